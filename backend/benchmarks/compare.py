@@ -0,0 +1,87 @@
+"""
+Normalize benchmark results and compare them with the stored baseline.
+
+Accepts pytest-benchmark JSON (`--benchmark-json`) and load test JSON (`--load-json`) files and turns them
+into one results document:
+
+    {"benchmarks": {"<name>": {"median_s": ..., "ops": ..., "iqr_s" or "p95_s": ...}}}
+
+A benchmark regresses when its median latency grows by more than the threshold relative to the baseline.
+
+    python backend/benchmarks/compare.py micro.json load.json                    # exit 1 on regression
+    python backend/benchmarks/compare.py micro.json load.json --update-baseline  # store as the baseline
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def normalize(paths: list[str]) -> dict[str, dict]:
+    benchmarks = {}
+    for path in paths:
+        with open(path) as file:
+            document = json.load(file)
+        for entry in document.get("benchmarks", []):
+            stats = entry["stats"]
+            benchmarks[entry["fullname"].split("::", 1)[-1]] = {
+                "median_s": stats["median"],
+                "iqr_s": stats["iqr"],
+                "ops": stats["ops"],
+            }
+        for name, stats in document.get("load", {}).items():
+            benchmarks[f"load[{name}]"] = {"median_s": stats["p50_s"], "p95_s": stats["p95_s"], "ops": stats["rps"]}
+    return benchmarks
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """Print a comparison table and return the names of the regressed benchmarks."""
+    regressions = []
+    print(f"{'benchmark':<60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, stats in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:<60} {'-':>12} {stats['median_s'] * 1000:>10.3f}ms {'new':>8}")
+            continue
+        change = stats["median_s"] / reference["median_s"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<60} {reference['median_s'] * 1000:>10.3f}ms {stats['median_s'] * 1000:>10.3f}ms "
+            f"{change:>+7.1%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("results", nargs="+", help="pytest-benchmark or load test JSON files")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown of the median")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = normalize(args.results)
+    if args.update_baseline:
+        document = {"machine": platform.platform(), "python": platform.python_version(), "benchmarks": results}
+        with open(args.baseline, "w") as file:
+            json.dump(document, file, indent=2, sort_keys=True)
+        print(f"Stored {len(results)} benchmarks in {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}; run with --update-baseline first.")
+    with open(args.baseline) as file:
+        baseline = json.load(file)["benchmarks"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        sys.exit(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark fixtures. The service modules are fed synthetic data instead of the files under backend/data,
+and the CRUD benchmarks run against a throwaway SQLite database. Run from the repository root, like the service:
+
+    pytest backend/benchmarks --benchmark-json=micro.json --load-json=load.json
+    python backend/benchmarks/compare.py micro.json load.json
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+# must be set before app.db.database is imported
+_db_dir = tempfile.mkdtemp(prefix="benchmarks-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'benchmarks.db')}")
+
+import synthetic  # noqa: E402
+
+load_results: dict[str, dict] = {}
+
+
+def pytest_addoption(parser):
+    parser.addoption("--load-json", default=None, help="Write the in-process load test results to this file")
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("--load-json")
+    if path and load_results:
+        with open(path, "w") as file:
+            json.dump({"load": load_results}, file, indent=2)
+
+
+@pytest.fixture(scope="session")
+def models():
+    from app.core import model
+
+    fitted = synthetic.make_models()
+    model.models.update(fitted)
+    return fitted
+
+
+@pytest.fixture(scope="session", params=synthetic.SCALES, ids=lambda rows: f"{rows}rows")
+def prices(request):
+    from app.core import data
+
+    return data.set_data(synthetic.make_prices(request.param))
+
+
+@pytest.fixture(scope="session")
+def eligibility_tables():
+    from app.core import eligibility
+
+    eligibility.facility_eligibility_table = synthetic.make_facility_table(200)
+    eligibility.land_eligibility_table = synthetic.make_land_table(50)
+    return eligibility.facility_eligibility_table, eligibility.land_eligibility_table
+
+
+@pytest.fixture(scope="session")
+def geo_tables():
+    from app.core import geo
+
+    geo.stations = geo.Stations(synthetic.make_stations(300))
+    geo.okrugs = geo.Okrugs(synthetic.make_okrugs())
+    return geo.stations, geo.okrugs
+
+
+@pytest.fixture(scope="session")
+def database():
+    from app.db.database import create_tables
+
+    create_tables()
+
+
+@pytest.fixture(scope="session")
+def listings_table(prices, database):
+    """The price dataset of the current scale, loaded into the listings table."""
+    from app.db import listings
+    from app.db.database import get_enginge
+    from sqlalchemy import text
+
+    listings.create_spatial_index()
+    with get_enginge().begin() as connection:
+        connection.execute(text("DELETE FROM listings"))
+    path = os.path.join(_db_dir, "listings.csv")
+    prices.to_csv(path, index=False)
+    listings.load_csv(path)
+    return prices
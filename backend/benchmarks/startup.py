@@ -0,0 +1,97 @@
+"""
+Startup benchmark: import time and peak RSS of each router, measured with `python -X importtime`.
+
+Every router is imported in a fresh interpreter, so the numbers reflect what a process serving
+only that router pays before it can bind. Run from the repository root:
+
+    python backend/benchmarks/startup.py
+    python backend/benchmarks/startup.py --warmup --json startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROUTERS = ["health", "users", "items", "model", "eligibility", "data"]
+
+# Modules a router pulls in only when its resources are loaded during warmup
+WARMUP_MODULES = {
+    "model": "app.core.model",
+    "eligibility": "app.core.eligibility",
+    "data": "app.core.data",
+}
+
+# Libraries that should only be imported by the routers that need them
+HEAVY_PACKAGES = ["pandas", "numpy", "xgboost", "sklearn", "geopy", "openpyxl", "sqlalchemy"]
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+PROBE = "import resource, {module}; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def parse_importtime(stderr: str) -> tuple[int, dict[str, int]]:
+    """
+    Parse `-X importtime` output.
+    Returns:
+        The total self time of all imports and the cumulative time of every top-level package, in microseconds.
+    """
+    total_us = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total_us += int(self_us)
+        name = name.strip()
+        if "." not in name:
+            packages[name] = max(packages.get(name, 0), int(cumulative_us))
+    return total_us, packages
+
+
+def measure(module: str) -> dict:
+    """Import a module in a fresh interpreter and report its import time, heaviest dependencies and RSS."""
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    # the database module refuses to import without connection settings; nothing connects here
+    for variable in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD"):
+        env.setdefault(variable, "benchmark")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        capture_output=True, text=True, env=env, check=True
+    )
+    total_us, packages = parse_importtime(result.stderr)
+    packages.pop(module.split(".")[0], None)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "module": module,
+        "import_ms": total_us / 1000,
+        "max_rss_mb": int(result.stdout.strip().splitlines()[-1]) / 1024,
+        "heaviest_ms": {name: cumulative / 1000 for name, cumulative in heaviest},
+        "heavy_packages": [name for name in HEAVY_PACKAGES if name in packages],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--warmup", action="store_true", help="Also measure the modules loaded during warmup")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = [measure("fastapi")]
+    results += [measure(f"app.api.routes.{router}") for router in ROUTERS]
+    if args.warmup:
+        results += [measure(module) for module in WARMUP_MODULES.values()]
+
+    for result in results:
+        heavy = ", ".join(result["heavy_packages"]) or "-"
+        print(f"{result['module']:<32} {result['import_ms']:>9.1f} ms {result['max_rss_mb']:>8.1f} MB  heavy: {heavy}")
+        for name, milliseconds in list(result["heaviest_ms"].items())[:3]:
+            print(f"    {name:<28} {milliseconds:>9.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Deterministic synthetic data for the benchmarks: price listings, eligibility tables, requests and models."""
+import numpy as np
+import pandas as pd
+from app.api import schemas
+from app.core.eligibility import facility_column_mapping, land_column_mapping
+
+# Rows in the price dataset at each benchmark scale
+SCALES = [1_000, 10_000, 100_000]
+
+MOSCOW_BOUNDS = (55.55, 55.95, 37.35, 37.85)
+
+CONDITIONS = ["Типовой ремонт", "Под чистовую отделку", "Дизайнерский ремонт"]
+OKRUGS = ["ЦАО", "ЗАО", "ВАО", "САО", "ЮАО"]
+METROS = ["Полянка", "Коммунарка", "Белорусская", "Курская", "Тульская"]
+TRANSPORTS = ["пешком", "транспортом"]
+CATEGORIES = ["Офис (продажа)", "Помещение свободного назначения (продажа)"]
+
+NUMERIC_FEATURES = ['общая площадь', 'этаж', 'время до станции', 'Этажность дома', 'широта', 'долгота']
+FEATURES = (
+    NUMERIC_FEATURES
+    + [f"состояние_{value}" for value in CONDITIONS]
+    + [f"округ_{value}" for value in OKRUGS]
+    + [f"метро_{value}" for value in METROS]
+    + [f"пешком/транспортом_{value}" for value in TRANSPORTS]
+    + [f"категория объявления_{value}" for value in CATEGORIES]
+    + ["distance_from_center"]
+)
+
+
+def make_prices(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Listings spread uniformly over Moscow, with the columns of prices.csv."""
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = MOSCOW_BOUNDS
+    return pd.DataFrame({
+        "price_per_meter": rng.lognormal(12.5, 0.4, rows).round(),
+        "latitude": rng.uniform(min_lat, max_lat, rows).round(5),
+        "longitude": rng.uniform(min_lon, max_lon, rows).round(5),
+    })
+
+
+def make_stations(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Metro stations spread uniformly over Moscow, every fifth one a second platform of an interchange."""
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = MOSCOW_BOUNDS
+    names = [f"станция {index - index % 5 if index % 5 == 1 else index}" for index in range(rows)]
+    return pd.DataFrame({
+        "name": names,
+        "latitude": rng.uniform(min_lat, max_lat, rows),
+        "longitude": rng.uniform(min_lon, max_lon, rows),
+    })
+
+
+def make_okrugs(vertices: int = 400) -> list[dict]:
+    """GeoJSON features of sectors of a disc around the center of Moscow, one per okrug, with wavy outer arcs."""
+    min_lat, max_lat, min_lon, max_lon = MOSCOW_BOUNDS
+    center = ((min_lon + max_lon) / 2, (min_lat + max_lat) / 2)
+    bounds = np.linspace(0, 2 * np.pi, len(OKRUGS) + 1)
+    features = []
+    for name, start, stop in zip(OKRUGS, bounds[:-1], bounds[1:]):
+        angles = np.linspace(start, stop, vertices)
+        radii = 0.18 + 0.02 * np.sin(angles * 40)
+        arc = np.column_stack([center[0] + radii * np.cos(angles), center[1] + 0.6 * radii * np.sin(angles)])
+        ring = np.vstack([center, arc, center]).tolist()
+        features.append({"type": "Feature", "properties": {"name": name}, "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    return features
+
+
+def make_polygon(vertices: int, seed: int = 0) -> list[tuple[float, float]]:
+    """A closed ring of (longitude, latitude) vertices: a jagged star over the center of Moscow, like a drawn area."""
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = MOSCOW_BOUNDS
+    angles = np.sort(rng.uniform(0, 2 * np.pi, vertices))
+    radii = 0.6 + 0.4 * rng.random(vertices)
+    ring = np.column_stack([
+        (min_lon + max_lon) / 2 + radii * np.cos(angles) * (max_lon - min_lon) / 4,
+        (min_lat + max_lat) / 2 + radii * np.sin(angles) * (max_lat - min_lat) / 4,
+    ])
+    return [tuple(vertex) for vertex in np.vstack([ring, ring[:1]])]
+
+
+def _flags(rng, rows: int) -> np.ndarray:
+    """Boolean criteria as in the Excel tables: True or missing."""
+    return np.where(rng.random(rows) < 0.3, True, None)
+
+
+def make_facility_table(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    table = pd.DataFrame({column: _flags(rng, rows) for column in facility_column_mapping.values()})
+    min_area = rng.choice([15.0, 40.0, 80.0, 200.0, 1000.0], rows)
+    min_floor = rng.choice([0.0, 1.0, np.nan], rows)
+    table["chain"] = [f"chain {index}" for index in range(rows)]
+    table["category"] = rng.choice(["Аптеки", "Кофейни", "Супермаркеты"], rows)
+    table["min_area"] = min_area
+    table["max_area"] = np.where(rng.random(rows) < 0.8, min_area * rng.uniform(1.5, 10, rows), np.nan)
+    table["min_ceiling_height"] = rng.choice([np.nan, 3.0, 4.0], rows)
+    table["min_floor"] = min_floor
+    table["max_floor"] = min_floor + rng.choice([0.0, 1.0, 2.0], rows)
+    return table
+
+
+def make_land_table(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    table = pd.DataFrame({column: _flags(rng, rows) for column in land_column_mapping.values()})
+    min_area = rng.choice([500.0, 1500.0, 3000.0, 40000.0], rows)
+    table["chain"] = [f"chain {index}" for index in range(rows)]
+    table["category"] = rng.choice(["Супермаркеты", "Общепит"], rows)
+    table["min_area"] = min_area
+    table["max_area"] = np.where(rng.random(rows) < 0.8, min_area * rng.uniform(1.5, 10, rows), np.nan)
+    return table
+
+
+def make_prediction_requests(rows: int, model: str = "xgb_1", seed: int = 0) -> list[schemas.PredictionRequest]:
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = MOSCOW_BOUNDS
+    return [
+        schemas.PredictionRequest(
+            metro=str(rng.choice(METROS)),
+            okrug=str(rng.choice(OKRUGS)),
+            city="Москва",
+            category=str(rng.choice(CATEGORIES)),
+            condition=str(rng.choice(CONDITIONS)),
+            area=float(rng.uniform(20, 500)),
+            floor=int(rng.integers(0, 20)),
+            total_floors=int(rng.integers(1, 25)),
+            time_to_station=int(rng.integers(1, 30)),
+            transport=str(rng.choice(TRANSPORTS)),
+            latitude=float(rng.uniform(min_lat, max_lat)),
+            longitude=float(rng.uniform(min_lon, max_lon)),
+            model=model,
+        )
+        for _ in range(rows)
+    ]
+
+
+def make_facility_requests(rows: int, seed: int = 0) -> list[schemas.FacilityEligibilityRequest]:
+    rng = np.random.default_rng(seed)
+    flags = [
+        "near_residential_area", "high_pedestrian_traffic", "high_vehicle_traffic", "nearby_facilities",
+        "utilities", "sanitary_facility", "expected_visitors", "cargo_unloading", "parking_available",
+    ]
+    return [
+        schemas.FacilityEligibilityRequest(
+            total_area=int(rng.integers(10, 2000)),
+            floor=int(rng.integers(0, 4)),
+            ceiling_height=int(rng.integers(2, 6)),
+            **{flag: bool(rng.random() < 0.5) for flag in flags},
+        )
+        for _ in range(rows)
+    ]
+
+
+def make_land_requests(rows: int, seed: int = 0) -> list[schemas.LandEligibilityRequest]:
+    rng = np.random.default_rng(seed)
+    return [
+        schemas.LandEligibilityRequest(
+            total_area=int(rng.integers(100, 50000)),
+            near_residential_area=bool(rng.random() < 0.5),
+            high_vehicle_traffic=bool(rng.random() < 0.5),
+            utilities=bool(rng.random() < 0.5),
+        )
+        for _ in range(rows)
+    ]
+
+
+def make_models(rows: int = 2_000, seed: int = 0) -> dict:
+    """Small XGBoost and MLP regressors fitted on random features with the production feature names."""
+    from sklearn.neural_network import MLPRegressor
+    from xgboost import XGBRegressor
+
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.random((rows, len(FEATURES))), columns=FEATURES)
+    target = rng.lognormal(12.5, 0.4, rows)
+    return {
+        "xgb_1": XGBRegressor(n_estimators=100, max_depth=6).fit(features, target),
+        "mlp_1": MLPRegressor(hidden_layer_sizes=(64,), max_iter=20).fit(features, target),
+    }
@@ -0,0 +1,187 @@
+import itertools
+import uuid
+
+import numpy as np
+import pytest
+import synthetic
+
+
+@pytest.mark.parametrize("model_name", ["xgb_1", "mlp_1"])
+def test_predict_user_input(benchmark, models, model_name):
+    from app.core.model import predict_user_input
+
+    requests = itertools.cycle(synthetic.make_prediction_requests(100, model=model_name))
+    benchmark(lambda: predict_user_input(next(requests)))
+
+
+@pytest.mark.parametrize("model_name", ["xgb_1", "mlp_1"])
+def test_predict_grid(benchmark, models, model_name):
+    from app.api import schemas
+    from app.core.surface import predict_grid
+
+    base = synthetic.make_prediction_requests(1, model=model_name)[0]
+    min_lat, max_lat, min_lon, max_lon = synthetic.MOSCOW_BOUNDS
+    bbox = schemas.BoundingBox(min_latitude=min_lat, max_latitude=max_lat, min_longitude=min_lon, max_longitude=max_lon)
+    benchmark.extra_info["cells"] = 200 * 200
+    benchmark(predict_grid, base, bbox, 200)
+
+
+@pytest.mark.parametrize("model_name", ["xgb_1", "mlp_1"])
+def test_explain(benchmark, models, model_name):
+    from app.core.explain import explain, explainer
+
+    requests = itertools.cycle(synthetic.make_prediction_requests(100, model=model_name))
+    explainer(model_name)
+    benchmark(lambda: explain(next(requests)))
+
+
+@pytest.mark.parametrize("radius", [None, 1.0])
+def test_score_frame(benchmark, models, prices, radius):
+    import pandas as pd
+    from app.batch import score_frame
+
+    listings = pd.DataFrame([request.dict() for request in synthetic.make_prediction_requests(5_000)])
+    benchmark.extra_info["listings"] = len(listings)
+    benchmark(score_frame, listings, radius=radius)
+
+
+@pytest.mark.parametrize("radius", [0.5, 2.0])
+def test_get_prices_within_radius(benchmark, prices, radius):
+    from app.core.data import get_prices_within_radius
+
+    benchmark.extra_info["rows"] = len(prices)
+    result = benchmark(get_prices_within_radius, 55.75, 37.62, radius)
+    benchmark.extra_info["matches"] = len(result)
+
+
+@pytest.mark.parametrize("radius", [0.5, 2.0])
+def test_listings_within_radius(benchmark, listings_table, radius):
+    from app.db.listings import within_radius
+
+    benchmark.extra_info["rows"] = len(listings_table)
+    result = benchmark(within_radius, 55.75, 37.62, radius)
+    benchmark.extra_info["matches"] = len(result)
+
+
+@pytest.mark.parametrize("vertices", [10, 5_000])
+def test_select_within_polygon(benchmark, prices, vertices):
+    from app.core.data import select_within_polygon
+    from app.core.geo import PreparedPolygon, ring_edges
+
+    ring = synthetic.make_polygon(vertices)
+    benchmark.extra_info["rows"] = len(prices)
+    result = benchmark(lambda: select_within_polygon(PreparedPolygon(ring_edges([ring]))))
+    benchmark.extra_info["matches"] = len(result)
+
+
+@pytest.mark.parametrize("vertices", [10, 5_000])
+def test_listings_within_polygon(benchmark, listings_table, vertices):
+    from app.db.listings import within_polygon
+    from app.core.geo import PreparedPolygon, ring_edges
+
+    polygon = PreparedPolygon(ring_edges([synthetic.make_polygon(vertices)]))
+    benchmark.extra_info["rows"] = len(listings_table)
+    result = benchmark(within_polygon, polygon)
+    benchmark.extra_info["matches"] = len(result)
+
+
+@pytest.mark.parametrize("points", [1, 10_000])
+def test_geo_resolve(benchmark, geo_tables, points):
+    from app.core.geo import resolve
+
+    min_lat, max_lat, min_lon, max_lon = synthetic.MOSCOW_BOUNDS
+    rng = np.random.default_rng(0)
+    latitudes, longitudes = rng.uniform(min_lat, max_lat, points), rng.uniform(min_lon, max_lon, points)
+    benchmark(resolve, latitudes, longitudes)
+
+
+@pytest.mark.parametrize("evaluator", ["rows", "compiled"])
+def test_check_eligibility_facility(benchmark, eligibility_tables, monkeypatch, evaluator):
+    from app.core import eligibility
+    from app.core.eligibility import check_eligibility_facility
+
+    monkeypatch.setattr(eligibility, "evaluator", evaluator)
+    requests = itertools.cycle(synthetic.make_facility_requests(100))
+    benchmark(lambda: check_eligibility_facility(next(requests)))
+
+
+@pytest.mark.parametrize("evaluator", ["rows", "compiled"])
+def test_check_eligibility_land(benchmark, eligibility_tables, monkeypatch, evaluator):
+    from app.core import eligibility
+    from app.core.eligibility import check_eligibility_land
+
+    monkeypatch.setattr(eligibility, "evaluator", evaluator)
+    requests = itertools.cycle(synthetic.make_land_requests(100))
+    benchmark(lambda: check_eligibility_land(next(requests)))
+
+
+def test_crud_create_user(benchmark, database):
+    from app.db import crud
+
+    benchmark(lambda: crud.create_user(uuid.uuid4().hex))
+
+
+def test_crud_read_user(benchmark, database):
+    from app.db import crud
+
+    user = crud.create_user(uuid.uuid4().hex)
+    benchmark(crud.read_user, user.id)
+
+
+def test_crud_create_item(benchmark, database):
+    from app.db import crud
+
+    user = crud.create_user(uuid.uuid4().hex)
+    benchmark(crud.create_item, user.id, "title", "description")
+
+
+def test_crud_get_user_items(benchmark, database):
+    from app.db import crud
+
+    user = crud.create_user(uuid.uuid4().hex)
+    for index in range(100):
+        crud.create_item(user.id, f"title {index}", "description")
+    benchmark(crud.get_user_items, user.id)
+
+
+def test_crud_create_and_delete_item(benchmark, database):
+    from app.db import crud
+
+    user = crud.create_user(uuid.uuid4().hex)
+
+    def create_and_delete():
+        item = crud.create_item(user.id, "title", "description")
+        crud.delete_item(user.id, item.id)
+
+    benchmark(create_and_delete)
+
+
+BULK_ROWS = 1_000
+
+
+def test_crud_create_items_one_by_one(benchmark, database):
+    from app.db import crud
+
+    user = crud.create_user(uuid.uuid4().hex)
+    benchmark.extra_info["rows"] = BULK_ROWS
+    benchmark.pedantic(
+        lambda: [crud.create_item(user.id, f"title {index}", "description") for index in range(BULK_ROWS)],
+        rounds=3,
+    )
+
+
+@pytest.mark.parametrize("batch_size", [100, 1_000])
+def test_crud_bulk_create_items(benchmark, database, batch_size):
+    from app.db import crud
+
+    user = crud.create_user(uuid.uuid4().hex)
+    items = [{"title": f"title {index}", "description": "description"} for index in range(BULK_ROWS)]
+    benchmark.extra_info["rows"] = BULK_ROWS
+    benchmark(crud.bulk_create_items, user.id, items, batch_size)
+
+
+def test_crud_bulk_create_users(benchmark, database):
+    from app.db import crud
+
+    benchmark.extra_info["rows"] = BULK_ROWS
+    benchmark(lambda: crud.bulk_create_users([uuid.uuid4().hex for _ in range(BULK_ROWS)]))
@@ -0,0 +1,73 @@
+"""
+In-process ASGI load test: concurrent clients drive the FastAPI app through httpx without a network hop.
+Reported per endpoint: throughput and latency percentiles, collected into the `--load-json` results.
+"""
+import asyncio
+import time
+import uuid
+
+import numpy as np
+import pytest
+import synthetic
+from conftest import load_results
+
+CONCURRENCY = 16
+REQUESTS = 400
+
+PAYLOADS = {
+    "predict": ("POST", "/model/predict/", lambda: synthetic.make_prediction_requests(1)[0].dict()),
+    "prices_in_radius": ("POST", "/data/prices_in_radius", lambda: {"latitude": 55.75, "longitude": 37.62, "radius": 1.0}),
+    "check_facility": ("POST", "/eligibility/check/facility", lambda: synthetic.make_facility_requests(1)[0].dict()),
+    "check_land": ("POST", "/eligibility/check/land", lambda: synthetic.make_land_requests(1)[0].dict()),
+    "create_user": ("POST", "/users/", lambda: {"name": uuid.uuid4().hex}),
+    "list_users": ("GET", "/users/", lambda: None),
+}
+
+
+@pytest.fixture(scope="module")
+def app(models, eligibility_tables, database):
+    from app.api.main import create_app
+    from app.core import data
+
+    data.set_data(synthetic.make_prices(10_000))
+    application = create_app("./backend/src/app/conf/config.yaml")
+    application.state.startup.ready = True
+    return application
+
+
+async def _drive(app, method: str, url: str, payload) -> list[float]:
+    import httpx
+
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(REQUESTS):
+        queue.put_nowait(payload())
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker():
+            while not queue.empty():
+                body = queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code < 500, response.text
+
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return latencies
+
+
+@pytest.mark.parametrize("endpoint", list(PAYLOADS))
+def test_load(app, endpoint):
+    method, url, payload = PAYLOADS[endpoint]
+    start = time.perf_counter()
+    latencies = np.array(asyncio.run(_drive(app, method, url, payload)))
+    elapsed = time.perf_counter() - start
+    load_results[endpoint] = {
+        "requests": len(latencies),
+        "concurrency": CONCURRENCY,
+        "rps": len(latencies) / elapsed,
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p95_s": float(np.percentile(latencies, 95)),
+        "p99_s": float(np.percentile(latencies, 99)),
+    }
+    print(endpoint, load_results[endpoint])
@@ -0,0 +1,35 @@
+"""
+Serialization of /data/prices_in_radius sized responses: the default FastAPI path (jsonable_encoder plus json)
+against orjson on records and on raw numpy columns, and the chunked NDJSON stream.
+"""
+import json
+
+import pytest
+import synthetic
+from app.api.responses import _ndjson_lines, frame_response
+from app.core.data import CHUNK_ROWS
+from fastapi.encoders import jsonable_encoder
+
+ROWS = [10_000, 100_000]
+
+
+@pytest.fixture(scope="module", params=ROWS, ids=lambda rows: f"{rows}rows")
+def frame(request):
+    return synthetic.make_prices(request.param)
+
+
+def test_stdlib_json(benchmark, frame):
+    benchmark(lambda: json.dumps(jsonable_encoder(frame.to_dict("records"))).encode())
+
+
+def test_orjson_records(benchmark, frame):
+    benchmark(lambda: frame_response(frame, "records").body)
+
+
+def test_orjson_columns(benchmark, frame):
+    benchmark(lambda: frame_response(frame, "columns").body)
+
+
+def test_ndjson_stream(benchmark, frame):
+    chunks = [frame.iloc[offset:offset + CHUNK_ROWS] for offset in range(0, len(frame), CHUNK_ROWS)]
+    benchmark(lambda: sum(len(lines) for lines in _ndjson_lines(chunks)))
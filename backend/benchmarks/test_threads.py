@@ -0,0 +1,52 @@
+"""
+Prediction latency against native thread settings: threads per model and BLAS/OpenMP pool size, times the
+number of request threads calling the model at once. The per-call p50 and p99 are kept in `extra_info`.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import synthetic
+
+REQUESTS = 64
+
+
+@pytest.mark.parametrize("concurrency", [1, 8])
+@pytest.mark.parametrize("threads", [1, 2, 4])
+@pytest.mark.parametrize("model_name", ["xgb_1", "mlp_1"])
+def test_predict_threads(benchmark, models, model_name, threads, concurrency):
+    from app.core import runtime
+    from app.core.model import predict_user_input
+    from threadpoolctl import threadpool_limits
+
+    requests = synthetic.make_prediction_requests(REQUESTS, model=model_name)
+    latencies = []
+
+    def timed_predict(request):
+        start = time.perf_counter()
+        predict_user_input(request)
+        latencies.append(time.perf_counter() - start)
+
+    def run():
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(timed_predict, requests))
+
+    model = models[model_name]
+    default_jobs = getattr(model, "n_jobs", None)
+    runtime.model_threads = {model_name: threads}
+    runtime.configure_model(model_name, model)
+    try:
+        with threadpool_limits(limits=threads):
+            benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    finally:
+        runtime.model_threads = {}
+        if hasattr(model, "get_booster"):
+            model.set_params(n_jobs=default_jobs)
+
+    benchmark.extra_info.update({
+        "requests": REQUESTS,
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p99_s": float(np.percentile(latencies, 99)),
+    })
+
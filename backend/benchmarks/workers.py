@@ -0,0 +1,110 @@
+"""
+Throughput of the production launcher against the number of workers.
+
+For every worker count a server is started with `python -m app.api.serve` on the resources configured in
+config.yaml, driven over HTTP by concurrent clients for a fixed time, then stopped. Run from the repository root:
+
+    python backend/benchmarks/workers.py --workers 1 2 4 --duration 20 --json workers.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+ENDPOINTS = {
+    "predict": ("/model/predict/", {
+        "metro": "Коммунарка", "okrug": "ЦАО", "city": "Москва", "category": "Офис (продажа)",
+        "condition": "Типовой ремонт", "area": 50, "floor": 2, "total_floors": 5, "time_to_station": 5,
+        "transport": "пешком", "latitude": 55.75, "longitude": 37.6, "model": "xgb_1",
+    }),
+    "prices_in_radius": ("/data/prices_in_radius", {"latitude": 55.75, "longitude": 37.62, "radius": 1.0}),
+}
+
+
+def start_server(workers: int, threads: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=os.path.join("backend", "src"))
+    command = [
+        sys.executable, "-m", "app.api.serve", "--workers", str(workers), "--threads-per-worker", str(threads),
+        "--port", str(port), "--host", "127.0.0.1",
+    ]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url: str, workers: int, timeout: float = 120) -> None:
+    """Wait until enough consecutive /readyz calls succeed to have most likely reached every worker."""
+    deadline = time.monotonic() + timeout
+    successes = 0
+    while successes < 4 * workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{url} did not become ready")
+        try:
+            successes = successes + 1 if httpx.get(f"{url}/readyz").status_code == 200 else 0
+        except httpx.TransportError:
+            successes = 0
+            time.sleep(0.5)
+
+
+async def drive(url: str, path: str, payload: dict, concurrency: int, duration: float) -> dict:
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post(path, json=payload)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p95_s": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads-per-worker", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per endpoint")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'workers':>7} {'endpoint':<20} {'rps':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for workers in args.workers:
+        url = f"http://127.0.0.1:{args.port}"
+        server = start_server(workers, args.threads_per_worker, args.port)
+        try:
+            wait_ready(url, workers)
+            for endpoint, (path, payload) in ENDPOINTS.items():
+                stats = asyncio.run(drive(url, path, payload, args.concurrency, args.duration))
+                results[f"{endpoint}[{workers}workers]"] = {"workers": workers, **stats}
+                print(
+                    f"{workers:>7} {endpoint:<20} {stats['rps']:>10.1f} "
+                    f"{stats['p50_s'] * 1000:>10.1f} {stats['p95_s'] * 1000:>10.1f}"
+                )
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"workers": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
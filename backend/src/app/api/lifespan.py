@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from app.core import metrics, runtime
+from fastapi import FastAPI
+
+logger = logging.getLogger(__name__)
+
+# Resources loaded by `preload` in a server master process; forked workers inherit them and skip loading
+preloaded: dict[str, float] = {}
+
+
+class StartupState:
+    """Readiness of the service and the time spent bringing each resource up."""
+
+    def __init__(self):
+        self.created_at = time.perf_counter()
+        self.ready = False
+        self.cold_start_seconds: Optional[float] = None
+        self.load_seconds: dict[str, float] = {}
+        self.warmup_seconds: dict[str, float] = {}
+        self.errors: dict[str, str] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "cold_start_seconds": self.cold_start_seconds,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "errors": self.errors,
+        }
+
+
+def _timed(action: str, name: str, func: Callable, durations: dict[str, float], errors: dict[str, str]) -> None:
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        logger.exception(f"Failed to {action} {name}")
+        errors[name] = str(e)
+    finally:
+        durations[name] = time.perf_counter() - start
+        logger.info(f"{action.capitalize()} {name} in {durations[name]:.3f}s")
+
+
+def _router_enabled(config, name: str) -> bool:
+    routers = config.api.get("routers")
+    return routers is None or name in routers
+
+
+def _resource_loaders(config) -> dict[str, Callable]:
+    """
+    Map every resource needed by the enabled routers to the function that loads it.
+    The heavy modules are imported here, during warmup, rather than when the routers are imported.
+    """
+    resources = config.resources
+    loaders = {}
+    if _router_enabled(config, "data") or _router_enabled(config, "model"):
+        from app.core import shards
+        from omegaconf import OmegaConf
+
+        # the other cities are loaded on their first request
+        shards.configure(OmegaConf.to_container(config.get("cities", {})))
+    if _router_enabled(config, "data") and config.get("data", {}).get("store", "memory") == "memory":
+        from app.core import data
+
+        loaders["prices"] = lambda: data.load_data(resources.prices, resources.get("prices_journal"))
+    if _router_enabled(config, "eligibility"):
+        from app.core import eligibility, rules
+        from omegaconf import OmegaConf
+
+        eligibility.configure(config.get("eligibility", {}))
+        rules.configure(config.get("eligibility", {}))
+        entries = OmegaConf.to_container(config.get("service", {}).get("eligibility", {}))
+        loaders["eligibility_rules"] = lambda: rules.load_rules(resources.facility, resources.land, entries)
+    if _router_enabled(config, "geo") or _router_enabled(config, "model"):
+        from app.core import geo
+
+        # optional tables, without them requests have to name their station and okrug
+        if resources.get("metro_stations"):
+            loaders["metro_stations"] = lambda: geo.load_stations(resources.metro_stations)
+        if resources.get("okrugs"):
+            loaders["okrugs"] = lambda: geo.load_okrugs(resources.okrugs)
+    if _router_enabled(config, "model"):
+        from app.core import explain, model
+
+        explain.configure(config.get("explain", {}))
+
+        for model_name, model_path in resources.models.items():
+            loaders[f"model:{model_name}"] = lambda name=model_name, path=model_path: model.load_model(name, path)
+    return loaders
+
+
+def preload(config) -> dict[str, str]:
+    """
+    Load every resource in the current process before workers are forked from it, so that the workers share
+    the loaded models and tables through copy-on-write instead of each holding a copy.
+    Warmup predictions are left to the workers: running OpenMP code before a fork can deadlock the children.
+    Returns:
+        dict[str, str]: The resources that failed to load, with their errors.
+    """
+    errors: dict[str, str] = {}
+    for name, loader in _resource_loaders(config).items():
+        _timed("preload", name, loader, preloaded, errors)
+    for name in errors:
+        preloaded.pop(name, None)
+    runtime.limit_loaded_pools()
+    return errors
+
+
+def refresh_rules(config_path: str) -> None:
+    """
+    Serve the eligibility rules of the current sources in a worker forked with preloaded rules. After a SIGHUP the
+    master forks the new workers with the rules it preloaded at its own start, from the config.yaml of that time.
+    """
+    from app.core import rules
+    from omegaconf import OmegaConf
+
+    config = OmegaConf.load(config_path)
+    try:
+        _, changed = rules.reload(OmegaConf.to_container(config.get("service", {}).get("eligibility", {})))
+    except ValueError:
+        logger.exception("Failed to reload the edited eligibility rules, serving the preloaded ones")
+        return
+    if changed:
+        logger.info("Serving eligibility rules edited since the master preloaded them")
+
+
+async def warmup(app: FastAPI) -> None:
+    """Load all resources concurrently, then run a warmup prediction for each model."""
+    state: StartupState = app.state.startup
+    start = time.perf_counter()
+    if preloaded:
+        # the app was created in the master long before this worker was forked
+        state.created_at = start
+    loaders = await asyncio.to_thread(_resource_loaders, app.state.config)
+    state.load_seconds["imports"] = time.perf_counter() - start
+    for name in preloaded.keys() & loaders.keys():
+        del loaders[name]
+        state.load_seconds[name] = 0.0
+    if "eligibility_rules" in preloaded and _router_enabled(app.state.config, "eligibility"):
+        await asyncio.to_thread(
+            _timed, "refresh", "eligibility_rules", lambda: refresh_rules(app.state.config_path), state.load_seconds,
+            state.errors,
+        )
+    await asyncio.gather(*(
+        asyncio.to_thread(_timed, "load", name, loader, state.load_seconds, state.errors)
+        for name, loader in loaders.items()
+    ))
+    runtime.limit_loaded_pools()
+    if _router_enabled(app.state.config, "model"):
+        from app.core import model
+
+        await asyncio.gather(*(
+            asyncio.to_thread(
+                _timed, "warm up", f"model:{model_name}", lambda name=model_name: model.warmup_model(name),
+                state.warmup_seconds, state.errors
+            )
+            for model_name in list(model.models)
+        ))
+
+    state.cold_start_seconds = time.perf_counter() - state.created_at
+    metrics.startup_seconds.set(state.cold_start_seconds, "cold_start", "service")
+    for phase, durations in (("load", state.load_seconds), ("warmup", state.warmup_seconds)):
+        for name, seconds in durations.items():
+            metrics.startup_seconds.set(seconds, phase, name)
+    state.ready = not state.errors
+    if state.ready:
+        logger.info(f"Service ready, cold start took {state.cold_start_seconds:.3f}s")
+    else:
+        logger.error(f"Service not ready after {state.cold_start_seconds:.3f}s: {state.errors}")
+
+
+async def start_jobs(app: FastAPI) -> None:
+    """
+    Start taking background jobs in this process, once it serves the models and tables they use.
+    The service stays ready without them: `/jobs` answers 503 and another process may run the jobs.
+    """
+    from app.core import jobs
+
+    try:
+        await asyncio.to_thread(jobs.start, app.state.config.get("jobs", {}))
+    except Exception:
+        logger.exception("Failed to start the background jobs")
+
+
+async def start_history(app: FastAPI) -> None:
+    """Start recording the predictions served; the service stays ready without it, only the history is lost."""
+    from app.core import history
+
+    try:
+        await asyncio.to_thread(history.start, app.state.config.get("history", {}))
+    except Exception:
+        logger.exception("Failed to start recording the prediction history")
+
+
+def _history_enabled(config) -> bool:
+    return _router_enabled(config, "model") and config.get("history", {}).get("enabled", False)
+
+
+async def start(app: FastAPI) -> None:
+    """Warm up, then start the background work; `/readyz` answers 503 until the warmup is done."""
+    await warmup(app)
+    if _router_enabled(app.state.config, "jobs"):
+        await start_jobs(app)
+    if _history_enabled(app.state.config):
+        await start_history(app)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # in the background, so that the server accepts connections meanwhile and the probes can tell a process
+    # that is starting from one that is down
+    startup = asyncio.create_task(start(app))
+    yield
+    if not startup.done():
+        startup.cancel()
+        # the loaders already running on threads finish on their own, nothing is started after them
+        await asyncio.gather(startup, return_exceptions=True)
+    if _history_enabled(app.state.config):
+        from app.core import history
+
+        # the records still buffered are written before the process exits
+        await asyncio.to_thread(history.stop)
+    if _router_enabled(app.state.config, "jobs"):
+        from app.core import jobs
+
+        # running jobs stop after their current chunk and are resumed by the next process
+        await asyncio.to_thread(jobs.stop)
@@ -1,14 +1,44 @@
+import importlib
 import logging
+from typing import Optional
 
 import uvicorn
 from fastapi import FastAPI
 from omegaconf import OmegaConf
-from app.api.routes import data, eligibility, items, model, users
-from app.db.database import create_tables
+from app.api.lifespan import StartupState, lifespan
+from app.api.middleware import AdmissionMiddleware, MetricsMiddleware
+from app.api.responses import ORJSONResponse
+from app.api.routes import health
+from app.api.routes import metrics as metrics_routes
+from app.core import admission, log, metrics, profiling, runtime
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Routers are imported only when enabled, so a process serving `/users` never pulls in pandas or the models
+ROUTERS = {
+    "users": "/users",
+    "items": "/items",
+    "model": "/model",
+    "eligibility": "/eligibility",
+    "data": "/data",
+    "geo": "/geo",
+    "jobs": "/jobs",
+    "admin": "/admin",
+}
+
+def create_database(config) -> None:
+    """Create the tables of the enabled routers, and the listings spatial index when `/data` queries the database."""
+    routers = set(config.api.get("routers", list(ROUTERS)))
+    if {"users", "items"} & routers:
+        from app.db.database import create_tables
+
+        create_tables()
+    if "data" in routers and config.get("data", {}).get("store", "memory") == "database":
+        from app.db.listings import create_spatial_index
+
+        create_spatial_index()
+
+
 def create_app(config_path: str = "src/app/conf/config.yaml") -> FastAPI:
     """
     Create a FastAPI application with the specified configuration.
@@ -18,24 +48,46 @@ def create_app(config_path: str = "src/app/conf/config.yaml") -> FastAPI:
     Returns:
         FastAPI: The FastAPI application instance.
     """
+    log.configure()
     config = OmegaConf.load(config_path)
 
-    api_router = FastAPI(title=config.api.title, description=config.api.description, version=config.api.version)
+    api_router = FastAPI(
+        title=config.api.title, description=config.api.description, version=config.api.version, lifespan=lifespan,
+        default_response_class=ORJSONResponse
+    )
+    api_router.state.config = config
+    api_router.state.config_path = config_path
+    api_router.state.startup = StartupState()
+
+    metrics.configure(config.get("metrics", {}))
+    profiling.configure(config.get("profiling", {}))
+    runtime.configure(config.get("runtime", {}))
+    admission.configure(config.get("admission", {}))
+    route_templates = {}
+    # added first, so that the requests it turns away are still timed by the metrics middleware around it
+    api_router.add_middleware(AdmissionMiddleware)
+    api_router.add_middleware(MetricsMiddleware, route_templates=route_templates)
+
+    def include_router(router, prefix: str = "", tags: Optional[list[str]] = None):
+        route_templates.update({route.endpoint: prefix + route.path for route in router.routes})
+        api_router.include_router(router, prefix=prefix, tags=tags)
 
-    api_router.include_router(users.router, prefix="/users", tags=["users"])
-    api_router.include_router(items.router, prefix="/items", tags=["items"])
-    api_router.include_router(model.router, prefix="/model", tags=["model"])
-    api_router.include_router(eligibility.router, prefix="/eligibility", tags=["eligibility"])
-    api_router.include_router(data.router, prefix="/data", tags=["data"])
+    include_router(health.router, tags=["health"])
+    include_router(metrics_routes.router, tags=["metrics"])
+    for name in config.api.get("routers", list(ROUTERS)):
+        module = importlib.import_module(f"app.api.routes.{name}")
+        include_router(module.router, prefix=ROUTERS[name], tags=[name])
 
     return api_router
 
 
 if __name__ == "__main__":
+    log.configure()
     config_path = "./backend/src/app/conf/config.yaml"
     config = OmegaConf.load(config_path)
-    create_tables()
+    create_database(config)
     app = create_app(config_path)
     logger.info("Starting the API server...")
-    uvicorn.run(app, host=config.api.host, port=config.api.port, log_level="info")
+    # without a log config of its own, uvicorn logs through the queue of app.core.log
+    uvicorn.run(app, host=config.api.host, port=config.api.port, log_level="info", log_config=None)
     logger.info("API server stopped.")
@@ -0,0 +1,74 @@
+import time
+
+from app.core import admission, metrics
+from starlette.responses import JSONResponse
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every HTTP request under its route template.
+    Args:
+        app: The wrapped ASGI application
+        route_templates: Maps endpoint functions to their full path templates, e.g. `/users/{user_id}`
+    """
+
+    def __init__(self, app, route_templates: dict):
+        self.app = app
+        self.route_templates = route_templates
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = self.route_templates.get(scope.get("endpoint"), "unmatched")
+            metrics.request_latency.observe(time.perf_counter() - start, scope["method"], route, status["code"])
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware holding the requests of the routes with admission limits until their route has a free slot.
+    The wait happens on the event loop, before the body is read and before a threadpool thread is taken; requests
+    that should not wait are answered at once with a 503 and a Retry-After.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope["type"] == "http":
+            path = scope["path"]
+            root_path = scope.get("root_path", "")
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+            limiter = admission.limiter_for(path)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire()
+        except admission.Rejected as e:
+            response = JSONResponse(
+                {"detail": f"{limiter.route} is overloaded ({e.reason}), retry in {e.retry_after}s."},
+                status_code=503, headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
@@ -0,0 +1,107 @@
+import io
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
+
+import orjson
+from app.core import metrics
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+if TYPE_CHECKING:
+    # main imports this module, and processes serving only `/users` never load pandas
+    import pandas as pd
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response encoded with orjson. NaN is written as null, numpy arrays and non-string keys are supported.
+    Returning it from a route skips the per-item `response_model` validation of FastAPI.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with metrics.stage("serialize"):
+            return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+def frame_response(frame: "pd.DataFrame", orient: str = "records") -> Response:
+    """
+    Serialize a DataFrame without building pydantic models for its rows.
+    Args:
+        frame: The rows to return
+        orient: `records` for a list of row objects, `columns` for one array per column
+
+    Returns:
+        Response: The encoded JSON response.
+    """
+    with metrics.stage("serialize"):
+        if orient == "columns":
+            content = {
+                column: values.to_numpy() if values.dtype.kind in "biuf" else values.tolist()
+                for column, values in frame.items()
+            }
+        else:
+            content = frame.to_dict("records")
+        body = orjson.dumps(content, option=ORJSON_OPTIONS)
+    return Response(body, media_type="application/json")
+
+
+def _ndjson_lines(chunks: Iterable["pd.DataFrame"]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield b"".join(orjson.dumps(row, option=ORJSON_OPTIONS) + b"\n" for row in chunk.to_dict("records"))
+
+
+def _arrow_batches(chunks: Iterable["pd.DataFrame"], schema) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    sink = io.BytesIO()
+
+    def drain() -> bytes:
+        payload = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return payload
+
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield drain()
+        for chunk in chunks:
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield drain()
+    yield drain()
+
+
+def frame_stream(chunks: Iterable["pd.DataFrame"], columns: "pd.DataFrame", media_type: str) -> StreamingResponse:
+    """
+    Stream DataFrame chunks as they are produced, as newline-delimited JSON or as an Arrow IPC stream.
+    Chunks are pulled one at a time while the client keeps up, so only one chunk is held in memory.
+    Args:
+        chunks: The rows to return, in chunks
+        columns: An empty frame with the columns and dtypes of the chunks, for the Arrow schema
+        media_type: `NDJSON_MEDIA_TYPE` or `ARROW_STREAM_MEDIA_TYPE`; the latter requires pyarrow
+
+    Returns:
+        StreamingResponse: The streamed response.
+    """
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        import pyarrow as pa
+
+        schema = pa.Schema.from_pandas(columns, preserve_index=False)
+        return StreamingResponse(_arrow_batches(chunks, schema), media_type=media_type)
+    return StreamingResponse(_ndjson_lines(chunks), media_type=media_type)
+
+
+def streaming_media_type(accept: str) -> str:
+    """
+    Pick the streamed format requested by an Accept header, or an empty string for a plain JSON response.
+    Raises ImportError when an Arrow stream is requested and pyarrow is not installed.
+    """
+    accepted = {part.split(";")[0].strip() for part in (accept or "").split(",")}
+    if ARROW_STREAM_MEDIA_TYPE in accepted:
+        import pyarrow  # noqa: F401
+
+        return ARROW_STREAM_MEDIA_TYPE
+    if NDJSON_MEDIA_TYPE in accepted:
+        return NDJSON_MEDIA_TYPE
+    return ""
@@ -0,0 +1,104 @@
+import hmac
+import os
+from typing import Optional
+
+from app.core import profiling, runtime
+from dotenv import find_dotenv, load_dotenv
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+
+load_dotenv(find_dotenv(usecwd=True))
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Only callers sending the ADMIN_TOKEN of the environment in X-Admin-Token; without one, the routes are closed."""
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="The admin routes are disabled: ADMIN_TOKEN is not set.")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="A valid X-Admin-Token header is required.")
+
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+
+@router.get("/profile")
+def get_profile_status():
+    return profiling.capture.status()
+
+
+@router.post("/profile/start")
+def start_profile(
+    duration: float = Query(30.0, gt=0, description="Seconds after which the capture stops on its own"),
+    interval: float = Query(None, gt=0, description="Seconds between two stack samples"),
+):
+    """Start sampling the stacks of every thread of this worker."""
+    try:
+        duration = profiling.capture.start(duration, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"Profiling for at most {duration:.0f} seconds.", **profiling.capture.status()}
+
+
+@router.post("/profile/stop", response_class=PlainTextResponse)
+def stop_profile():
+    """Stop the running capture and return its stacks in the folded flame graph format."""
+    stacks = profiling.capture.stop()
+    if stacks is None:
+        raise HTTPException(status_code=404, detail="No profile capture is running.")
+    return PlainTextResponse(profiling.to_folded(stacks))
+
+
+@router.get("/runtime")
+def get_runtime():
+    """Thread pool sizes, CPU affinity and per-model threads of this worker."""
+    return runtime.report()
+
+
+@router.get("/shards")
+def get_city_shards():
+    """The cities with shards of their own, the shards loaded in this worker and the memory they hold."""
+    from app.core import shards
+
+    return shards.status()
+
+
+@router.get("/admission")
+def get_admission():
+    """The limits of the routes under admission control, with the requests running and queued in this worker."""
+    from app.core import admission
+
+    return admission.status()
+
+
+@router.get("/eligibility")
+def get_eligibility_rules():
+    """
+    The key of the served eligibility rules, their size, the disagreements between their sources and the chains
+    only listed in config.yaml.
+    """
+    from app.core import rules
+
+    if rules.rule_set is None:
+        raise HTTPException(status_code=404, detail="No eligibility rules are loaded.")
+    return rules.rule_set.status()
+
+
+@router.post("/eligibility/reload")
+def reload_eligibility_rules(http_request: Request):
+    """
+    Serve the eligibility rules again if the Excel tables or `service.eligibility` of config.yaml changed.
+    Only this worker reloads, so until the others do, they serve the previous rules. To reload every worker, send
+    SIGHUP to the server master: it forks new workers, which serve the current rules from their warmup.
+    """
+    from app.core import rules
+    from omegaconf import OmegaConf
+
+    if rules.rule_set is None:
+        raise HTTPException(status_code=404, detail="No eligibility rules are loaded.")
+    config = OmegaConf.load(http_request.app.state.config_path)
+    try:
+        rule_set, changed = rules.reload(OmegaConf.to_container(config.get("service", {}).get("eligibility", {})))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"reloaded": changed, **rule_set.status()}
@@ -1,30 +1,208 @@
 import logging
+from typing import Literal, Optional, Union
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, HTTPException, Request
 from app.api import schemas
-from app.core.data import get_prices_within_radius
+from app.api.responses import frame_response, frame_stream, streaming_media_type
+from app.core.profiling import profiled
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+def _database_store(http_request: Request, city: Optional[str] = None) -> bool:
+    """
+    Whether the listings are queried from the `listings` table rather than from the CSV held in memory.
+    The table holds the listings of the default city; a city with a shard of its own is served from the shard.
+    """
+    from app.core import shards
+
+    if shards.served_city(city) != shards.default_city:
+        return False
+    return http_request.app.state.config.get("data", {}).get("store", "memory") == "database"
+
+
 # FastAPI route for the task
 @router.post("/prices_in_radius", response_model=list[dict[str, float]])
-def prices_in_radius(request: schemas.LocationRequest):
+@profiled("prices_in_radius")
+def prices_in_radius(
+    request: schemas.LocationRequest,
+    http_request: Request,
+    orient: Literal["records", "columns"] = "records",
+    accept: Optional[str] = Header(None),
+):
     """
     Get prices within a specified radius from a given location.
 
     Args:
         request (schemas.LocationRequest): The location request containing latitude, longitude, and radius.
+        orient: `records` for a list of listings, `columns` for parallel arrays of prices and coordinates.
+        accept: `application/x-ndjson` or `application/vnd.apache.arrow.stream` to stream the listings
+            as they are found instead of returning one JSON document.
 
     Returns:
-        list[float]: A list of prices within the specified radius.
+        list[dict[str, float]]: The listings within the specified radius.
     """
-    logging.info(f"Received request for prices within radius of {request.radius} km from {request.latitude}, {request.longitude}")
-    prices = get_prices_within_radius(
+    logger.info(
+        "Received request for prices within radius of %s km from %s, %s", request.radius, request.latitude,
+        request.longitude,
+    )
+    from app.core import admission, data
+
+    try:
+        media_type = streaming_media_type(accept)
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow streams are not available: pyarrow is not installed")
+
+    if _database_store(http_request, request.city):
+        import pandas as pd
+        from app.db import listings
+
+        if media_type:
+            chunks = listings.iter_within_radius(request.latitude, request.longitude, request.radius, data.CHUNK_ROWS)
+            return frame_stream(chunks, pd.DataFrame(columns=data.COLUMNS, dtype=float), media_type)
+        return frame_response(listings.within_radius(request.latitude, request.longitude, request.radius), orient)
+
+    if admission.max_radius_rows:
+        # the listings of the latitude band are the ones scanned, known from two binary searches
+        start, stop = data.latitude_band(data.get_data(request.city), request.latitude, request.radius)
+        if stop - start > admission.max_radius_rows:
+            admission.rejections.inc("/data/prices_in_radius", "cost")
+            raise HTTPException(
+                status_code=422,
+                detail=f"A radius of {request.radius} km around this location covers about {stop - start} listings, "
+                       f"more than the {admission.max_radius_rows} a request may scan; narrow the radius.",
+            )
+
+    if media_type:
+        chunks = data.iter_within_radius(
+            center_lat=request.latitude, center_lon=request.longitude, radius=request.radius, city=request.city
+        )
+        return frame_stream(chunks, data.get_data(request.city).iloc[:0], media_type)
+
+    prices = data.select_within_radius(
         center_lat=request.latitude,
         center_lon=request.longitude,
-        radius=request.radius
+        radius=request.radius,
+        city=request.city,
     )
-    return prices
+    return frame_response(prices, orient)
+
+
+@router.post("/prices_in_polygon", response_model=Union[list[dict[str, float]], schemas.PriceStats])
+def prices_in_polygon(
+    request: schemas.PolygonRequest,
+    http_request: Request,
+    orient: Literal["records", "columns"] = "records",
+):
+    """
+    Get the listings, or their price statistics, inside a polygon or an okrug.
+
+    Args:
+        request (schemas.PolygonRequest): The vertices of a polygon or the name of an okrug, and whether to aggregate.
+        orient: `records` for a list of listings, `columns` for parallel arrays of prices and coordinates.
+
+    Returns:
+        The listings inside the area, or `schemas.PriceStats` of their prices when `aggregate` is set.
+    """
+    from app.core import geo, shards
+
+    if (request.polygon is None) == (request.okrug is None):
+        raise HTTPException(status_code=422, detail="Exactly one of polygon and okrug is required.")
+    if request.okrug is not None:
+        shard = shards.shard_for(request.city)
+        okrugs = geo.okrugs if shard is None else shard.okrugs
+        if okrugs is None:
+            raise HTTPException(status_code=503, detail="No okrug boundaries are loaded.")
+        if request.okrug not in okrugs.names:
+            raise HTTPException(status_code=404, detail=f"Okrug {request.okrug} does not exist.")
+        polygon = okrugs.polygon(request.okrug)
+    else:
+        vertices = [(point.longitude, point.latitude) for point in request.polygon]
+        polygon = geo.PreparedPolygon(geo.ring_edges([vertices + vertices[:1]]))
+
+    if _database_store(http_request, request.city):
+        from app.db import listings
+
+        if request.aggregate:
+            return listings.polygon_price_stats(polygon)
+        return frame_response(listings.within_polygon(polygon), orient)
+    from app.core import data
+
+    if request.aggregate:
+        return data.polygon_price_stats(polygon, request.city)
+    return frame_response(data.select_within_polygon(polygon, request.city), orient)
+
+
+@router.post("/nearest", response_model=list[dict[str, float]])
+def nearest_listings(request: schemas.NearestRequest, http_request: Request):
+    """
+    Get the listings closest to a location.
+
+    Args:
+        request (schemas.NearestRequest): The location and the number of listings to return.
+
+    Returns:
+        list[dict[str, float]]: The closest listings, nearest first, with their distance in kilometers.
+    """
+    if _database_store(http_request, request.city):
+        from app.db.listings import nearest
+
+        return frame_response(nearest(request.latitude, request.longitude, request.k))
+    from app.core.data import nearest
+
+    return frame_response(nearest(request.latitude, request.longitude, request.k, request.city))
+
+
+@router.post("/price_stats", response_model=schemas.PriceStats)
+def price_stats(request: schemas.LocationRequest, http_request: Request):
+    """
+    Get the count, mean, median, min and max price per meter of the listings within a radius.
+
+    Args:
+        request (schemas.LocationRequest): The location request containing latitude, longitude, and radius.
+
+    Returns:
+        schemas.PriceStats: The price statistics, empty when no listing is within the radius.
+    """
+    if _database_store(http_request, request.city):
+        from app.db.listings import price_stats
+
+        return price_stats(request.latitude, request.longitude, request.radius)
+    from app.core.data import price_stats
+
+    return price_stats(request.latitude, request.longitude, request.radius, request.city)
+
+
+@router.post("/listings", response_model=schemas.ListingsIngestResponse)
+def ingest_listings(request: schemas.ListingsIngestRequest, http_request: Request):
+    """
+    Add listings to the price dataset without a restart. Queries running meanwhile keep the previous version.
+    With several worker processes, the listings reach the other workers through `resources.prices_journal`,
+    without it ingestion is refused.
+
+    Args:
+        request (schemas.ListingsIngestRequest): The listings and whether to append or upsert them.
+
+    Returns:
+        schemas.ListingsIngestResponse: The new dataset version and the counts of added, updated and skipped listings.
+    """
+    if _database_store(http_request):
+        raise HTTPException(
+            status_code=409, detail="Listings are served from the database; load them with `python -m app.db.listings`"
+        )
+    import os
+
+    import pandas as pd
+    from app.core.data import COLUMNS, ingest, journal_path
+
+    workers = int(os.environ.get("APP_WORKERS", "1"))
+    if workers > 1 and journal_path is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Listings ingested here would only reach one of the {workers} workers; "
+                   f"configure resources.prices_journal to share them.",
+        )
+    listings = pd.DataFrame([listing.dict() for listing in request.listings], columns=COLUMNS)
+    return ingest(listings, upsert=request.mode == "upsert")
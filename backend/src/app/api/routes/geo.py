@@ -0,0 +1,26 @@
+from app.api import schemas
+from app.api.responses import ORJSONResponse
+from fastapi import APIRouter, HTTPException
+
+router = APIRouter()
+
+
+@router.post("/resolve", response_model=list[schemas.GeoResolution])
+def resolve_points(request: schemas.GeoResolveRequest):
+    """
+    Find the nearest metro stations and the containing okrug of every point.
+
+    Args:
+        request (schemas.GeoResolveRequest): The points and the number of stations to return for each.
+
+    Returns:
+        list[schemas.GeoResolution]: One entry per point, in the order of the request.
+    """
+    import numpy as np
+    from app.core import geo
+
+    if geo.stations is None and geo.okrugs is None:
+        raise HTTPException(status_code=503, detail="No metro stations or okrug boundaries are loaded.")
+    latitudes = np.array([point.latitude for point in request.points])
+    longitudes = np.array([point.longitude for point in request.points])
+    return ORJSONResponse(geo.resolve(latitudes, longitudes, request.k))
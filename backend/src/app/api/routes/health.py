@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+def healthz():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+def readyz(request: Request):
+    """Readiness probe: all resources are loaded and every model has been warmed up."""
+    state = request.app.state.startup
+    content = {"status": "ready" if state.ready else "starting", **state.as_dict()}
+    if state.errors:
+        content["status"] = "failed"
+    return JSONResponse(content=content, status_code=200 if state.ready else 503)
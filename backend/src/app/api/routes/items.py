@@ -5,7 +5,6 @@ from app.api import schemas
 from app.db import crud
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -23,6 +22,17 @@ def create_item(request: schemas.ItemCreate, user_id: int):
     db_item = crud.create_item(user_id=user_id, title=request.title, description=request.description)
     return schemas.ItemBase(id=db_item.id, title=db_item.title, description=db_item.description)
 
+@router.post("/{user_id}/bulk", response_model=schemas.BulkResult)
+def create_items(request: schemas.ItemsBulkCreate, user_id: int):
+    logger.info(f"Creating {len(request.items)} items for user {user_id}")
+
+    db_user = crud.read_user(user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail=f"User with id {user_id} does not exist.")
+
+    created = crud.bulk_create_items(user_id, [item.dict() for item in request.items])
+    return schemas.BulkResult(created=created)
+
 @router.get("/{user_id}", response_model=list[schemas.ItemBase])
 def read_user_items(user_id: int):
     logger.info(f"Getting items for user {user_id}")
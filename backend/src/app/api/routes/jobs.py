@@ -0,0 +1,163 @@
+from typing import Optional
+
+from app.api import schemas
+from fastapi import APIRouter, Header, HTTPException, Query
+
+router = APIRouter()
+
+
+def _runner_required():
+    from app.core import jobs
+
+    if jobs.runner is None:
+        raise HTTPException(status_code=503, detail="Background jobs are not running in this process.")
+    return jobs
+
+
+def _input_path(jobs, path: str) -> str:
+    try:
+        return jobs.resolve_input(path)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _status(job_id: str) -> dict:
+    from app.core import jobs
+    from app.db.jobs import get_job
+
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} does not exist.")
+    return jobs.status(job)
+
+
+@router.post("/predict", response_model=schemas.JobStatus, status_code=202)
+def submit_predictions(request: schemas.PredictionJobRequest):
+    """
+    Queue the prediction of many listings, with the price statistics around them and their eligible chains
+    when requested.
+
+    Args:
+        request (schemas.PredictionJobRequest): The listings, or a file of the job input directory, and the options.
+
+    Returns:
+        schemas.JobStatus: The queued job; its result has the listings with `predicted_price_per_sqm` added.
+    """
+    import pandas as pd
+
+    jobs = _runner_required()
+    if (request.listings is None) == (request.input_path is None):
+        raise HTTPException(status_code=422, detail="Exactly one of listings and input_path is required.")
+    if request.listings is not None and request.eligibility is not None:
+        raise HTTPException(status_code=422, detail="Eligibility criteria can only be read from an input_path file.")
+    options = {"model_name": request.model, "city": request.city, "radius": request.radius,
+               "eligibility": request.eligibility}
+    if request.listings is not None:
+        rows = pd.DataFrame([listing.dict() for listing in request.listings])
+        return _status(jobs.submit("predict", {"options": options}, rows=rows))
+    path = _input_path(jobs, request.input_path)
+    return _status(jobs.submit("predict", {"options": options, "input": path}, total_chunks=jobs.count_chunks(path)))
+
+
+@router.post("/eligibility", response_model=schemas.JobStatus, status_code=202)
+def submit_eligibility(request: schemas.EligibilityJobRequest):
+    """
+    Queue the eligibility screening of many facilities or land plots.
+
+    Args:
+        request (schemas.EligibilityJobRequest): The facilities, the land plots, or a file of the job input
+            directory with the `kind` of its criteria.
+
+    Returns:
+        schemas.JobStatus: The queued job; its result has the rows with `eligible_chains` added.
+    """
+    import pandas as pd
+
+    jobs = _runner_required()
+    sources = [source for source in (request.facility, request.land, request.input_path) if source is not None]
+    if len(sources) != 1:
+        raise HTTPException(status_code=422, detail="Exactly one of facility, land and input_path is required.")
+    if request.input_path is not None:
+        if request.kind is None:
+            raise HTTPException(status_code=422, detail="The kind of the criteria of input_path is required.")
+        path = _input_path(jobs, request.input_path)
+        return _status(jobs.submit("eligibility", {"kind": request.kind, "input": path}, total_chunks=jobs.count_chunks(path)))
+    kind = "facility" if request.facility is not None else "land"
+    rows = pd.DataFrame([criteria.dict() for criteria in sources[0]])
+    return _status(jobs.submit("eligibility", {"kind": kind}, rows=rows))
+
+
+@router.post("/grid", response_model=schemas.JobStatus, status_code=202)
+def submit_grid(request: schemas.GridJobRequest):
+    """
+    Queue the prediction of the base listing over a grid too fine for `/model/surface`.
+
+    Args:
+        request (schemas.GridJobRequest): The base listing, the bounding box and the resolution.
+
+    Returns:
+        schemas.JobStatus: The queued job; its result has the latitude, longitude and price of every cell.
+    """
+    import math
+
+    jobs = _runner_required()
+    bbox = request.bbox
+    if bbox.min_latitude >= bbox.max_latitude or bbox.min_longitude >= bbox.max_longitude:
+        raise HTTPException(status_code=422, detail="The bbox minimums must be below its maximums.")
+    params = {"base": request.base.dict(), "bbox": bbox.dict(), "resolution": request.resolution}
+    band = max(1, jobs.chunk_rows // request.resolution)
+    return _status(jobs.submit("grid", params, total_chunks=math.ceil(request.resolution / band)))
+
+
+@router.get("", response_model=list[schemas.JobStatus])
+def list_jobs(
+    status: Optional[str] = Query(None, description="Only the jobs in this state"),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """The most recent jobs first."""
+    from app.core import jobs
+    from app.db.jobs import list_jobs as read_jobs
+
+    return [jobs.status(job) for job in read_jobs(limit, status)]
+
+
+@router.get("/{job_id}", response_model=schemas.JobStatus)
+def get_job_status(job_id: str):
+    return _status(job_id)
+
+
+@router.get("/{job_id}/result")
+def get_job_result(job_id: str, accept: Optional[str] = Header(None)):
+    """
+    Stream the result of a succeeded job part by part, as newline-delimited JSON, or as an Arrow IPC stream
+    with `Accept: application/vnd.apache.arrow.stream`. The Parquet parts themselves are in the job directory.
+    """
+    import itertools
+
+    import pandas as pd
+    from app.api.responses import NDJSON_MEDIA_TYPE, frame_stream, streaming_media_type
+    from app.core import jobs
+
+    status = _status(job_id)
+    if status["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {status['status']}, not succeeded.")
+    try:
+        media_type = streaming_media_type(accept) or NDJSON_MEDIA_TYPE
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow streams are not available: pyarrow is not installed")
+    parts = jobs.read_result(job_id)
+    first = next(parts, pd.DataFrame())
+    # the schema is taken from a whole part: an empty frame leaves the types of the text columns unknown
+    return frame_stream(itertools.chain([first], parts), first, media_type)
+
+
+@router.post("/{job_id}/cancel", response_model=schemas.JobStatus)
+def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one after the chunk it is scoring."""
+    from app.core import jobs
+    from app.db.jobs import TERMINAL_STATUSES, request_cancel
+
+    status = _status(job_id)
+    if status["status"] in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is already {status['status']}.")
+    return jobs.status(request_cancel(job_id))
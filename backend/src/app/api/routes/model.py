@@ -1,87 +1,190 @@
 import logging
-import pickle
 
-import pandas as pd
 from app.api import schemas
-from app.db import crud
-from fastapi import APIRouter
-from geopy.distance import great_circle
+from app.api.responses import ORJSONResponse
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Load models
-model_files = {
-    "xgb_1": './backend/models/xgb_model_1.pkl',
-    "xgb_2": './backend/models/xgb_model_2.pkl',
-    "mlp_1": './backend/models/mlp_model_1.pkl'
-}
-
-models = {}
-for model_name, model_path in model_files.items():
-    with open(model_path, 'rb') as model_file:
-        models[model_name] = pickle.load(model_file)
-
-# Prediction function
-def predict_user_input(user_input: schemas.PredictionRequest):
-    model = models[user_input.model]
-
-    input_data = {feature: 0 for feature in model.feature_names_in_}
-
-    # Map numerical fields
-    input_data['общая площадь'] = user_input.area
-    input_data['этаж'] = user_input.floor
-    input_data['время до станции'] = user_input.time_to_station
-    input_data['Этажность дома'] = user_input.total_floors
-    input_data['широта'] = user_input.latitude
-    input_data['долгота'] = user_input.longitude
-
-    # Set one-hot encoded fields
-    state_feature = f"состояние_{user_input.condition}"
-    if state_feature in input_data:
-        input_data[state_feature] = 1
-
-    district_feature = f"округ_{user_input.okrug}"
-    if district_feature in input_data:
-        input_data[district_feature] = 1
-
-    metro_feature = f"метро_{user_input.metro}"
-    if metro_feature in input_data:
-        input_data[metro_feature] = 1
-
-    walk_transit_feature = f"пешком/транспортом_{user_input.transport}"
-    if walk_transit_feature in input_data:
-        input_data[walk_transit_feature] = 1
-
-    category_feature = f"категория объявления_{user_input.category}"
-    if category_feature in input_data:
-        input_data[category_feature] = 1
-
-    # Convert dictionary into DataFrame for prediction
-    input_df = pd.DataFrame([input_data])
-
-    # Calculate distance from Moscow's center
-    moscow_center_coords = (55.7558, 37.6173)
-    input_df['distance_from_center'] = input_df.apply(
-        lambda row: great_circle((row['широта'], row['долгота']), moscow_center_coords).kilometers, axis=1
-    )
-
-    try:
-        # Prediction
-        prediction = model.predict(input_df)
-        return prediction[0]
-    except Exception as e:
-        raise e
-
 # Define FastAPI endpoint
 @router.post("/predict/")
-def get_prediction(user_input: schemas.PredictionRequest):
+def get_prediction(
+    user_input: schemas.PredictionRequest,
+    explain: bool = Query(False, description="Добавить вклад каждого признака в предсказание"),
+):
+    import time
+
+    from app.core import history
+    from app.core.geo import UnresolvedLocation
+    from app.core.model import predict_user_input
+
     try:
+        start = time.perf_counter()
         prediction = predict_user_input(user_input)
-        logger.info(f"Prediction: {prediction}")
-        return {"predicted_price_per_sqm": float(prediction)}
+        history.record(
+            "predict", user_input.model, user_input.city, [user_input.dict()], [prediction],
+            time.perf_counter() - start,
+        )
+        logger.info("Prediction: %s", prediction)
+        response = {"predicted_price_per_sqm": float(prediction)}
+        if explain:
+            from app.core.explain import explain as explain_prediction
+
+            response["explanation"] = explain_prediction(user_input)
+        return response
+    except UnresolvedLocation as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error: {e}")
         return {"error": "Prediction error"}
+
+
+@router.post("/predict/batch")
+def get_predictions(
+    user_inputs: list[schemas.PredictionRequest],
+    explain: bool = Query(False, description="Добавить вклад каждого признака в предсказания"),
+):
+    """
+    Predict many listings at once; the listings of each city and model are encoded and scored together.
+
+    Returns:
+        The predictions in the order of the listings, and their explanations when requested.
+    """
+    import time
+
+    import numpy as np
+    import pandas as pd
+    from app.core import history, shards
+    from app.core.geo import UnresolvedLocation
+    from app.core.model import UnknownModel, predict_frame
+
+    if not user_inputs:
+        return ORJSONResponse({"predicted_price_per_sqm": [], **({"explanations": []} if explain else {})})
+    listings = [user_input.dict() for user_input in user_inputs]
+    inputs = pd.DataFrame(listings)
+    predictions = np.empty(len(inputs))
+    explanations = [None] * len(inputs)
+    cities = inputs["city"].map(shards.served_city)
+    try:
+        for (city, model_name), rows in inputs.groupby([cities, "model"], sort=False):
+            start = time.perf_counter()
+            predictions[rows.index] = predict_frame(model_name, rows, city=city)
+            history.record(
+                "predict/batch", model_name, city, [listings[index] for index in rows.index],
+                predictions[rows.index], time.perf_counter() - start,
+            )
+            if explain:
+                from app.core.explain import explain_frame
+
+                for index, explanation in zip(rows.index, explain_frame(model_name, rows, city)):
+                    explanations[index] = explanation
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UnresolvedLocation as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    response = {"predicted_price_per_sqm": predictions}
+    if explain:
+        response["explanations"] = explanations
+    return ORJSONResponse(response)
+
+
+@router.post("/surface")
+def get_price_surface(request: schemas.SurfaceRequest):
+    """
+    Predict the price per square meter of the base listing over a grid or at a set of points.
+
+    Args:
+        request (schemas.SurfaceRequest): The base listing and either a bounding box with a resolution or points.
+
+    Returns:
+        `array`: the grid axes and a row of prices per latitude, north first, or the prices of the points;
+        `geojson`: a FeatureCollection of points; `png`: a heatmap of the grid, north up, with the price range
+        in the X-Price-Min and X-Price-Max headers.
+    """
+    import numpy as np
+    from app.core import surface
+    from app.core.geo import UnresolvedLocation
+    from app.core.model import UnknownModel
+
+    if request.points is None and request.bbox is None:
+        raise HTTPException(status_code=422, detail="Either bbox or points is required.")
+    if request.points is not None and request.format == "png":
+        raise HTTPException(status_code=422, detail="A PNG heatmap needs a bbox grid.")
+    bbox = request.bbox
+    if bbox is not None and (bbox.min_latitude >= bbox.max_latitude or bbox.min_longitude >= bbox.max_longitude):
+        raise HTTPException(status_code=422, detail="The bbox minimums must be below its maximums.")
+
+    try:
+        if request.points is not None:
+            latitudes = np.array([point.latitude for point in request.points])
+            longitudes = np.array([point.longitude for point in request.points])
+            prices = surface.predict_points(request.base, latitudes, longitudes)
+        else:
+            axis_lat, axis_lon, grid = surface.predict_grid(request.base, bbox, request.resolution)
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UnresolvedLocation as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if request.points is not None:
+        if request.format == "geojson":
+            return ORJSONResponse(surface.to_geojson(latitudes, longitudes, prices))
+        return ORJSONResponse({"predicted_price_per_sqm": prices})
+    if request.format == "png":
+        low, high = float(grid.min()), float(grid.max())
+        return Response(
+            surface.to_png(surface.colorize(grid, low, high)),
+            media_type="image/png",
+            headers={"X-Price-Min": f"{low:.0f}", "X-Price-Max": f"{high:.0f}"},
+        )
+    if request.format == "geojson":
+        grid_lat, grid_lon = np.meshgrid(axis_lat, axis_lon, indexing="ij")
+        return ORJSONResponse(surface.to_geojson(grid_lat.ravel(), grid_lon.ravel(), grid.ravel()))
+    return ORJSONResponse({"latitudes": axis_lat, "longitudes": axis_lon, "predicted_price_per_sqm": grid})
+
+
+# Largest batch a what-if request may expand to
+MAX_WHATIF_ROWS = 100_000
+
+
+@router.post("/whatif")
+def get_what_if(request: schemas.WhatIfRequest):
+    """
+    Predict the base listing with some attributes changed, in one model call.
+
+    Args:
+        request (schemas.WhatIfRequest): The base listing, sweeps of some of its attributes and how to combine them.
+
+    Returns:
+        The base prediction and one row per variant with the changed attributes, the prediction and its change
+        from the base in rubles per square meter and in percent.
+    """
+    import math
+
+    from app.core import whatif
+    from app.core.geo import UnresolvedLocation
+    from app.core.model import UnknownModel
+
+    requested = {field: getattr(request, field) for field in whatif.SWEEP_FIELDS if getattr(request, field) is not None}
+    if not requested:
+        raise HTTPException(status_code=422, detail="At least one sweep is required.")
+    for field, sweep in requested.items():
+        if isinstance(sweep, schemas.Range) and sweep.stop < sweep.start:
+            raise HTTPException(status_code=422, detail=f"The {field} sweep stops before it starts.")
+    # counted before any value is built, so that a huge range is refused rather than allocated
+    sizes = [whatif.sweep_size(sweep) for sweep in requested.values()]
+    rows = math.prod(sizes) if request.mode == "product" else sum(sizes)
+    if rows > MAX_WHATIF_ROWS:
+        raise HTTPException(status_code=422, detail=f"The sweeps expand to {rows} variants, at most {MAX_WHATIF_ROWS} are allowed.")
+    sweeps = {field: whatif.sweep_values(sweep) for field, sweep in requested.items()}
+
+    try:
+        base_price, table = whatif.what_if(request.base, sweeps, request.mode)
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UnresolvedLocation as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return ORJSONResponse({"base_price_per_sqm": base_price, "variants": table.to_dict("records")})
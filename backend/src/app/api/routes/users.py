@@ -4,7 +4,6 @@ from fastapi import APIRouter, HTTPException
 from app.api import schemas
 from app.db import crud
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -22,6 +21,12 @@ def create_user(user_in: schemas.UserCreate):
     db_user = crud.create_user(user_in.name)
     return schemas.User(id=db_user.id, name=db_user.name, items=db_user.items)
 
+@router.post("/bulk", response_model=schemas.BulkResult)
+def create_users(users_in: schemas.UsersBulkCreate):
+    """Create many users in one transaction; names that already exist are skipped."""
+    created = crud.bulk_create_users(users_in.names)
+    return schemas.BulkResult(created=created, skipped=len(users_in.names) - created)
+
 @router.get("/", response_model=list[schemas.User])
 def get_users():
     db_users = crud.read_users()
@@ -1,6 +1,6 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, Field, conint, constr
+from pydantic import BaseModel, ConfigDict, Field, conint
 
 
 class ItemBase(BaseModel):
@@ -15,8 +15,7 @@ class Item(ItemBase):
     id: int
     owner_id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserBase(BaseModel):
     name: str
@@ -29,16 +28,29 @@ class User(UserBase):
     name: str
     items: List[Item] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class UsersBulkCreate(BaseModel):
+    names: List[str]
+
+class ItemBulkEntry(BaseModel):
+    title: str
+    description: Optional[str] = None
+
+class ItemsBulkCreate(BaseModel):
+    items: List[ItemBulkEntry]
+
+class BulkResult(BaseModel):
+    created: int
+    skipped: int = 0
 
 class Message(BaseModel):
     message: str
 
 # Input schema for prediction request
 class PredictionRequest(BaseModel):
-    metro: str
-    okrug: str
+    metro: Optional[str] = Field(None, description="Ближайшая станция метро; по умолчанию определяется по координатам")
+    okrug: Optional[str] = Field(None, description="Округ; по умолчанию определяется по координатам")
     city: str
     category: str
     condition: str
@@ -51,6 +63,37 @@ class PredictionRequest(BaseModel):
     longitude: float
     model: str
 
+class BoundingBox(BaseModel):
+    min_latitude: float = Field(..., ge=-90, le=90, json_schema_extra={"example": 55.55})
+    max_latitude: float = Field(..., ge=-90, le=90, json_schema_extra={"example": 55.95})
+    min_longitude: float = Field(..., ge=-180, le=180, json_schema_extra={"example": 37.35})
+    max_longitude: float = Field(..., ge=-180, le=180, json_schema_extra={"example": 37.85})
+
+class Point(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90, json_schema_extra={"example": 55.735})
+    longitude: float = Field(..., ge=-180, le=180, json_schema_extra={"example": 37.73})
+
+class SurfaceRequest(BaseModel):
+    base: PredictionRequest = Field(..., description="Объект, который переносится в каждую точку; его координаты не используются, а метро и округ без значения определяются в каждой точке")
+    bbox: Optional[BoundingBox] = Field(None, description="Область сетки")
+    resolution: conint(ge=2, le=500) = Field(100, description="Число узлов сетки по каждой оси")
+    points: Optional[List[Point]] = Field(None, description="Точки вместо сетки, например координаты адресов")
+    format: Literal["array", "geojson", "png"] = "array"
+
+class Range(BaseModel):
+    start: float
+    stop: float
+    step: float = Field(..., gt=0)
+
+class WhatIfRequest(BaseModel):
+    base: PredictionRequest
+    area: Optional[Range] = Field(None, description="Площади, от start до stop включительно")
+    floor: Optional[Range] = None
+    time_to_station: Optional[Range] = None
+    condition: Optional[List[str]] = Field(None, description="Варианты состояния, например ['Дизайнерский ремонт']")
+    transport: Optional[List[str]] = None
+    mode: Literal["each", "product"] = Field("each", description="each: по одному признаку за раз, product: все сочетания")
+
 class FacilityEligibilityRequest(BaseModel):
     total_area: conint(ge=1) = Field(..., description="Общая площадь объекта недвижимости в квадратных метрах")
     floor: conint(ge=0) = Field(..., description="Этаж объекта (0 - цоколь)")
@@ -71,7 +114,89 @@ class LandEligibilityRequest(BaseModel):
     high_vehicle_traffic: bool = Field(..., description="Высокий автомобильный трафик")
     utilities: bool = Field(..., description="Наличие всех коммуникаций")
 
+class PredictionJobRequest(BaseModel):
+    listings: Optional[List[PredictionRequest]] = Field(None, description="Объекты для оценки")
+    input_path: Optional[str] = Field(None, description="CSV или Parquet файл в каталоге входных данных задач вместо объектов")
+    model: str = Field("xgb_1", description="Модель для строк файла без колонки model")
+    city: Optional[str] = Field(None, description="Город для строк файла без колонки city")
+    radius: Optional[float] = Field(None, gt=0, description="Добавить статистику цен в этом радиусе, км")
+    eligibility: Optional[Literal["facility", "land"]] = Field(None, description="Добавить подходящие сети; строки должны содержать критерии")
+
+class EligibilityJobRequest(BaseModel):
+    facility: Optional[List[FacilityEligibilityRequest]] = None
+    land: Optional[List[LandEligibilityRequest]] = None
+    input_path: Optional[str] = Field(None, description="CSV или Parquet файл в каталоге входных данных задач")
+    kind: Optional[Literal["facility", "land"]] = Field(None, description="Вид критериев строк input_path")
+
+class GridJobRequest(BaseModel):
+    base: PredictionRequest
+    bbox: BoundingBox
+    resolution: conint(ge=2, le=10_000) = Field(1000, description="Число узлов сетки по каждой оси")
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed", "cancelled"]
+    total_chunks: Optional[int] = None
+    done_chunks: int
+    progress: Optional[float] = None
+    rows: int
+    attempts: int
+    cancel_requested: bool
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
 class LocationRequest(BaseModel):
-    latitude: float = Field(..., example=55.735)
-    longitude: float = Field(..., example=37.73000)
-    radius: float = Field(..., example=1.0, description="Радиус в километрах")
\ No newline at end of file
+    latitude: float = Field(..., json_schema_extra={"example": 55.735})
+    longitude: float = Field(..., json_schema_extra={"example": 37.73000})
+    radius: float = Field(..., json_schema_extra={"example": 1.0}, description="Радиус в километрах")
+    city: Optional[str] = Field(None, description="Город; по умолчанию и для городов без своих данных — Москва", json_schema_extra={"example": "Москва"})
+
+class Listing(BaseModel):
+    price_per_meter: float = Field(..., gt=0, json_schema_extra={"example": 350000.0})
+    latitude: float = Field(..., ge=-90, le=90, json_schema_extra={"example": 55.735})
+    longitude: float = Field(..., ge=-180, le=180, json_schema_extra={"example": 37.73})
+
+class ListingsIngestRequest(BaseModel):
+    listings: List[Listing]
+    mode: Literal["append", "upsert"] = Field("append", description="upsert заменяет цену объявлений с теми же координатами")
+
+class ListingsIngestResponse(BaseModel):
+    version: int
+    rows: int
+    added: int
+    updated: int
+    duplicates: int
+
+class NearestRequest(BaseModel):
+    latitude: float = Field(..., json_schema_extra={"example": 55.735})
+    longitude: float = Field(..., json_schema_extra={"example": 37.73000})
+    k: conint(ge=1, le=1000) = Field(10, description="Количество ближайших объявлений")
+    city: Optional[str] = Field(None, description="Город; по умолчанию и для городов без своих данных — Москва", json_schema_extra={"example": "Москва"})
+
+class PolygonRequest(BaseModel):
+    polygon: Optional[List[Point]] = Field(None, min_length=3, description="Вершины многоугольника; замыкать не обязательно")
+    okrug: Optional[str] = Field(None, description="Округ вместо многоугольника", json_schema_extra={"example": "ЦАО"})
+    aggregate: bool = Field(False, description="Вернуть статистику цен вместо объявлений")
+    city: Optional[str] = Field(None, description="Город; по умолчанию и для городов без своих данных — Москва", json_schema_extra={"example": "Москва"})
+
+class PriceStats(BaseModel):
+    count: float
+    mean: Optional[float] = None
+    median: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class GeoResolveRequest(BaseModel):
+    points: List[Point] = Field(..., min_length=1)
+    k: conint(ge=1, le=10) = Field(1, description="Количество ближайших станций метро")
+
+class StationDistance(BaseModel):
+    name: str
+    distance_km: float
+
+class GeoResolution(BaseModel):
+    okrug: Optional[str] = Field(None, description="Округ, в котором находится точка; пусто за пределами всех округов")
+    stations: Optional[List[StationDistance]] = Field(None, description="Ближайшие станции; пусто, если станции не загружены")
@@ -0,0 +1,147 @@
+"""
+Production launcher: several worker processes serving the API on one port.
+
+    python -m app.api.serve                                   # settings from the `server` section of config.yaml
+    python -m app.api.serve --workers 4 --threads-per-worker 2
+
+With gunicorn installed, the master creates the app and loads the models and tables once, then forks
+UvicornWorker processes that share that memory copy-on-write. `kill -HUP <master pid>` replaces the workers
+gracefully: new ones are forked and the old ones finish their requests within `graceful_timeout`.
+To deploy new code, `kill -USR2 <master pid>` starts a new master next to the old one, which is then
+stopped with `kill -TERM <old master pid>`.
+
+Without gunicorn, `uvicorn --workers` is used; each worker then loads its own copy of the resources.
+"""
+import argparse
+import gc
+import logging
+import os
+import sys
+
+from app.core import runtime
+from omegaconf import OmegaConf
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = "./backend/src/app/conf/config.yaml"
+
+
+def resolve_workers(workers: int) -> int:
+    return workers or os.cpu_count() or 1
+
+
+def resolve_threads(threads: int, workers: int) -> int:
+    """Threads per worker; by default the cores are split evenly so that the workers don't oversubscribe them."""
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+def pin_worker(workers: int):
+    """gunicorn post_fork hook giving each worker its own slice of the CPUs, round robin over replacements."""
+    def post_fork(server, worker):
+        cpus = sorted(os.sched_getaffinity(0))
+        share = max(1, len(cpus) // workers)
+        index = (worker.age - 1) % workers
+        runtime.pin(cpus[index * share:(index + 1) * share] or cpus)
+    return post_fork
+
+
+def close_connections() -> None:
+    """Close the pooled database connections of this process, so that forked workers don't share their sockets."""
+    database = sys.modules.get("app.db.database")
+    if database is not None and database.get_enginge.cache_info().currsize:
+        database.get_enginge().dispose()
+
+
+def app_factory():
+    """Application factory for the uvicorn workers."""
+    from app.api.main import create_app
+
+    return create_app(os.environ.get("APP_CONFIG", CONFIG_PATH))
+
+
+def run_gunicorn(config_path: str, options: dict) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # With preload_app this runs once, in the master, before the workers are forked
+            from app.api.lifespan import preload
+            from app.api.main import create_app, create_database
+
+            application = create_app(config_path)
+            create_database(application.state.config)
+            errors = preload(application.state.config)
+            if errors:
+                logger.error(f"Resources that failed to preload will be retried by the workers: {errors}")
+            close_connections()
+            # Keep the collector from touching the preloaded objects, which would copy their pages in every worker
+            gc.freeze()
+            return application
+
+    Server().run()
+
+
+def main():
+    from app.core import log
+
+    log.configure()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default=CONFIG_PATH)
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, 0 for one per core")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Native threads per worker, 0 to split the cores")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.config)
+    server = config.get("server", {})
+    host = args.host or config.api.host
+    port = args.port or config.api.port
+    workers = resolve_workers(args.workers if args.workers is not None else server.get("workers", 0))
+    threads = resolve_threads(
+        args.threads_per_worker if args.threads_per_worker is not None else server.get("threads_per_worker", 0), workers
+    )
+    # before the master imports numpy, scikit-learn and xgboost
+    runtime.set_thread_env(threads)
+    os.environ["APP_CONFIG"] = args.config
+    os.environ["APP_WORKERS"] = str(workers)
+    logger.info(f"Starting {workers} workers with {threads} threads each on {host}:{port}")
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        import uvicorn
+
+        from app.api.main import create_database
+
+        logger.warning("gunicorn is not installed, falling back to uvicorn workers without preloading")
+        # once here rather than racing in every worker
+        create_database(config)
+        close_connections()
+        uvicorn.run(
+            "app.api.serve:app_factory", factory=True, host=host, port=port, workers=workers,
+            timeout_graceful_shutdown=server.get("graceful_timeout", 30), log_config=None,
+        )
+        return
+
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "timeout": server.get("timeout", 60),
+        "graceful_timeout": server.get("graceful_timeout", 30),
+        "max_requests": server.get("max_requests", 0),
+        "max_requests_jitter": server.get("max_requests_jitter", 0),
+    }
+    if server.get("pin_workers", False) and hasattr(os, "sched_setaffinity"):
+        options["post_fork"] = pin_worker(workers)
+    run_gunicorn(args.config, options)
+
+
+if __name__ == "__main__":
+    main()
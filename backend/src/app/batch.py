@@ -0,0 +1,266 @@
+"""
+Score a file of listings offline, with the models and tables of the service but without HTTP:
+
+    python -m app.batch listings.parquet predictions/ --workers 8
+    python -m app.batch listings.csv predictions/ --radius 1.0 --eligibility facility
+
+The input is a CSV or Parquet file with the fields of a prediction request as columns; `model` and `city`
+default to the options of the same name, `metro` and `okrug` are derived from the coordinates when missing.
+It is read `--chunk-rows` rows at a time and the chunks are scored by a pool of processes, each loading the
+resources of config.yaml once. Every chunk is written to the output directory as its own Parquet part with
+the input columns and `predicted_price_per_sqm`, the price statistics of the listings within `--radius` km
+(`radius_count`, `radius_mean`, ...) and the `eligible_chains` for the criteria in the input.
+
+An interrupted run is resumed by running the same command again: the parts already written are skipped.
+Reading needs pyarrow for Parquet input, writing always does.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = "./backend/src/app/conf/config.yaml"
+MANIFEST = "_batch.json"
+PREDICTION_FIELDS = [
+    "category", "condition", "area", "floor", "total_floors", "time_to_station", "transport", "latitude", "longitude",
+]
+
+
+def read_chunks(path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """The rows of a CSV or Parquet file, `chunk_rows` at a time."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+def eligibility_fields(kind: str) -> list[str]:
+    from app.api import schemas
+
+    request = schemas.FacilityEligibilityRequest if kind == "facility" else schemas.LandEligibilityRequest
+    return list(request.__fields__)
+
+
+def missing_columns(inputs: pd.DataFrame, eligibility: Optional[str] = None, predict: bool = True) -> list[str]:
+    """The input columns the scoring needs that `inputs` lacks; `total_area` is taken from `area` when absent."""
+    required = (PREDICTION_FIELDS if predict else []) + (eligibility_fields(eligibility) if eligibility else [])
+    return [field for field in required if field not in inputs and not (field == "total_area" and "area" in inputs)]
+
+
+def eligible_chains(inputs: pd.DataFrame, kind: str) -> list[list[str]]:
+    """The chains whose criteria every listing satisfies, through the compiled criteria tables."""
+    from app.core import eligibility
+
+    table = eligibility.get_facility_decision_table() if kind == "facility" else eligibility.get_land_decision_table()
+    fields = eligibility_fields(kind)
+    if "total_area" not in inputs:
+        inputs = inputs.assign(total_area=inputs["area"])
+    return [[record["chain"] for record in table.eligible(row)] for row in inputs[fields].itertuples(index=False)]
+
+
+def score_frame(
+    inputs: pd.DataFrame,
+    model_name: str = "xgb_1",
+    city: Optional[str] = None,
+    radius: Optional[float] = None,
+    eligibility: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Score listings the way `/model/predict/batch` does, the listings of each city and model together.
+    Args:
+        inputs: One listing per row, with the fields of a prediction request
+        model_name: The model of the listings without a `model`
+        city: The city of the listings without a `city`
+        radius: Add the price statistics of the listings within that many kilometers
+        eligibility: `facility` or `land` to add the chains the listings are eligible for
+
+    Returns:
+        pd.DataFrame: `inputs` with the added columns.
+    """
+    import numpy as np
+    from app.core import data, shards
+    from app.core.model import predict_frame
+
+    inputs = inputs.reset_index(drop=True)
+    for field, default in (("model", model_name), ("city", city), ("metro", None), ("okrug", None)):
+        if field not in inputs:
+            inputs[field] = default
+    inputs["model"] = inputs["model"].fillna(model_name)
+    cities = inputs["city"].map(shards.served_city)
+    predictions = np.empty(len(inputs))
+    for (served, name), rows in inputs.groupby([cities, "model"], sort=False):
+        predictions[rows.index] = predict_frame(name, rows, city=served)
+    scored = inputs.assign(predicted_price_per_sqm=predictions)
+
+    if radius is not None:
+        stats = pd.DataFrame(index=inputs.index, columns=[f"radius_{stat}" for stat in data.STATS], dtype=float)
+        for served, rows in inputs.groupby(cities, sort=False):
+            found = data.price_stats_many(rows["latitude"], rows["longitude"], radius, served)
+            stats.loc[rows.index] = found.to_numpy()
+        scored = pd.concat([scored, stats], axis=1)
+    if eligibility is not None:
+        scored["eligible_chains"] = eligible_chains(inputs, eligibility)
+    return scored
+
+
+def _init_worker(config_path: str, threads: int, load_prices: bool) -> None:
+    """Load the resources of config.yaml in a pool process, once for all the chunks it scores."""
+    from app.api.lifespan import preload
+    from app.core import data, log, runtime
+    from omegaconf import OmegaConf
+
+    # spawned, the process starts without the logging of the parent
+    log.configure()
+    config = OmegaConf.load(config_path)
+    runtime.configure({**OmegaConf.to_container(config.get("runtime", {})), "threads": threads})
+    errors = preload(config)
+    if errors:
+        logger.warning(f"Resources that failed to load: {errors}")
+    if load_prices and data.data is None:
+        data.load_data(config.resources.prices, config.resources.get("prices_journal"))
+
+
+def part_path(output_dir: str, index: int) -> str:
+    return os.path.join(output_dir, f"part-{index:06d}.parquet")
+
+
+def _score_part(index: int, inputs: pd.DataFrame, output_dir: str, options: dict) -> tuple[int, int, float]:
+    """Score one chunk and write its part; the part appears only once complete, so a resume never reads half of one."""
+    start = time.perf_counter()
+    scored = score_frame(inputs, **options)
+    path = part_path(output_dir, index)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    scored.to_parquet(temporary, index=False)
+    os.replace(temporary, path)
+    return index, len(scored), time.perf_counter() - start
+
+
+def _prepare_output(output_dir: str, manifest: dict, restart: bool) -> set[int]:
+    """
+    Create the output directory, or find the parts written by an interrupted run of the same job.
+    Returns:
+        The indexes of the chunks already scored.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    parts = sorted(name for name in os.listdir(output_dir) if name.startswith("part-"))
+    if os.path.exists(manifest_path) and not restart:
+        with open(manifest_path) as file:
+            previous = json.load(file)
+        previous.pop("completed", None)
+        if previous != manifest:
+            raise ValueError(f"{output_dir} holds the output of another job, pass --restart to replace it")
+    elif parts and not restart:
+        raise ValueError(f"{output_dir} holds parts of an unknown job, pass --restart to replace them")
+    if restart:
+        for name in parts:
+            os.remove(os.path.join(output_dir, name))
+        parts = []
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    return {int(name[5:11]) for name in parts if name.endswith(".parquet")}
+
+
+def run(input_path: str, output_dir: str, options: dict, workers: int, chunk_rows: int,
+        config_path: str = CONFIG_PATH, restart: bool = False) -> dict:
+    """
+    Score every chunk of the input that has no part in the output directory yet.
+    Returns:
+        dict: The rows scored and skipped, the elapsed seconds and the rate in rows per second.
+    """
+    stat = os.stat(input_path)
+    manifest = {
+        "input": os.path.abspath(input_path), "size": stat.st_size, "modified": stat.st_mtime,
+        "chunk_rows": chunk_rows, "options": options,
+    }
+    done = _prepare_output(output_dir, manifest, restart)
+    if done:
+        logger.info(f"Resuming: {len(done)} chunks were scored by an earlier run")
+
+    start = time.perf_counter()
+    scored = skipped = 0
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    def record(future) -> None:
+        nonlocal scored
+        index, rows, seconds = future.result()
+        scored += rows
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Chunk {index}: {rows} rows in {seconds:.2f}s, {scored} rows so far at {scored / elapsed:.0f} rows/s"
+        )
+
+    # spawned rather than forked, so no process inherits native thread pools started by another
+    context = multiprocessing.get_context("spawn")
+    initargs = (config_path, threads, options.get("radius") is not None)
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=initargs) as pool:
+        pending = set()
+        for index, chunk in enumerate(read_chunks(input_path, chunk_rows)):
+            if index == 0:
+                missing = missing_columns(chunk, options.get("eligibility"))
+                if missing:
+                    raise ValueError(f"{input_path} lacks the columns {missing}")
+            if index in done:
+                skipped += len(chunk)
+                continue
+            # a bounded window of chunks in flight keeps the memory independent of the input size
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future)
+            pending.add(pool.submit(_score_part, index, chunk, output_dir, options))
+        for future in wait(pending).done:
+            record(future)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "rows": scored, "skipped": skipped, "seconds": round(elapsed, 3),
+        "rows_per_second": round(scored / elapsed, 1) if elapsed else None,
+    }
+    with open(os.path.join(output_dir, MANIFEST), "w") as file:
+        json.dump({**manifest, "completed": summary}, file, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    from app.core import log
+
+    log.configure()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or Parquet file of listings")
+    parser.add_argument("output", help="Directory of the Parquet parts")
+    parser.add_argument("--model", default="xgb_1", help="Model of the listings without a model column")
+    parser.add_argument("--city", default=None, help="City of the listings without a city column")
+    parser.add_argument("--radius", type=float, default=None, help="Add the price statistics within this many km")
+    parser.add_argument("--eligibility", choices=["facility", "land"], default=None,
+                        help="Add the eligible chains; the input needs the criteria of that kind of request")
+    parser.add_argument("--workers", type=int, default=0, help="Scoring processes, 0 for one per core")
+    parser.add_argument("--chunk-rows", type=int, default=50_000, help="Rows per chunk and per part")
+    parser.add_argument("--config", default=CONFIG_PATH, help="config.yaml with the models and tables to load")
+    parser.add_argument("--restart", action="store_true", help="Discard the parts of an earlier run")
+    args = parser.parse_args()
+
+    options = {"model_name": args.model, "city": args.city, "radius": args.radius, "eligibility": args.eligibility}
+    try:
+        summary = run(
+            args.input, args.output, options, args.workers or os.cpu_count() or 1, args.chunk_rows, args.config,
+            args.restart,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    logger.info(f"Done: {summary}")
+
+
+if __name__ == "__main__":
+    main()
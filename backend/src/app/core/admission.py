@@ -0,0 +1,175 @@
+"""
+Admission control for the expensive routes.
+
+Each route listed under `admission.routes` in config.yaml runs at most `concurrency` requests at once. Further
+requests wait in a bounded queue, outside the threadpool, for at most `max_wait` seconds. A request is turned
+away at once when the queue is full or when its expected wait, from the recent service times of the route, is
+over that budget; a request still queued at its deadline is turned away then. Turned away requests get a 503
+with a Retry-After, so that clients back off instead of piling up behind requests bound to time out.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+enabled = True
+# radius queries whose latitude band holds more listings than this are refused before the scan, 0 for no limit
+max_radius_rows = 0
+# weight of the latest request in the moving average of the service time of a route
+SMOOTHING = 0.2
+
+rejections = metrics.Counter(
+    "admission_rejections_total", "Requests turned away by admission control, by route and reason", ("route", "reason")
+)
+wait_latency = metrics.Histogram(
+    "admission_wait_seconds", "Time requests waited for a slot of their route", ("route",)
+)
+
+
+class Rejected(Exception):
+    """A request turned away; `retry_after` is the number of seconds after which a retry should be admitted."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RouteLimiter:
+    """
+    The concurrency limit and the queue of one route.
+    Args:
+        route: The path of the route
+        concurrency: Requests running at once
+        queue: Requests waiting for a slot at most
+        max_wait: Seconds a request may wait for a slot
+    """
+
+    def __init__(self, route: str, concurrency: int, queue: int, max_wait: float):
+        self.route = route
+        self.concurrency = max(1, concurrency)
+        self.queue = max(0, queue)
+        self.max_wait = max_wait
+        self.active = 0
+        # futures of the waiting requests, in arrival order; a slot is handed over by popping one
+        self.waiters: deque[asyncio.Future] = deque()
+        self.service_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def expected_wait(self, position: int) -> float:
+        """Seconds until the request at that position of the queue gets a slot, 0 before any request finished."""
+        if self.service_time is None:
+            return 0.0
+        return math.ceil(position / self.concurrency) * self.service_time
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(min(self.expected_wait(len(self.waiters) + 1), self.max_wait)))
+
+    def _reject(self, reason: str, retry_after: int) -> Rejected:
+        rejections.inc(self.route, reason)
+        return Rejected(reason, retry_after)
+
+    async def acquire(self) -> None:
+        """Wait for a slot of the route; raises Rejected when the request should not wait."""
+        start = time.perf_counter()
+        with self._lock:
+            if self.active < self.concurrency and not self.waiters:
+                self.active += 1
+                return
+            if len(self.waiters) >= self.queue:
+                raise self._reject("queue_full", self._retry_after())
+            if self.expected_wait(len(self.waiters) + 1) > self.max_wait:
+                raise self._reject("wait_budget", self._retry_after())
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # the client went away: give up the place in the queue, or the slot handed over meanwhile
+            if not self._withdraw(waiter):
+                self.release()
+            raise
+        if self._withdraw(waiter):
+            raise self._reject("deadline", self._retry_after())
+        if metrics.enabled:
+            wait_latency.observe(time.perf_counter() - start, self.route)
+
+    def _withdraw(self, waiter: asyncio.Future) -> bool:
+        """Take a request out of the queue; False when `release` already handed it a slot."""
+        with self._lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                return True
+            return False
+
+    def release(self, seconds: Optional[float] = None) -> None:
+        """Free the slot of a request that ran for `seconds`, handing it to the oldest waiting request."""
+        with self._lock:
+            if seconds is not None:
+                previous = self.service_time
+                self.service_time = seconds if previous is None else previous + SMOOTHING * (seconds - previous)
+            if self.waiters:
+                waiter = self.waiters.popleft()
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+            else:
+                self.active -= 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency, "queue": self.queue, "max_wait": self.max_wait,
+                "active": self.active, "queued": len(self.waiters), "service_time": self.service_time,
+            }
+
+
+limiters: dict[str, RouteLimiter] = {}
+
+
+def configure(config) -> None:
+    """Apply the `admission` section of config.yaml."""
+    global enabled, max_radius_rows, limiters
+    enabled = bool(config.get("enabled", enabled))
+    max_radius_rows = int(config.get("max_radius_rows", max_radius_rows))
+    limiters = {
+        route: RouteLimiter(
+            route, int(limits.get("concurrency", 8)), int(limits.get("queue", 32)), float(limits.get("max_wait", 2.0))
+        )
+        for route, limits in (config.get("routes") or {}).items()
+    }
+
+
+def limiter_for(path: str) -> Optional[RouteLimiter]:
+    """The limiter of the route at that path, None for the routes without limits."""
+    if not enabled:
+        return None
+    return limiters.get(path)
+
+
+def status() -> dict:
+    return {"enabled": enabled, "max_radius_rows": max_radius_rows,
+            "routes": {route: limiter.status() for route, limiter in limiters.items()}}
+
+
+def _queue_depths() -> dict[tuple, float]:
+    depths = {}
+    for route, limiter in limiters.items():
+        with limiter._lock:
+            depths[(route, "active")] = limiter.active
+            depths[(route, "queued")] = len(limiter.waiters)
+    return depths
+
+
+metrics.Gauge("admission_requests", "Requests running and waiting for a slot, by route", ("route", "state"),
+              callback=_queue_depths)
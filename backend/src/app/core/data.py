@@ -1,32 +1,390 @@
-import math
+import io
+import logging
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Iterator, Optional
 
+import numpy as np
 import pandas as pd
+from app.core import metrics
 
+try:
+    import fcntl
+except ImportError:  # Windows: no locking between processes, a single process serves the dataset
+    fcntl = None
 
-data = pd.read_csv("./backend/data/prices.csv")
+logger = logging.getLogger(__name__)
 
-# Haversine formula to calculate the distance between two points on Earth
+PRICES_PATH = "./backend/data/prices.csv"
+EARTH_RADIUS_KM = 6371
+# Rows scanned per step when streaming a radius query
+CHUNK_ROWS = 8192
+COLUMNS = ["price_per_meter", "latitude", "longitude"]
+COORDINATES = ["latitude", "longitude"]
+JOURNAL_COLUMNS = [*COLUMNS, "upsert"]
+
+# The published snapshot, sorted by latitude so that a radius query only scans the rows of its latitude band.
+# It is never modified in place: ingestion builds a new frame and swaps the reference, so readers need no lock.
+data: Optional[pd.DataFrame] = None
+version = 0
+# Ingested batches are appended here and replayed by load_data, so they survive a restart. The journal is also how
+# the worker processes share them: a process appends under an exclusive file lock, and every process applies what
+# the others appended when it next reads the dataset.
+journal_path: Optional[str] = None
+_base_path = PRICES_PATH
+# (inode, size) of the journal applied to `data`; a new inode means another process compacted it
+_journal_position: Optional[tuple[int, int]] = None
+
+_write_lock = threading.RLock()
+
+
+def _dataset_stats() -> dict[tuple, float]:
+    if data is None:
+        return {}
+    return {("rows",): len(data), ("version",): version}
+
+
+metrics.Gauge("price_dataset", "Listings and version of the served price dataset", ("stat",), callback=_dataset_stats)
+
+
+def index_by_latitude(frame: pd.DataFrame) -> pd.DataFrame:
+    """The listings sorted by latitude, the order every query relies on to narrow its scan."""
+    return frame.sort_values("latitude", kind="mergesort", ignore_index=True)
+
+
+def set_data(frame: pd.DataFrame) -> pd.DataFrame:
+    """Index the listings by latitude and make them the dataset served by the radius queries."""
+    global data, version
+    data = index_by_latitude(frame)
+    version += 1
+    return data
+
+
+def load_data(path: str = PRICES_PATH, journal: Optional[str] = None) -> pd.DataFrame:
+    """Read the price dataset, replay and compact the ingestion journal if there is one, and serve the result."""
+    global journal_path, _base_path, _journal_position
+    with _write_lock:
+        journal_path, _base_path, _journal_position = journal, path, None
+        set_data(pd.read_csv(path))
+        if journal:
+            with _journal_lock(exclusive=True):
+                entries = _catch_up()
+                if entries is not None:
+                    _compact(entries)
+        return data
+
+
+@contextmanager
+def _journal_lock(exclusive: bool):
+    """Serialize the journal between processes: appending and compacting are exclusive, reading it is shared."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{journal_path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _journal_stat() -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(journal_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size
+
+
+def _catch_up() -> Optional[pd.DataFrame]:
+    """
+    Apply the journal entries this process has not applied yet, under `_write_lock` and the journal lock.
+    Returns:
+        The entries applied, None when there were none.
+    """
+    global _journal_position
+    position = _journal_stat()
+    if position == _journal_position:
+        return None
+    offset = 0
+    if _journal_position is not None:
+        if position is not None and position[0] == _journal_position[0] and position[1] >= _journal_position[1]:
+            offset = _journal_position[1]
+        else:
+            # compacted or removed since: the journal is applied again to the base listings
+            set_data(pd.read_csv(_base_path))
+    entries = None
+    if position is not None:
+        with open(journal_path, "rb") as file:
+            file.seek(offset)
+            chunk = file.read(position[1] - offset)
+        if chunk.strip():
+            entries = pd.read_csv(io.BytesIO(chunk), **({} if offset == 0 else {"header": None, "names": JOURNAL_COLUMNS}))
+            # consecutive rows of one mode were ingested together or are equivalent to that
+            runs = (entries["upsert"] != entries["upsert"].shift()).cumsum()
+            for _, batch in entries.groupby(runs, sort=False):
+                _apply(batch[COLUMNS].astype(float), upsert=bool(batch["upsert"].iloc[0]))
+            logger.info(f"Replayed {len(entries)} ingested listings from {journal_path}")
+    _journal_position = position
+    return entries
+
+
+def _compact(entries: pd.DataFrame) -> None:
+    """
+    Rewrite the journal as the listings now served at the coordinates it touched, when that is shorter: the first
+    listing of each coordinates upserted, the others added next to it. Runs under the exclusive journal lock.
+    """
+    global _journal_position
+    rows = data[pd.MultiIndex.from_frame(data[COORDINATES]).isin(pd.MultiIndex.from_frame(entries[COORDINATES]))]
+    first = ~rows.duplicated(COORDINATES)
+    compacted = pd.concat([rows[first].assign(upsert=True), rows[~first].assign(upsert=False)])[JOURNAL_COLUMNS]
+    if len(compacted) >= len(entries):
+        return
+    temporary = f"{journal_path}.{os.getpid()}.tmp"
+    compacted.to_csv(temporary, index=False)
+    os.replace(temporary, journal_path)
+    _journal_position = _journal_stat()
+    logger.info(f"Compacted {journal_path} from {len(entries)} to {len(compacted)} listings")
+
+
+def get_data(city: Optional[str] = None) -> pd.DataFrame:
+    """
+    Return the price dataset, loading it on first use.
+    Args:
+        city: A city with a shard of its own gets the listings of its shard, see `shards.shard_for`;
+            any other city, or none, the dataset of the default city
+    """
+    if city is not None:
+        from app.core import shards
+
+        shard = shards.shard_for(city)
+        if shard is not None:
+            return shard.prices
+    if data is None:
+        return load_data()
+    if journal_path and _journal_stat() != _journal_position:
+        with _write_lock, _journal_lock(exclusive=False):
+            _catch_up()
+    return data
+
+
+# Haversine formula to calculate the distance between two points on Earth, for scalars or numpy arrays
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Radius of the Earth in kilometers
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
+    R = EARTH_RADIUS_KM  # Radius of the Earth in kilometers
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
 
-    a = (math.sin(dlat / 2) ** 2 +
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-         math.sin(dlon / 2) ** 2)
+    a = (np.sin(dlat / 2) ** 2 +
+         np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) *
+         np.sin(dlon / 2) ** 2)
 
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     distance = R * c  # Distance in kilometers
     return distance
 
 
+def latitude_band(frame: pd.DataFrame, center_lat, radius) -> tuple[int, int]:
+    """Positions of the first and past-the-last rows whose latitude can lie within `radius` km of `center_lat`."""
+    delta = np.degrees(radius / EARTH_RADIUS_KM)
+    latitudes = frame["latitude"].to_numpy()
+    return (
+        int(np.searchsorted(latitudes, center_lat - delta, side="left")),
+        int(np.searchsorted(latitudes, center_lat + delta, side="right")),
+    )
+
+
+def _within_radius(frame: pd.DataFrame, center_lat, center_lon, radius) -> pd.DataFrame:
+    distances = haversine(center_lat, center_lon, frame["latitude"].to_numpy(), frame["longitude"].to_numpy())
+    return frame[distances <= radius]
+
+
+def select_within_radius(center_lat, center_lon, radius, city: Optional[str] = None) -> pd.DataFrame:
+    """Return the rows of the price dataset of `city` within `radius` kilometers of the center, as a DataFrame."""
+    frame = get_data(city)
+    with metrics.stage("distance"):
+        start, stop = latitude_band(frame, center_lat, radius)
+        return _within_radius(frame.iloc[start:stop], center_lat, center_lon, radius)
+
+
+def iter_within_radius(
+    center_lat, center_lon, radius, chunk_rows: int = CHUNK_ROWS, city: Optional[str] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield the rows within `radius` kilometers of the center chunk by chunk, scanning `chunk_rows` rows of the
+    latitude band at a time, so that the memory used does not depend on the number of matching rows.
+    Chunks without matches are skipped. The whole stream reads the snapshot current at the time of the call.
+    """
+    return _iter_within_radius(get_data(city), center_lat, center_lon, radius, chunk_rows)
+
+
+def _iter_within_radius(frame: pd.DataFrame, center_lat, center_lon, radius, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    start, stop = latitude_band(frame, center_lat, radius)
+    for offset in range(start, stop, chunk_rows):
+        chunk = _within_radius(frame.iloc[offset:min(offset + chunk_rows, stop)], center_lat, center_lon, radius)
+        if len(chunk):
+            yield chunk
+
+
 # Function to return all prices within a specified radius
-def get_prices_within_radius(center_lat, center_lon, radius):
-    prices_within_radius = []
+def get_prices_within_radius(center_lat, center_lon, radius, city: Optional[str] = None):
+    prices = select_within_radius(center_lat, center_lon, radius, city)
 
-    for _, entry in data.iterrows():
-        distance = haversine(center_lat, center_lon, entry["latitude"], entry["longitude"])
-        if distance <= radius:
-            prices_within_radius.append(entry.to_dict())
+    with metrics.stage("serialize"):
+        prices_within_radius = prices.to_dict("records")
 
     return prices_within_radius
+
+
+def select_within_polygon(polygon, city: Optional[str] = None) -> pd.DataFrame:
+    """
+    Return the rows of the price dataset inside a polygon, as a DataFrame.
+    Args:
+        polygon: A `geo.PreparedPolygon`; the latitude index narrows the rows to its bounding box before the test.
+    """
+    frame = get_data(city)
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    with metrics.stage("polygon"):
+        latitudes = frame["latitude"].to_numpy()
+        start = int(np.searchsorted(latitudes, min_lat, side="left"))
+        stop = int(np.searchsorted(latitudes, max_lat, side="right"))
+        band = frame.iloc[start:stop]
+        return band[polygon.contains(band["latitude"].to_numpy(), band["longitude"].to_numpy())]
+
+
+def nearest(center_lat, center_lon, k: int, city: Optional[str] = None) -> pd.DataFrame:
+    """The `k` listings of `city` closest to the point, nearest first, with their distance in kilometers."""
+    frame = get_data(city)
+    with metrics.stage("distance"):
+        distances = haversine(center_lat, center_lon, frame["latitude"].to_numpy(), frame["longitude"].to_numpy())
+        closest = np.argpartition(distances, k - 1)[:k] if k < len(frame) else np.arange(len(frame))
+        closest = closest[np.argsort(distances[closest])]
+        return frame.iloc[closest].assign(distance=distances[closest]).reset_index(drop=True)
+
+
+def describe_prices(prices: np.ndarray) -> dict[str, Optional[float]]:
+    """Count, mean, median, min and max of prices per meter."""
+    if len(prices) == 0:
+        return {"count": 0.0, "mean": None, "median": None, "min": None, "max": None}
+    return {
+        "count": float(len(prices)),
+        "mean": float(prices.mean()),
+        "median": float(np.median(prices)),
+        "min": float(prices.min()),
+        "max": float(prices.max()),
+    }
+
+
+def price_stats(center_lat, center_lon, radius, city: Optional[str] = None) -> dict[str, Optional[float]]:
+    """Price statistics of the listings of `city` within `radius` kilometers of the center."""
+    return describe_prices(select_within_radius(center_lat, center_lon, radius, city)["price_per_meter"].to_numpy())
+
+
+STATS = ["count", "mean", "median", "min", "max"]
+
+
+def price_stats_many(latitudes, longitudes, radius, city: Optional[str] = None) -> pd.DataFrame:
+    """
+    `price_stats` around many centers at once, one row per center with the columns of `STATS`.
+    The latitude bands of all the centers are found in one search; only the distances are computed per center.
+    """
+    frame = get_data(city)
+    latitudes, longitudes = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+    listing_lat, listing_lon = frame["latitude"].to_numpy(), frame["longitude"].to_numpy()
+    prices = frame["price_per_meter"].to_numpy()
+    delta = np.degrees(radius / EARTH_RADIUS_KM)
+    stats = np.full((len(latitudes), len(STATS)), np.nan)
+    stats[:, 0] = 0
+    with metrics.stage("distance"):
+        starts = np.searchsorted(listing_lat, latitudes - delta, side="left")
+        stops = np.searchsorted(listing_lat, latitudes + delta, side="right")
+        for row, (start, stop) in enumerate(zip(starts, stops)):
+            distances = haversine(latitudes[row], longitudes[row], listing_lat[start:stop], listing_lon[start:stop])
+            within = prices[start:stop][distances <= radius]
+            if len(within):
+                stats[row] = len(within), within.mean(), np.median(within), within.min(), within.max()
+    return pd.DataFrame(stats, columns=STATS)
+
+
+def polygon_price_stats(polygon, city: Optional[str] = None) -> dict[str, Optional[float]]:
+    """Price statistics of the listings of `city` inside a `geo.PreparedPolygon`."""
+    return describe_prices(select_within_polygon(polygon, city)["price_per_meter"].to_numpy())
+
+
+def _insert_sorted(frame: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """Merge rows into a frame sorted by latitude in one linear pass, without re-sorting the frame."""
+    rows = rows.sort_values("latitude", kind="mergesort")
+    positions = np.searchsorted(frame["latitude"].to_numpy(), rows["latitude"].to_numpy(), side="right")
+    return pd.DataFrame({
+        column: np.insert(frame[column].to_numpy(), positions, rows[column].to_numpy()) for column in frame.columns
+    })
+
+
+def ingest(listings: pd.DataFrame, upsert: bool = False, record: bool = True) -> dict[str, int]:
+    """
+    Add listings to the price dataset and publish the result as a new snapshot.
+
+    Listings that match an existing one on coordinates and price are skipped. With `upsert`, a listing
+    replaces the existing listings at the same coordinates; otherwise it is added next to them.
+    Writers are serialized, across processes when a journal is configured; readers keep the snapshot they started
+    with and never wait.
+    Args:
+        listings: Rows with the columns of prices.csv
+        upsert: Replace the price of listings with the same coordinates
+        record: Append the listings to the journal, if one is configured
+
+    Returns:
+        dict[str, int]: The new version and the number of added, updated and skipped listings.
+    """
+    global _journal_position
+    listings = listings[COLUMNS].astype(float)
+    journaled = record and journal_path is not None
+    with _write_lock, _journal_lock(exclusive=True) if journaled else nullcontext():
+        if data is None:
+            get_data()
+        if journaled:
+            # the listings the other processes ingested are applied first, the changes are computed against them
+            _catch_up()
+        changed, updated = _apply(listings, upsert)
+        if journaled and len(changed):
+            text = changed.assign(upsert=upsert)[JOURNAL_COLUMNS].to_csv(index=False, header=not (_journal_position and _journal_position[1]))
+            with open(journal_path, "ab") as file:
+                file.write(text.encode())
+            _journal_position = _journal_stat()
+        result = {
+            "version": version,
+            "rows": len(data),
+            "added": len(changed) - updated,
+            "updated": updated,
+            "duplicates": len(listings) - len(changed),
+        }
+    logger.info(f"Ingested listings: {result}")
+    return result
+
+
+def _apply(listings: pd.DataFrame, upsert: bool) -> tuple[pd.DataFrame, int]:
+    """
+    Publish the dataset with the listings merged in, under `_write_lock`.
+    Returns:
+        The listings that changed the dataset, and how many of them updated existing coordinates.
+    """
+    global data, version
+    current = data
+    unique = listings.drop_duplicates(COORDINATES if upsert else COLUMNS, keep="last")
+    current_keys = pd.MultiIndex.from_frame(current[COLUMNS])
+    unique_keys = pd.MultiIndex.from_frame(unique[COLUMNS])
+    new = unique[~unique_keys.isin(current_keys)]
+    # the listings that change the dataset, and so are journaled: with upsert, a listing that exists already
+    # still removes the other prices at its coordinates
+    changed = new
+    updated = 0
+    if upsert:
+        current_coordinates = pd.MultiIndex.from_frame(current[COORDINATES])
+        unique_coordinates = pd.MultiIndex.from_frame(unique[COORDINATES])
+        replaced = current_coordinates.isin(unique_coordinates) & ~current_keys.isin(unique_keys)
+        changed = unique[~unique_keys.isin(current_keys) | unique_coordinates.isin(current_coordinates[replaced])]
+        updated = int(pd.MultiIndex.from_frame(changed[COORDINATES]).isin(current_coordinates).sum())
+        current = current[~replaced]
+    data = _insert_sorted(current, new)
+    version += 1
+    return changed, updated
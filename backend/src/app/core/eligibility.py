@@ -1,6 +1,13 @@
+from bisect import bisect_left
+from typing import Optional
+
 from app.api import schemas
+import numpy as np
 import pandas as pd
 
+FACILITY_TABLE_PATH = "./backend/data/facility.xlsx"
+LAND_TABLE_PATH = "./backend/data/land.xlsx"
+
 
 facility_column_mapping = {
     "Сеть": "chain",
@@ -20,9 +27,7 @@ facility_column_mapping = {
     "Max floor": "max_floor"
 }
 
-facility_eligibility_table = pd.read_excel("./backend/data/facility.xlsx")
-facility_eligibility_table.columns = [facility_column_mapping[column.strip()] for column in facility_eligibility_table.columns]
-facility_eligibility_table.replace({'да': True}, inplace=True)
+facility_eligibility_table: Optional[pd.DataFrame] = None
 
 
 land_column_mapping = {
@@ -35,15 +40,208 @@ land_column_mapping = {
     "Наличие всех коммуникации": "utilities"
 }
 
-land_eligibility_table = pd.read_excel("./backend/data/land.xlsx")
-land_eligibility_table.columns = [land_column_mapping[column.strip()] for column in land_eligibility_table.columns]
-land_eligibility_table.replace({'да': True}, inplace=True)
+land_eligibility_table: Optional[pd.DataFrame] = None
+
+# `compiled` answers from the decision tables built when the criteria are loaded, `rows` evaluates every row
+evaluator = "compiled"
+
+# Boolean criteria: the request field and the column it has to match when the column is set
+facility_flags = {
+    "near_residential_area": "high_pedestrian_traffic",
+    "high_vehicle_traffic": "high_vehicle_traffic",
+    "nearby_facilities": "nearby_facilities",
+    "utilities": "utilities",
+    "sanitary_facility": "sanitary_facility",
+    "cargo_unloading": "cargo_unloading",
+    "parking_available": "parking_available",
+}
+# Numeric criteria: the request field and the columns of its inclusive lower and upper bounds
+facility_bounds = [
+    ("total_area", "min_area", "max_area"),
+    ("floor", "min_floor", "max_floor"),
+    ("ceiling_height", "min_ceiling_height", None),
+]
+
+land_flags = {
+    "near_residential_area": "near_residential_area",
+    "high_vehicle_traffic": "high_vehicle_traffic",
+    "utilities": "utilities",
+}
+land_bounds = [("total_area", "min_area", None)]
+
+
+def configure(config) -> None:
+    """Apply the `eligibility` section of config.yaml."""
+    global evaluator
+    evaluator = config.get("evaluator", evaluator)
+    if evaluator not in ("compiled", "rows"):
+        raise ValueError(f"Unknown eligibility evaluator {evaluator}, expected compiled or rows")
+
+
+def read_eligibility_table(path: str, column_mapping: dict[str, str]) -> pd.DataFrame:
+    table = pd.read_excel(path)
+    table.columns = [column_mapping[column.strip()] for column in table.columns]
+    table.replace({'да': True}, inplace=True)
+    return table
+
+
+def load_facility_table(path: str = FACILITY_TABLE_PATH) -> pd.DataFrame:
+    global facility_eligibility_table
+    facility_eligibility_table = read_eligibility_table(path, facility_column_mapping)
+    if evaluator == "compiled":
+        get_facility_decision_table()
+    return facility_eligibility_table
+
+
+def load_land_table(path: str = LAND_TABLE_PATH) -> pd.DataFrame:
+    global land_eligibility_table
+    land_eligibility_table = read_eligibility_table(path, land_column_mapping)
+    if evaluator == "compiled":
+        get_land_decision_table()
+    return land_eligibility_table
+
+
+def get_facility_table() -> pd.DataFrame:
+    """Return the facility criteria table, loading it on first use."""
+    if facility_eligibility_table is None:
+        return load_facility_table()
+    return facility_eligibility_table
+
+
+def get_land_table() -> pd.DataFrame:
+    """Return the land criteria table, loading it on first use."""
+    if land_eligibility_table is None:
+        return load_land_table()
+    return land_eligibility_table
+
+
+def _records(table: pd.DataFrame) -> list[dict]:
+    """The rows of a criteria table as dicts, with None for the criteria that are not set."""
+    return [
+        {key: None if pd.isna(value) else value for key, value in row.items()}
+        for row in table.to_dict("records")
+    ]
+
+
+def _bitset(rows) -> int:
+    """The positions of the true values as the bits of an int."""
+    return sum(1 << position for position, matches in enumerate(rows) if matches)
+
+
+class Breakpoints:
+    """
+    The rows whose bounds admit a value, for every value of one numeric criterion.
+    The sorted thresholds split the number line into the thresholds themselves and the open intervals between
+    them; every row admits either all the values of such a slot or none, so one row set per slot is enough.
+    """
+
+    def __init__(self, table: pd.DataFrame, field: str, lower: Optional[str], upper: Optional[str]):
+        self.field = field
+        lows = table[lower].to_numpy(dtype=float) if lower else None
+        highs = table[upper].to_numpy(dtype=float) if upper else None
+        thresholds = pd.concat([table[column] for column in (lower, upper) if column]).dropna().astype(float)
+        self.thresholds = sorted(thresholds.unique())
+
+        # a value below, at and above every threshold
+        edges = [self.thresholds[0] - 1] if self.thresholds else [0.0]
+        for index, threshold in enumerate(self.thresholds):
+            following = self.thresholds[index + 1] if index + 1 < len(self.thresholds) else threshold + 2
+            edges += [threshold, (threshold + following) / 2]
+        self.slot_rows = []
+        for value in edges:
+            admits = np.ones(len(table), dtype=bool)
+            if lows is not None:
+                admits &= np.isnan(lows) | (lows <= value)
+            if highs is not None:
+                admits &= np.isnan(highs) | (value <= highs)
+            self.slot_rows.append(_bitset(admits))
+
+    def rows(self, value) -> int:
+        index = bisect_left(self.thresholds, value)
+        if index < len(self.thresholds) and self.thresholds[index] == value:
+            return self.slot_rows[2 * index + 1]
+        return self.slot_rows[2 * index]
+
+
+class DecisionTable:
+    """
+    A criteria table compiled for constant time checks.
+
+    Every combination of the boolean criteria of a request indexes the set of rows it satisfies, held as the bits
+    of an int, and every numeric criterion maps its value to a row set through `Breakpoints`. A check is then one
+    lookup, a binary search per numeric criterion and the intersection of the row sets.
+    """
+
+    def __init__(self, table: pd.DataFrame, flags: dict[str, str], bounds: list[tuple]):
+        self.table = table
+        self.flag_fields = list(flags)
+        columns = [table[column].tolist() for column in flags.values()]
+        self.flag_rows = []
+        for mask in range(2 ** len(flags)):
+            values = [bool(mask >> position & 1) for position in range(len(flags))]
+            self.flag_rows.append(_bitset(
+                all(pd.isna(required) or value == required for value, required in zip(values, row))
+                for row in zip(*columns)
+            ))
+        self.breakpoints = [Breakpoints(table, *bound) for bound in bounds]
+        self.records = _records(table)
+
+    def eligible(self, request) -> list[dict]:
+        """The criteria rows the request satisfies, in table order. The dicts are shared, do not modify them."""
+        mask = 0
+        for position, field in enumerate(self.flag_fields):
+            if getattr(request, field):
+                mask |= 1 << position
+        rows = self.flag_rows[mask]
+        for breakpoints in self.breakpoints:
+            rows &= breakpoints.rows(getattr(request, breakpoints.field))
+        eligible = []
+        while rows:
+            lowest = rows & -rows
+            eligible.append(self.records[lowest.bit_length() - 1])
+            rows ^= lowest
+        return eligible
+
+
+facility_decision_table: Optional[DecisionTable] = None
+land_decision_table: Optional[DecisionTable] = None
+
+
+def get_facility_decision_table() -> DecisionTable:
+    """Return the compiled facility criteria, compiling them again whenever the table is replaced."""
+    global facility_decision_table
+    table = get_facility_table()
+    if facility_decision_table is None or facility_decision_table.table is not table:
+        facility_decision_table = DecisionTable(table, facility_flags, facility_bounds)
+    return facility_decision_table
+
+
+def get_land_decision_table() -> DecisionTable:
+    """Return the compiled land criteria, compiling them again whenever the table is replaced."""
+    global land_decision_table
+    table = get_land_table()
+    if land_decision_table is None or land_decision_table.table is not table:
+        land_decision_table = DecisionTable(table, land_flags, land_bounds)
+    return land_decision_table
 
 
 def check_eligibility_facility(user_input: schemas.FacilityEligibilityRequest) -> list[dict[str, str]]:
+    if evaluator == "compiled":
+        return get_facility_decision_table().eligible(user_input)
+    return evaluate_facility_rows(user_input)
+
+
+def check_eligibility_land(user_input: schemas.LandEligibilityRequest) -> list[dict[str, str]]:
+    if evaluator == "compiled":
+        return get_land_decision_table().eligible(user_input)
+    return evaluate_land_rows(user_input)
+
+
+def evaluate_facility_rows(user_input: schemas.FacilityEligibilityRequest) -> list[dict[str, str]]:
+    """Check the request against every row of the facility criteria; the reference for `DecisionTable`."""
     eligible_categories = []
 
-    for _, criteria in facility_eligibility_table.iterrows():
+    for _, criteria in get_facility_table().iterrows():
         # Check each criterion only if the value is not NaN (None)
         is_eligible = True
 
@@ -82,10 +280,11 @@ def check_eligibility_facility(user_input: schemas.FacilityEligibilityRequest) -
     return eligible_categories
 
 
-def check_eligibility_land(user_input: schemas.LandEligibilityRequest) -> list[dict[str, str]]:
+def evaluate_land_rows(user_input: schemas.LandEligibilityRequest) -> list[dict[str, str]]:
+    """Check the request against every row of the land criteria; the reference for `DecisionTable`."""
     eligible_categories = []
 
-    for _, criteria in land_eligibility_table.iterrows():
+    for _, criteria in get_land_table().iterrows():
         is_eligible = True
 
         if pd.notna(criteria["min_area"]) and not (criteria["min_area"] <= user_input.total_area):
@@ -0,0 +1,192 @@
+"""
+Feature contributions of a prediction, per attribute of the listing.
+
+XGBoost models report exact TreeSHAP values through `pred_contribs`. Other models get KernelSHAP estimates
+against a background set of listings; without the configured background file they are measured against the
+single listing used for the warmup, and the explanations say so with `background_fallback`. Everything that depends only on the model is cached per model version:
+the encoded background, its mean prediction and the least squares projection of the coalitions. An explanation
+then costs one batch prediction over coalitions x background rows.
+"""
+import logging
+import os
+from functools import lru_cache
+from math import comb
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from app.api import schemas
+from app.core import geo, metrics, shards
+from app.core.model import NUMERIC_FIELDS, ONE_HOT_FIELDS, city_model, city_model_version, encode, warmup_request
+
+logger = logging.getLogger(__name__)
+
+# Listings with the fields of schemas.PredictionRequest, the reference the contributions are measured against
+background_path: Optional[str] = None
+background_size = 20
+# Coalitions evaluated by KernelSHAP; all of them are used when there are fewer
+max_coalitions = 2048
+
+# Attributes the contributions are reported for. The coordinates and the distance derived from them move together
+LOCATION = "location"
+ATTRIBUTES = ["area", "floor", "time_to_station", "total_floors", LOCATION, *ONE_HOT_FIELDS.values()]
+
+
+def configure(config) -> None:
+    """Apply the `explain` section of config.yaml."""
+    global background_path, background_size, max_coalitions
+    background_path = config.get("background", background_path)
+    background_size = int(config.get("background_size", background_size))
+    max_coalitions = int(config.get("max_coalitions", max_coalitions))
+    _explainer.cache_clear()
+
+
+def attribute_of(feature: str) -> Optional[str]:
+    """The listing attribute an encoded feature is derived from."""
+    if feature in ("широта", "долгота", "distance_from_center"):
+        return LOCATION
+    if feature in NUMERIC_FIELDS:
+        return NUMERIC_FIELDS[feature]
+    for prefix, field in ONE_HOT_FIELDS.items():
+        if feature.startswith(prefix):
+            return field
+    return None
+
+
+def membership(feature_names) -> np.ndarray:
+    """Boolean matrix of attributes x features."""
+    return np.array([[attribute_of(feature) == attribute for feature in feature_names] for attribute in ATTRIBUTES])
+
+
+def load_background(model_name: str) -> tuple[pd.DataFrame, bool]:
+    """
+    A sample of the background listings, or the typical listing used for the warmup when none are configured.
+    Returns:
+        The listings, and whether they are that fallback listing.
+    """
+    if background_path and os.path.exists(background_path):
+        listings = pd.read_csv(background_path)
+        if len(listings) > background_size:
+            listings = listings.sample(background_size, random_state=0)
+        return listings.assign(model=model_name).reset_index(drop=True), False
+    logger.warning(
+        f"No explanation background at {background_path}, the contributions of {model_name} are measured against "
+        f"a single typical listing"
+    )
+    return pd.DataFrame([warmup_request.dict()]).assign(model=model_name), True
+
+
+def coalitions(size: int, budget: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Coalitions of attributes, excluding the empty and the full one, with their Shapley kernel weights.
+    All of them when they fit in the budget, otherwise a sample drawn with probability proportional to the kernel.
+    """
+    if 2 ** size - 2 <= budget:
+        codes = np.arange(1, 2 ** size - 1)
+        matrix = ((codes[:, None] >> np.arange(size)) & 1).astype(bool)
+        sizes = matrix.sum(axis=1)
+        weights = (size - 1) / (np.array([comb(size, k) for k in sizes]) * sizes * (size - sizes))
+        return matrix, weights
+    rng = np.random.default_rng(seed)
+    subset_sizes = np.arange(1, size)
+    size_weights = (size - 1) / (subset_sizes * (size - subset_sizes))
+    drawn = rng.choice(subset_sizes, budget, p=size_weights / size_weights.sum())
+    matrix = np.zeros((budget, size), dtype=bool)
+    for row, count in enumerate(drawn):
+        matrix[row, rng.choice(size, count, replace=False)] = True
+    return matrix, np.ones(budget)
+
+
+class KernelExplainer:
+    """KernelSHAP over the listing attributes, with the efficiency constraint built into the least squares."""
+
+    def __init__(self, model, background: pd.DataFrame, center: tuple[float, float], fallback: bool = False):
+        self.model = model
+        self.center = center
+        # measured against the single warmup listing rather than a background sample
+        self.fallback = fallback
+        self.background = encode(model, background, center).to_numpy()
+        self.expected_value = float(np.mean(model.predict(encode(model, background, center))))
+        self.groups = membership(model.feature_names_in_)
+        self.coalitions, weights = coalitions(len(ATTRIBUTES), max_coalitions)
+        # Substituting the last attribute by the constraint leaves an unconstrained weighted least squares
+        last = self.coalitions[:, -1:].astype(float)
+        design = self.coalitions[:, :-1] - last
+        weighted = design.T * weights
+        self.projection = np.linalg.solve(weighted @ design, weighted)
+        self.last = last.ravel()
+        # Feature mask of every coalition
+        self.masks = (self.coalitions.astype(float) @ self.groups.astype(float)) > 0
+
+    def explain(self, features: np.ndarray) -> tuple[float, np.ndarray]:
+        """The expected value and the contribution of every attribute for one encoded listing."""
+        rows = np.where(self.masks[:, None, :], features[None, None, :], self.background[None, :, :])
+        frame = pd.DataFrame(rows.reshape(-1, features.shape[0]), columns=self.model.feature_names_in_)
+        values = self.model.predict(frame).reshape(len(self.masks), len(self.background)).mean(axis=1)
+        prediction = float(self.model.predict(pd.DataFrame([features], columns=self.model.feature_names_in_))[0])
+        total = prediction - self.expected_value
+        partial = self.projection @ (values - self.expected_value - self.last * total)
+        return self.expected_value, np.append(partial, total - partial.sum())
+
+
+class TreeExplainer:
+    """Exact TreeSHAP values from XGBoost, summed per listing attribute."""
+
+    fallback = False
+
+    def __init__(self, model, center: tuple[float, float]):
+        self.model = model
+        self.center = center
+        self.groups = membership(model.feature_names_in_)
+
+    def explain_many(self, features: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        from xgboost import DMatrix
+
+        contributions = self.model.get_booster().predict(DMatrix(features), pred_contribs=True)
+        return contributions[:, -1], contributions[:, :-1] @ self.groups.T.astype(float)
+
+
+@lru_cache(maxsize=16)
+def _explainer(model_name: str, city: str, version: str):
+    model, center, _ = city_model(model_name, city)
+    logger.info(f"Preparing the explainer of {model_name} of {city} version {version}")
+    if hasattr(model, "get_booster"):
+        return TreeExplainer(model, center)
+    background, fallback = load_background(model_name)
+    return KernelExplainer(model, background, center, fallback)
+
+
+def explainer(model_name: str, city: Optional[str] = None):
+    """The explainer of the current version of a model of a city, prepared on first use."""
+    return _explainer(model_name, shards.served_city(city), city_model_version(model_name, city))
+
+
+def explain_frame(model_name: str, inputs: pd.DataFrame, city: Optional[str] = None) -> list[dict]:
+    """
+    Contributions of every attribute to the prediction of every listing.
+    Returns:
+        One dict per listing with the `base_value` the contributions add up from, the `contributions`, and
+        `background_fallback` when they are measured against a single typical listing instead of a background.
+    """
+    model_explainer = explainer(model_name, city)
+    shard = shards.shard_for(city)
+    inputs = geo.fill_missing(inputs) if shard is None else shard.fill_missing(inputs)
+    with metrics.stage("explain"):
+        features = encode(model_explainer.model, inputs, model_explainer.center)
+        if isinstance(model_explainer, TreeExplainer):
+            base_values, contributions = model_explainer.explain_many(features)
+        else:
+            explained = [model_explainer.explain(row) for row in features.to_numpy()]
+            base_values = np.array([base_value for base_value, _ in explained])
+            contributions = np.array([values for _, values in explained])
+    return [
+        {
+            "base_value": float(base_value), "contributions": dict(zip(ATTRIBUTES, values.tolist())),
+            "background_fallback": model_explainer.fallback,
+        }
+        for base_value, values in zip(base_values, contributions)
+    ]
+
+
+def explain(request: schemas.PredictionRequest) -> dict:
+    return explain_frame(request.model, pd.DataFrame([request.dict()]), request.city)[0]
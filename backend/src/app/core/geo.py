@@ -0,0 +1,376 @@
+"""
+Nearest metro stations and the containing okrug of a point, so that listings can be predicted from their
+coordinates alone.
+
+The stations are indexed by a k-d tree of their points on the unit sphere, and the okrug boundaries are prepared
+once into a grid of cells labeled with their okrug. A lookup is then a tree query and a grid read, with ray casting
+only near a boundary, for a single point or for a whole batch at once.
+"""
+import json
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371
+# Points tested against the edges of an okrug at once, bounding the points x edges intermediate arrays
+CONTAINS_CHUNK_POINTS = 4096
+# Side of the grid cells that locate a point in an okrug without testing the boundaries, about 300 m
+GRID_CELL_DEGREES = 0.003
+# Cells per side of the grid over the bounding box of a polygon query
+POLYGON_GRID_CELLS = 256
+
+
+class UnresolvedLocation(ValueError):
+    """A metro station or okrug is missing from a request and cannot be derived from its coordinates."""
+
+
+def unit_vectors(latitudes, longitudes) -> np.ndarray:
+    """Points of the unit sphere, one row per coordinate pair; the straight line distance grows with the arc."""
+    lat, lon = np.radians(np.atleast_1d(latitudes).astype(float)), np.radians(np.atleast_1d(longitudes).astype(float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class Stations:
+    """Metro stations in a k-d tree of their points on the unit sphere."""
+
+    def __init__(self, frame: pd.DataFrame):
+        from scipy.spatial import cKDTree
+
+        self.names = frame["name"].to_numpy(dtype=object)
+        self.distinct = len(set(self.names))
+        self.tree = cKDTree(unit_vectors(frame["latitude"], frame["longitude"]))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def nearest(self, latitudes, longitudes, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The `k` nearest distinct stations of every point.
+        Returns:
+            The station names and their distances in kilometers, both of shape (points, k), nearest first.
+            Stations sharing a name, such as the platforms of an interchange, count once at their closest.
+        """
+        points = unit_vectors(latitudes, longitudes)
+        k = min(k, self.distinct)
+        if k == 1:
+            chords, indices = self.tree.query(points, k=[1])
+            return self.names[indices], _arc_km(chords)
+        # a few extra candidates to make up for the stations dropped as duplicate names
+        chords, indices = self.tree.query(points, k=min(len(self.names), 3 * k))
+        names = np.empty((len(points), k), dtype=object)
+        kept = np.empty((len(points), k))
+        for row in range(len(points)):
+            _, first = np.unique(self.names[indices[row]], return_index=True)
+            first = np.sort(first)[:k]
+            names[row], kept[row] = self.names[indices[row, first]], chords[row, first]
+        return names, _arc_km(kept)
+
+
+def _arc_km(chords: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2, 1.0))
+
+
+def ring_edges(rings) -> np.ndarray:
+    """The edges of closed rings of (longitude, latitude) vertices, one (x1, y1, x2, y2) row per edge."""
+    rings = [np.asarray(ring, dtype=float) for ring in rings]
+    return np.vstack([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+
+
+def _near_edges(edges: np.ndarray, origin: tuple, cell: tuple, shape: tuple) -> np.ndarray:
+    """
+    The cells of a grid that an edge passes through, and their neighbours. Edges are sampled every half cell;
+    the neighbours cover the corners a sampled path can cut.
+    """
+    steps = np.ceil(2 * np.maximum(
+        np.abs(edges[:, 2] - edges[:, 0]) / cell[0], np.abs(edges[:, 3] - edges[:, 1]) / cell[1]
+    )).astype(int) + 2
+    owners = np.repeat(np.arange(len(edges)), steps)
+    fractions = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / (steps[owners] - 1)
+    x = edges[owners, 0] + fractions * (edges[owners, 2] - edges[owners, 0])
+    y = edges[owners, 1] + fractions * (edges[owners, 3] - edges[owners, 1])
+    rows = np.clip(np.floor((y - origin[1]) / cell[1]).astype(int), 0, shape[0] - 1)
+    columns = np.clip(np.floor((x - origin[0]) / cell[0]).astype(int), 0, shape[1] - 1)
+    crossed = np.zeros(shape, dtype=bool)
+    crossed[rows, columns] = True
+    padded = np.pad(crossed, 1)
+    near = np.zeros_like(crossed)
+    for dy in range(3):
+        for dx in range(3):
+            near |= padded[dy:dy + shape[0], dx:dx + shape[1]]
+    return near
+
+
+class PreparedPolygon:
+    """
+    A polygon, with holes and several parts under the even-odd rule, prepared for testing many points.
+
+    A grid over its bounding box marks the cells wholly inside, wholly outside and along the boundary. Points in
+    the first two are decided by their cell; the others are ray cast against the edges bucketed in their grid row
+    only, a few edges even for polygons with thousands of vertices.
+    """
+
+    OUTSIDE, INSIDE, BOUNDARY = 0, 1, 2
+
+    def __init__(self, edges: np.ndarray, cells: int = POLYGON_GRID_CELLS):
+        self.edges = edges
+        self.bounds = (*edges[:, :2].min(axis=0), *edges[:, :2].max(axis=0))
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        self.origin = (min_lon, min_lat)
+        self.cell = (max(max_lon - min_lon, 1e-9) / cells, max(max_lat - min_lat, 1e-9) / cells)
+        self.shape = (cells, cells)
+
+        # every edge in the bucket of each grid row its latitudes overlap
+        low = self._row(np.minimum(edges[:, 1], edges[:, 3]))
+        high = self._row(np.maximum(edges[:, 1], edges[:, 3]))
+        spans = high - low + 1
+        owners = np.repeat(np.arange(len(edges)), spans)
+        rows = low[owners] + np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+        order = np.argsort(rows, kind="stable")
+        self.band_edges = edges[owners[order]]
+        self.band_offsets = np.searchsorted(rows[order], np.arange(cells + 1))
+
+        centers_lon, centers_lat = np.meshgrid(
+            min_lon + (np.arange(cells) + 0.5) * self.cell[0], min_lat + (np.arange(cells) + 0.5) * self.cell[1]
+        )
+        grid = self._exact(centers_lon.ravel(), centers_lat.ravel()).reshape(self.shape).astype(np.int8)
+        grid[_near_edges(edges, self.origin, self.cell, self.shape)] = self.BOUNDARY
+        self.grid = grid
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+    def _row(self, latitudes: np.ndarray) -> np.ndarray:
+        return np.clip(np.floor((latitudes - self.origin[1]) / self.cell[1]).astype(int), 0, self.shape[0] - 1)
+
+    def _column(self, longitudes: np.ndarray) -> np.ndarray:
+        return np.clip(np.floor((longitudes - self.origin[0]) / self.cell[0]).astype(int), 0, self.shape[1] - 1)
+
+    def _exact(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Ray casting of every point against the edges of its grid row."""
+        inside = np.zeros(len(x), dtype=bool)
+        rows = self._row(y)
+        order = np.argsort(rows, kind="stable")
+        starts = np.searchsorted(rows[order], np.arange(self.shape[0] + 1))
+        for row in np.flatnonzero(np.diff(starts)):
+            edges = self.band_edges[self.band_offsets[row]:self.band_offsets[row + 1]]
+            points = order[starts[row]:starts[row + 1]]
+            for start in range(0, len(points), CONTAINS_CHUNK_POINTS):
+                chunk = points[start:start + CONTAINS_CHUNK_POINTS]
+                inside[chunk] = _inside(edges, x[chunk], y[chunk])
+        return inside
+
+    def contains(self, latitudes, longitudes) -> np.ndarray:
+        """Whether every point lies inside the polygon."""
+        latitudes, longitudes = np.atleast_1d(latitudes).astype(float), np.atleast_1d(longitudes).astype(float)
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        candidates = np.flatnonzero(
+            (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+        )
+        codes = self.grid[self._row(latitudes[candidates]), self._column(longitudes[candidates])]
+        inside = np.zeros(len(latitudes), dtype=bool)
+        inside[candidates[codes == self.INSIDE]] = True
+        boundary = candidates[codes == self.BOUNDARY]
+        inside[boundary] = self._exact(longitudes[boundary], latitudes[boundary])
+        return inside
+
+
+class Okrugs:
+    """
+    Okrug boundaries prepared for point in polygon tests.
+
+    A grid over all the okrugs holds the okrug of every cell that no boundary crosses, so most points are located
+    by their cell alone. Points in the cells along the boundaries are tested against the edges of the okrugs
+    whose bounding box contains them.
+    """
+
+    BOUNDARY = -2
+
+    def __init__(self, features: list[dict], cell_degrees: float = GRID_CELL_DEGREES):
+        self.names = []
+        self.boxes = []
+        self.edges = []
+        for feature in features:
+            geometry = feature["geometry"]
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+            # every ring, outer or hole, of every part: an even number of crossings means outside
+            edges = ring_edges([ring for polygon in polygons for ring in polygon])
+            self.names.append(feature["properties"]["name"])
+            self.boxes.append((*edges[:, :2].min(axis=0), *edges[:, :2].max(axis=0)))
+            self.edges.append(edges)
+        # the last entry names the points outside every okrug
+        self.labels = np.array([*self.names, None], dtype=object)
+        self._build_grid(cell_degrees)
+        self._polygons: dict[str, PreparedPolygon] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def polygon(self, name: str) -> PreparedPolygon:
+        """The boundary of an okrug prepared for testing many points, built on first use."""
+        if name not in self._polygons:
+            self._polygons[name] = PreparedPolygon(self.edges[self.names.index(name)])
+        return self._polygons[name]
+
+    def _build_grid(self, cell: float) -> None:
+        boxes = np.array(self.boxes)
+        self.cell = cell
+        self.origin = boxes[:, 0].min(), boxes[:, 1].min()
+        columns = int(np.ceil((boxes[:, 2].max() - self.origin[0]) / cell)) + 1
+        rows = int(np.ceil((boxes[:, 3].max() - self.origin[1]) / cell)) + 1
+        centers_lon, centers_lat = np.meshgrid(
+            self.origin[0] + (np.arange(columns) + 0.5) * cell, self.origin[1] + (np.arange(rows) + 0.5) * cell
+        )
+        grid = self._exact(centers_lat.ravel(), centers_lon.ravel()).reshape(rows, columns)
+
+        near = np.zeros((rows, columns), dtype=bool)
+        for edges in self.edges:
+            near |= _near_edges(edges, self.origin, (cell, cell), (rows, columns))
+        grid[near] = self.BOUNDARY
+        self.grid = grid
+
+    def _row(self, latitudes: np.ndarray) -> np.ndarray:
+        return np.floor((latitudes - self.origin[1]) / self.cell).astype(int)
+
+    def _column(self, longitudes: np.ndarray) -> np.ndarray:
+        return np.floor((longitudes - self.origin[0]) / self.cell).astype(int)
+
+    def _exact(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """Position in `names` of the okrug containing every point, -1 outside all of them, by ray casting."""
+        result = np.full(len(latitudes), -1)
+        for position, ((min_lon, min_lat, max_lon, max_lat), edges) in enumerate(zip(self.boxes, self.edges)):
+            candidates = np.flatnonzero(
+                (result < 0) & (latitudes >= min_lat) & (latitudes <= max_lat)
+                & (longitudes >= min_lon) & (longitudes <= max_lon)
+            )
+            for start in range(0, len(candidates), CONTAINS_CHUNK_POINTS):
+                rows = candidates[start:start + CONTAINS_CHUNK_POINTS]
+                result[rows[_inside(edges, longitudes[rows], latitudes[rows])]] = position
+        return result
+
+    def containing(self, latitudes, longitudes) -> np.ndarray:
+        """The name of the okrug containing every point, None for points outside all of them."""
+        latitudes, longitudes = np.atleast_1d(latitudes).astype(float), np.atleast_1d(longitudes).astype(float)
+        rows, columns = self._row(latitudes), self._column(longitudes)
+        on_grid = (rows >= 0) & (rows < self.grid.shape[0]) & (columns >= 0) & (columns < self.grid.shape[1])
+        codes = np.full(len(latitudes), -1)
+        codes[on_grid] = self.grid[rows[on_grid], columns[on_grid]]
+        boundary = np.flatnonzero(codes == self.BOUNDARY)
+        if len(boundary):
+            codes[boundary] = self._exact(latitudes[boundary], longitudes[boundary])
+        return self.labels[codes]
+
+
+def _inside(edges: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Even-odd rule: cast a ray from every point towards positive x and count the edges it crosses."""
+    x1, y1, x2, y2 = (edges[:, column][None, :] for column in range(4))
+    spans = (y1 > y[:, None]) != (y2 > y[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = x1 + (y[:, None] - y1) * (x2 - x1) / (y2 - y1)
+    return ((spans & (x[:, None] < crossing_x)).sum(axis=1) % 2).astype(bool)
+
+
+stations: Optional[Stations] = None
+okrugs: Optional[Okrugs] = None
+
+
+def load_stations(path: str) -> Optional[Stations]:
+    """
+    Index the metro stations of a CSV file with `name`, `latitude` and `longitude` columns.
+    Without the file, missing stations are not resolved and requests have to name theirs.
+    """
+    global stations
+    stations = read_stations(path)
+    return stations
+
+
+def read_stations(path: str) -> Optional[Stations]:
+    """The metro stations of a CSV file, or None without the file."""
+    if not os.path.exists(path):
+        logger.warning(f"No metro stations at {path}, requests without a station will be rejected")
+        return None
+    table = Stations(pd.read_csv(path))
+    logger.info(f"Indexed {len(table)} metro stations from {path}")
+    return table
+
+
+def load_okrugs(path: str) -> Optional[Okrugs]:
+    """
+    Prepare the okrug boundaries of a GeoJSON FeatureCollection of polygons with a `name` property.
+    Without the file, missing okrugs are not resolved and requests have to name theirs.
+    """
+    global okrugs
+    okrugs = read_okrugs(path)
+    return okrugs
+
+
+def read_okrugs(path: str) -> Optional[Okrugs]:
+    """The okrug boundaries of a GeoJSON file, or None without the file."""
+    if not os.path.exists(path):
+        logger.warning(f"No okrug boundaries at {path}, requests without an okrug will be rejected")
+        return None
+    with open(path, encoding="utf-8") as file:
+        table = Okrugs(json.load(file)["features"])
+    logger.info(f"Prepared {len(table)} okrug boundaries from {path}")
+    return table
+
+
+def resolve(latitudes, longitudes, k: int = 1) -> list[dict]:
+    """
+    The nearest stations with their distances and the containing okrug of every point.
+    Returns:
+        One dict per point with `okrug` and `stations`, each station a dict with `name` and `distance_km`;
+        either is None when its table is not loaded.
+    """
+    latitudes, longitudes = np.atleast_1d(latitudes), np.atleast_1d(longitudes)
+    with metrics.stage("geo"):
+        containing = okrugs.containing(latitudes, longitudes) if okrugs is not None else [None] * len(latitudes)
+        if stations is not None:
+            names, distances = stations.nearest(latitudes, longitudes, k)
+            nearest = [
+                [{"name": name, "distance_km": distance} for name, distance in zip(row_names, row_distances)]
+                for row_names, row_distances in zip(names.tolist(), distances.tolist())
+            ]
+        else:
+            nearest = [None] * len(latitudes)
+    return [{"okrug": okrug, "stations": row} for okrug, row in zip(containing, nearest)]
+
+
+def fill_missing(inputs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fill in the `metro` and `okrug` of the listings that lack them from their coordinates.
+    Returns:
+        `inputs` itself when nothing is missing, otherwise a completed copy. Points outside every okrug keep
+        a missing okrug.
+    Raises:
+        UnresolvedLocation: A value is missing and the table needed to derive it is not loaded.
+    """
+    return fill_missing_from(inputs, stations, okrugs)
+
+
+def fill_missing_from(inputs: pd.DataFrame, stations: Optional[Stations], okrugs: Optional[Okrugs]) -> pd.DataFrame:
+    """`fill_missing` with the tables of another city."""
+    missing_metro = inputs["metro"].isna().to_numpy()
+    missing_okrug = inputs["okrug"].isna().to_numpy()
+    if not (missing_metro.any() or missing_okrug.any()):
+        return inputs
+    if missing_metro.any() and stations is None:
+        raise UnresolvedLocation("metro is required: no metro stations are loaded to find the nearest one")
+    if missing_okrug.any() and okrugs is None:
+        raise UnresolvedLocation("okrug is required: no okrug boundaries are loaded to locate the listing")
+
+    inputs = inputs.copy()
+    latitudes = inputs["latitude"].to_numpy(dtype=float)
+    longitudes = inputs["longitude"].to_numpy(dtype=float)
+    with metrics.stage("geo"):
+        if missing_metro.any():
+            names, _ = stations.nearest(latitudes[missing_metro], longitudes[missing_metro])
+            inputs.loc[missing_metro, "metro"] = names[:, 0]
+        if missing_okrug.any():
+            inputs.loc[missing_okrug, "okrug"] = okrugs.containing(latitudes[missing_okrug], longitudes[missing_okrug])
+    return inputs
@@ -0,0 +1,151 @@
+"""
+History of the predictions served, for later analysis and drift monitoring.
+
+`record` only appends to an in-memory buffer; a background thread writes the buffer to the `predictions` table
+with bulk inserts, once `batch_size` records are waiting or every `flush_interval` seconds, and a last time when
+the process stops. The buffer holds `max_records` at most: when the database falls behind, new records are
+dropped and counted rather than slowing the predictions down or growing without bound.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Iterable, Optional
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+batch_size = 500
+flush_interval = 2.0
+max_records = 50000
+
+written = metrics.Counter("prediction_records_written_total", "Prediction records written to the predictions table")
+dropped = metrics.Counter(
+    "prediction_records_dropped_total", "Prediction records lost, because the buffer was full or the write failed",
+    ("reason",),
+)
+
+
+class HistoryBuffer:
+    """The prediction records waiting to be written, and the thread writing them."""
+
+    def __init__(self):
+        self.records: list[dict] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="prediction-history", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def add(self, records: list[dict]) -> None:
+        with self._lock:
+            kept = records[:max(0, max_records - len(self.records))]
+            self.records.extend(kept)
+            due = len(self.records) >= batch_size
+        if len(kept) < len(records):
+            dropped.inc("buffer_full", amount=len(records) - len(kept))
+        if due:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Write the records buffered so far. Returns the number of records written."""
+        from app.db.predictions import insert_predictions
+
+        with self._lock:
+            records, self.records = self.records, []
+        if not records:
+            return 0
+        # the inputs are serialized here rather than on the request thread
+        for record in records:
+            record["inputs"] = json.dumps(record["inputs"], ensure_ascii=False, default=str)
+        try:
+            insert_predictions(records)
+        except Exception:
+            logger.exception(f"Failed to write {len(records)} prediction records")
+            dropped.inc("write_error", amount=len(records))
+            return 0
+        written.inc(amount=len(records))
+        return len(records)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Write the remaining records and stop the thread."""
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+
+buffer: Optional[HistoryBuffer] = None
+
+
+def configure(config) -> None:
+    """Apply the `history` section of config.yaml."""
+    global batch_size, flush_interval, max_records
+    batch_size = int(config.get("batch_size", batch_size))
+    flush_interval = float(config.get("flush_interval", flush_interval))
+    max_records = int(config.get("max_records", max_records))
+
+
+def start(config) -> HistoryBuffer:
+    """Create the tables if needed and start recording the predictions of this process."""
+    global buffer
+    from app.db.database import create_tables
+
+    configure(config)
+    create_tables()
+    buffer = HistoryBuffer()
+    buffer.start()
+    logger.info(f"Recording predictions in batches of {batch_size} or every {flush_interval}s")
+    return buffer
+
+
+def stop() -> None:
+    global buffer
+    if buffer is not None:
+        buffer.stop()
+        buffer = None
+
+
+def record(endpoint: str, model_name: str, city: Optional[str], inputs: list[dict], predictions: Iterable[float],
+           latency: float) -> None:
+    """
+    Buffer the predictions of one scoring call, a no-op when the history is not recorded.
+    Args:
+        endpoint: The route that served the predictions, e.g. `predict`
+        model_name: The model that scored them
+        city: The city of the listings, whose shard may hold a model of its own
+        inputs: The fields of the prediction requests, one dict per prediction
+        predictions: The predicted prices per square meter
+        latency: Seconds the call spent scoring `inputs`
+    """
+    if buffer is None:
+        return
+    from app.core import shards
+    from app.core.model import city_model_version
+
+    created_at = time.time()
+    common = {
+        "created_at": created_at, "endpoint": endpoint, "model": model_name,
+        "model_version": city_model_version(model_name, city), "city": shards.served_city(city),
+        "latency": latency, "batch_rows": len(inputs),
+    }
+    buffer.add([
+        {**common, "inputs": fields, "predicted_price_per_sqm": float(prediction)}
+        for fields, prediction in zip(inputs, predictions)
+    ])
+
+
+def _buffered() -> dict[tuple, float]:
+    return {(): len(buffer.records)} if buffer is not None else {}
+
+
+metrics.Gauge("prediction_records_buffered", "Prediction records waiting to be written", callback=_buffered)
@@ -0,0 +1,370 @@
+"""
+Background jobs for bulk predictions, eligibility screening and grid scoring, without an external broker.
+
+A job is a row of the `jobs` table and a directory holding its input and its result, one Parquet part per chunk.
+Every process of the service runs a `JobRunner`: its dispatcher thread takes queued jobs from the table, oldest
+first, within a limit of jobs per process and per kind, and runs each in a thread of its own. Between chunks a
+job records its progress and honours cancellation. A failing chunk is retried with backoff, unless the error is
+in the input. Parts are written atomically and never recomputed, so a job interrupted by a shutdown or a crash
+resumes where it stopped: the runner refreshes a heartbeat of its jobs, and jobs whose heartbeat goes stale are
+queued again for any process to pick up.
+"""
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Iterator, Optional
+
+import pandas as pd
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+directory = "./backend/jobs"
+# Server-side files a job may read its listings from; None to accept inline listings only
+input_dir: Optional[str] = None
+workers = 2
+# Jobs of one kind running at once in this process, at most `workers` when not set
+limits: dict[str, int] = {}
+chunk_rows = 50_000
+max_attempts = 3
+retry_delay = 1.0
+poll_interval = 1.0
+# Running jobs without a heartbeat for that long are taken for lost with their process
+stale_after = 60.0
+
+# Errors in the input of a job, which a retry would only repeat
+PERMANENT_ERRORS = (ValueError, KeyError)
+
+runner: Optional["JobRunner"] = None
+
+jobs_finished = metrics.Counter("jobs_finished_total", "Background jobs finished by kind and status", ("kind", "status"))
+chunks_retried = metrics.Counter("job_chunk_retries_total", "Chunks of background jobs run again after an error", ("kind",))
+
+
+def configure(config) -> None:
+    """Apply the `jobs` section of config.yaml."""
+    global directory, input_dir, workers, limits, chunk_rows, max_attempts, retry_delay, poll_interval, stale_after
+    directory = config.get("directory", directory)
+    input_dir = config.get("input_dir", input_dir) or None
+    workers = int(config.get("workers", workers))
+    limits = dict(config.get("limits") or {})
+    chunk_rows = int(config.get("chunk_rows", chunk_rows))
+    max_attempts = int(config.get("max_attempts", max_attempts))
+    retry_delay = float(config.get("retry_delay", retry_delay))
+    poll_interval = float(config.get("poll_interval", poll_interval))
+    stale_after = float(config.get("stale_after", stale_after))
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(directory, job_id)
+
+
+def part_paths(job_id: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(job_dir(job_id), "part-*.parquet")))
+
+
+def resolve_input(path: str) -> str:
+    """
+    The location of a server-side input file.
+    Raises:
+        ValueError: Inputs are not allowed, the file lies outside `input_dir` or does not exist.
+    """
+    if input_dir is None:
+        raise ValueError("Jobs do not read server-side files, send the rows with the request.")
+    root = os.path.realpath(input_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root or not os.path.isfile(resolved):
+        raise ValueError(f"{path} is not a file of the job input directory.")
+    if not resolved.endswith((".csv", ".parquet")):
+        raise ValueError(f"{path} is neither a CSV nor a Parquet file.")
+    return resolved
+
+
+def count_chunks(path: str) -> Optional[int]:
+    """Chunks of an input file; unknown for CSV files, which would have to be read to count their rows."""
+    if not path.endswith(".parquet"):
+        return None
+    import pyarrow.parquet as pq
+
+    return max(1, math.ceil(pq.ParquetFile(path).metadata.num_rows / chunk_rows))
+
+
+# Every kind of job splits its work into chunks: pairs of the chunk index and a function producing its rows
+def _predict_chunks(params: dict) -> Iterator[tuple[int, Callable[[], pd.DataFrame]]]:
+    from app.batch import read_chunks, score_frame
+
+    for index, chunk in enumerate(read_chunks(params["input"], chunk_rows)):
+        yield index, lambda chunk=chunk: score_frame(chunk, **params["options"])
+
+
+def _eligibility_chunks(params: dict) -> Iterator[tuple[int, Callable[[], pd.DataFrame]]]:
+    from app.batch import eligible_chains, missing_columns, read_chunks
+
+    def screen(chunk: pd.DataFrame) -> pd.DataFrame:
+        missing = missing_columns(chunk, params["kind"], predict=False)
+        if missing:
+            raise ValueError(f"The listings lack the columns {missing}")
+        return chunk.assign(eligible_chains=eligible_chains(chunk, params["kind"]))
+
+    for index, chunk in enumerate(read_chunks(params["input"], chunk_rows)):
+        yield index, lambda chunk=chunk: screen(chunk)
+
+
+def _grid_chunks(params: dict) -> Iterator[tuple[int, Callable[[], pd.DataFrame]]]:
+    import numpy as np
+    from app.api import schemas
+    from app.core import surface
+
+    base = schemas.PredictionRequest(**params["base"])
+    axis_lat, axis_lon = surface.grid_axes(schemas.BoundingBox(**params["bbox"]), params["resolution"])
+    band = max(1, chunk_rows // len(axis_lon))
+
+    def score(latitudes: np.ndarray) -> pd.DataFrame:
+        grid_lat, grid_lon = (axis.ravel() for axis in np.meshgrid(latitudes, axis_lon, indexing="ij"))
+        prices = surface.predict_points(base, grid_lat, grid_lon)
+        return pd.DataFrame({"latitude": grid_lat, "longitude": grid_lon, "predicted_price_per_sqm": prices})
+
+    for index, start in enumerate(range(0, len(axis_lat), band)):
+        yield index, lambda latitudes=axis_lat[start:start + band]: score(latitudes)
+
+
+HANDLERS = {"predict": _predict_chunks, "eligibility": _eligibility_chunks, "grid": _grid_chunks}
+
+
+def submit(kind: str, params: dict, rows: Optional[pd.DataFrame] = None, total_chunks: Optional[int] = None) -> str:
+    """
+    Queue a job.
+    Args:
+        kind: One of `HANDLERS`
+        params: The parameters of the handler; `input` is set to the stored `rows` when they are given
+        rows: Listings sent with the request, stored in the job directory as the input of the job
+        total_chunks: The number of chunks when known
+
+    Returns:
+        str: The id of the job.
+    """
+    from app.db import jobs as store
+
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_dir(job_id), exist_ok=True)
+    if rows is not None:
+        params = {**params, "input": os.path.join(job_dir(job_id), "input.parquet")}
+        rows.to_parquet(params["input"], index=False)
+        total_chunks = max(1, math.ceil(len(rows) / chunk_rows))
+    store.create_job(job_id, kind, json.dumps(params, ensure_ascii=False), total_chunks)
+    logger.info(f"Queued {kind} job {job_id}")
+    if runner is not None:
+        runner.wake.set()
+    return job_id
+
+
+def status(job) -> dict:
+    """The state and progress of a job of the `jobs` table."""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "total_chunks": job.total_chunks,
+        "done_chunks": job.done_chunks,
+        "progress": job.done_chunks / job.total_chunks if job.total_chunks else None,
+        "rows": job.rows,
+        "attempts": job.attempts,
+        "cancel_requested": job.cancel_requested,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def read_result(job_id: str) -> Iterator[pd.DataFrame]:
+    """The result of a job, one part at a time."""
+    for path in part_paths(job_id):
+        yield pd.read_parquet(path)
+
+
+class Stopped(Exception):
+    """The job was cancelled, or the process is shutting down and leaves it to be resumed, or it lost the job."""
+
+
+# the reason of a Stopped job that was queued again, after a pause of its runner, and belongs to another one now
+LOST = "was taken over by another runner"
+
+
+class JobRunner:
+    """Takes queued jobs from the table and runs them in threads, within the per process and per kind limits."""
+
+    def __init__(self):
+        # recorded on the jobs this runner claims, so that a runner that lost a job cannot overwrite its state
+        self.id = uuid.uuid4().hex
+        self.running: dict[str, str] = {}
+        self.stopping = False
+        self.wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+
+    def start(self) -> None:
+        self._dispatcher.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop taking jobs and let the running ones finish their current chunk; they are resumed on next start."""
+        self.stopping = True
+        self.wake.set()
+        self._dispatcher.join(timeout)
+        deadline = time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _dispatch_loop(self) -> None:
+        from app.db import jobs as store
+
+        while not self.stopping:
+            try:
+                with self._lock:
+                    running = list(self.running)
+                store.heartbeat(running, self.id)
+                requeued, failed = store.requeue_stale(time.time() - stale_after, max_attempts)
+                if requeued or failed:
+                    logger.warning(f"Jobs of stopped processes: {requeued} queued again, {failed} failed")
+                self._dispatch()
+            except Exception:
+                logger.exception("Could not dispatch the queued jobs")
+            self.wake.wait(poll_interval)
+            self.wake.clear()
+
+    def _dispatch(self) -> None:
+        from app.db import jobs as store
+
+        with self._lock:
+            free = workers - len(self.running)
+            kinds = Counter(self.running.values())
+        if free <= 0:
+            return
+        for job in store.queued_jobs(limit=4 * workers):
+            if free <= 0:
+                break
+            if kinds[job.kind] >= limits.get(job.kind, workers) or not store.claim(job.id, self.id):
+                continue
+            with self._lock:
+                self.running[job.id] = job.kind
+            kinds[job.kind] += 1
+            free -= 1
+            thread = threading.Thread(target=self._run, args=(job.id,), name=f"job-{job.id}", daemon=True)
+            self._threads = [alive for alive in self._threads if alive.is_alive()] + [thread]
+            thread.start()
+
+    def _run(self, job_id: str) -> None:
+        from app.db import jobs as store
+
+        job = store.get_job(job_id)
+        try:
+            rows, done = self._run_chunks(job)
+        except Stopped as stop:
+            if str(stop) == "cancelled":
+                self._finish(job, status="cancelled", finished_at=time.time())
+            elif str(stop) != LOST:
+                store.update_running(job_id, self.id, status="queued", runner_id=None)
+            logger.info(f"Job {job_id} {stop}")
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            self._finish(job, status="failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+        else:
+            if self._finish(job, status="succeeded", rows=rows, done_chunks=done, total_chunks=done,
+                            finished_at=time.time()):
+                logger.info(f"Job {job_id} scored {rows} rows in {done} chunks")
+        finally:
+            with self._lock:
+                self.running.pop(job_id, None)
+            self.wake.set()
+
+    def _finish(self, job, **values) -> bool:
+        """Record the outcome of a job, unless it was taken from this runner meanwhile."""
+        from app.db import jobs as store
+
+        if not store.update_running(job.id, self.id, **values):
+            logger.warning(f"Job {job.id} was taken over by another runner, its {values['status']} outcome is dropped")
+            return False
+        jobs_finished.inc(job.kind, values["status"])
+        return True
+
+    def _run_chunks(self, job) -> tuple[int, int]:
+        """Produce the missing parts of a job; returns the rows and chunks of the whole result."""
+        import pyarrow.parquet as pq
+        from app.batch import part_path
+        from app.db import jobs as store
+
+        rows = done = 0
+        for index, produce in HANDLERS[job.kind](json.loads(job.params)):
+            path = part_path(job_dir(job.id), index)
+            if not os.path.exists(path):
+                current = store.get_job(job.id)
+                if current.cancel_requested:
+                    raise Stopped("cancelled")
+                if self.stopping:
+                    raise Stopped("left to resume after the restart")
+                self._write_part(job, produce, path)
+            rows += pq.ParquetFile(path).metadata.num_rows
+            done += 1
+            if not store.update_running(job.id, self.id, rows=rows, done_chunks=done):
+                raise Stopped(LOST)
+        return rows, done
+
+    def _write_part(self, job, produce: Callable[[], pd.DataFrame], path: str) -> None:
+        """Produce a chunk, retrying with exponential backoff, and write it where only complete parts appear."""
+        for attempt in range(1, max_attempts + 1):
+            try:
+                with metrics.stage(f"job_{job.kind}"):
+                    frame = produce()
+                break
+            except PERMANENT_ERRORS:
+                raise
+            except Exception as e:
+                if attempt == max_attempts:
+                    raise
+                chunks_retried.inc(job.kind)
+                logger.warning(f"Job {job.id}: chunk attempt {attempt} failed ({e}), retrying")
+                time.sleep(retry_delay * 2 ** (attempt - 1))
+        temporary = f"{path}.{os.getpid()}.tmp"
+        frame.to_parquet(temporary, index=False)
+        os.replace(temporary, path)
+
+
+def _running_jobs() -> dict[tuple, float]:
+    if runner is None:
+        return {}
+    with runner._lock:
+        kinds = Counter(runner.running.values())
+    return {(kind,): count for kind, count in kinds.items()}
+
+
+metrics.Gauge("jobs_running", "Background jobs running in this process by kind", ("kind",), callback=_running_jobs)
+
+
+def start(config) -> "JobRunner":
+    """Create the tables if needed and start taking jobs in this process."""
+    global runner
+    import pyarrow  # noqa: F401 - the parts are Parquet files
+
+    from app.db.database import create_tables
+
+    configure(config)
+    create_tables()
+    os.makedirs(directory, exist_ok=True)
+    runner = JobRunner()
+    runner.start()
+    logger.info(f"Running up to {workers} background jobs from {directory}")
+    return runner
+
+
+def stop() -> None:
+    global runner
+    if runner is not None:
+        runner.stop()
+        runner = None
@@ -0,0 +1,186 @@
+"""
+Logging, configured once per process from conf/logging_config.yaml.
+
+The handlers of the file never run on the threads that log. Records are put on a bounded queue and a
+QueueListener thread formats and writes them, so a request does not wait on a formatter or on the terminal.
+Records are queued unformatted: `%s` arguments are rendered by the listener, and only for the records that are
+kept, so `logger.debug("...: %s", Payload(request))` costs next to nothing when DEBUG is off.
+
+Besides the `logging.config` schema, the file holds:
+    queue_size: records waiting for the listener at most; records logged while it is full are dropped and counted
+    sampling: per logger and its children, the fraction of the records below WARNING that are kept
+    max_payload_chars: the length `Payload` arguments are cut to
+"""
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from typing import Callable, Optional
+
+from app.core import metrics
+
+LOGGING_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "conf", "logging_config.yaml")
+
+max_payload_chars = 500
+
+dropped = metrics.Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+_handler: Optional["QueueHandler"] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+# attributes every LogRecord has; the others were passed through `extra` and are written as JSON fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed through `extra` next to the message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below WARNING of some loggers, the rate of the closest configured ancestor."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = {name: float(rate) for name, rate in rates.items()}
+        self._resolved: dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            logger_name = name
+            while logger_name not in self.rates and "." in logger_name:
+                logger_name = logger_name.rpartition(".")[0]
+            rate = self._resolved[name] = self.rates.get(logger_name, 1.0)
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Queue records as they are, leaving their formatting to the listener, and drop them when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped.inc()
+
+
+class Payload:
+    """A large argument of a log call, rendered by the listener and cut to `max_payload_chars`."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: Optional[int] = None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        limit = self.limit or max_payload_chars
+        if len(text) <= limit:
+            return text
+        return f"{text[:limit]}... ({len(text)} characters)"
+
+
+class Lazy:
+    """An argument of a log call computed by `func(*args)` only when the record is formatted."""
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func: Callable, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args))
+
+
+def _start_listener(handlers: list[logging.Handler], queue_size: int) -> None:
+    global _listener
+    _handler.queue = queue.Queue(queue_size)
+    _listener = logging.handlers.QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def configure(path: str = LOGGING_CONFIG_PATH, force: bool = False) -> None:
+    """
+    Set up logging from a logging config file, unless it is set up already.
+    Args:
+        path: The YAML file, `logging.config` schema plus `queue_size`, `sampling` and `max_payload_chars`
+        force: Set up again, e.g. after editing the file
+    """
+    from omegaconf import OmegaConf
+
+    global _handler, max_payload_chars
+    with _lock:
+        if _handler is not None and not force:
+            return
+        stop()
+        config = OmegaConf.to_container(OmegaConf.load(path))
+        queue_size = int(config.pop("queue_size", 10000))
+        rates = config.pop("sampling", None) or {}
+        max_payload_chars = int(config.pop("max_payload_chars", max_payload_chars))
+        # the loggers of the modules imported before this call keep working
+        config.setdefault("disable_existing_loggers", False)
+        logging.config.dictConfig(config)
+
+        # the handlers of the file are moved behind the queue; loggers that do not propagate keep their own
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        for handler in handlers:
+            root.removeHandler(handler)
+        _handler = QueueHandler(queue.Queue(queue_size))
+        if rates:
+            _handler.addFilter(SamplingFilter(rates))
+        root.addHandler(_handler)
+        _start_listener(handlers, queue_size)
+
+
+def stop() -> None:
+    """Write the records still queued and stop the listener thread."""
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+def _after_fork() -> None:
+    # the listener thread is not forked with the process: a child gets a queue and a listener of its own
+    if _listener is not None:
+        _start_listener(list(_listener.handlers), _handler.queue.maxsize)
+
+
+atexit.register(stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,80 +1,222 @@
+import hashlib
+import logging
 import pickle
+from typing import Optional
 
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI
-from geopy.distance import great_circle
-from pydantic import BaseModel
-from xgboost import XGBClassifier
+from app.api import schemas
+from app.core import geo, metrics, runtime, shards
+from geopy.distance import EARTH_RADIUS
 
-# Load models
-with open('./backend/models/xgb_model_1.pkl', 'rb') as model_file:
-    xgb_model_1 = pickle.load(model_file)
+logger = logging.getLogger(__name__)
 
-with open('./backend/models/xgb_model_2.pkl', 'rb') as model_file:
-    xgb_model_2 = pickle.load(model_file)
+# Default model locations, overridden by `resources.models` in config.yaml
+model_files = {
+    "xgb_1": './backend/models/xgb_model_1.pkl',
+    "xgb_2": './backend/models/xgb_model_2.pkl',
+    "mlp_1": './backend/models/mlp_model_1.pkl'
+}
 
-with open('./backend/models/mlp_model_1.pkl', 'rb') as model_file:
-    mlp_model_1 = pickle.load(model_file)
+models = {}
+# Content hash of the file each model was loaded from, to key caches derived from the model
+model_versions: dict[str, str] = {}
+
+# Typical listing used to warm up every model after loading
+warmup_request = schemas.PredictionRequest(
+    metro="Коммунарка",
+    okrug="ЦАО",
+    city="Москва",
+    category="Помещение свободного назначения (продажа)",
+    condition="Типовой ремонт",
+    area=182.0,
+    floor=1,
+    total_floors=9,
+    time_to_station=8,
+    transport="пешком",
+    latitude=55.74993,
+    longitude=37.58892,
+    model="xgb_1",
+)
+
+
+class UnknownModel(KeyError):
+    """A model name that is not served, for the default city or for the city of the request."""
+
+    def __init__(self, model_name: str, city: Optional[str] = None):
+        super().__init__(model_name)
+        self.model_name = model_name
+        self.city = city
+
+    def __str__(self) -> str:
+        return f"Model {self.model_name} does not exist" + (f" for {self.city}." if self.city else ".")
+
+
+def load_model(model_name: str, model_path: Optional[str] = None):
+    """
+    Load a pickled model and register it under the given name.
+    Args:
+        model_name: The name the model is served under
+        model_path: The path to the pickled model, defaults to `model_files[model_name]`
+
+    Returns:
+        The loaded model.
+    """
+    if model_path is None and model_name not in model_files:
+        raise UnknownModel(model_name)
+    model_path = model_path or model_files[model_name]
+    model, version, _ = read_model(model_name, model_path)
+    model_files[model_name] = model_path
+    model_versions[model_name] = version
+    models[model_name] = model
+    return model
+
+
+def read_model(model_name: str, model_path: str) -> tuple[object, str, int]:
+    """
+    Unpickle a model and size its thread pools, without registering it.
+    Returns:
+        The model, the content hash of its file and the size of the file in bytes.
+    """
+    with open(model_path, 'rb') as model_file:
+        payload = model_file.read()
+    model = pickle.loads(payload)
+    runtime.configure_model(model_name, model)
+    return model, hashlib.sha256(payload).hexdigest()[:16], len(payload)
+
+
+def get_model_version(model_name: str) -> str:
+    """The content hash of a loaded model, or its identity for a model registered without a file."""
+    model = get_model(model_name)
+    return model_versions.get(model_name) or f"object-{id(model):x}"
+
+
+def get_model(model_name: str):
+    """Return a loaded model, loading it on first use."""
+    model = models.get(model_name)
+    metrics.record_cache("models", model is not None)
+    if model is None:
+        model = load_model(model_name)
+    return model
+
+
+MOSCOW_CENTER = (55.7558, 37.6173)
+
+# Numerical features and the request fields they are read from
+NUMERIC_FIELDS = {
+    'общая площадь': 'area',
+    'этаж': 'floor',
+    'время до станции': 'time_to_station',
+    'Этажность дома': 'total_floors',
+    'широта': 'latitude',
+    'долгота': 'longitude',
+}
 
-models = {
-    "xgb_1": xgb_model_1,
-    "xgb_2": xgb_model_2,
-    "mlp_1": mlp_model_1
+# Prefixes of the one-hot encoded features and the request fields holding their values
+ONE_HOT_FIELDS = {
+    'состояние_': 'condition',
+    'округ_': 'okrug',
+    'метро_': 'metro',
+    'пешком/транспортом_': 'transport',
+    'категория объявления_': 'category',
 }
 
-# Define FastAPI app
-app = FastAPI()
+# Rows scored per model call by the batch predictions
+PREDICT_CHUNK_ROWS = 50_000
+
+
+def distance_from_center(latitudes, longitudes, center: tuple[float, float] = MOSCOW_CENTER):
+    """Great-circle distance in kilometers to the center of the city, for scalars or numpy arrays."""
+    lat1, lon1 = np.radians(latitudes), np.radians(longitudes)
+    lat2, lon2 = np.radians(center[0]), np.radians(center[1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def encode(model, inputs: pd.DataFrame, center: tuple[float, float] = MOSCOW_CENTER) -> pd.DataFrame:
+    """
+    Build the feature matrix of a model for many listings at once.
+    Args:
+        model: A fitted model with `feature_names_in_`
+        inputs: One row per listing, with the fields of `schemas.PredictionRequest` as columns
+        center: The city center the distance feature is measured from
+
+    Returns:
+        pd.DataFrame: The features, in the order the model was fitted with.
+    """
+    names = list(model.feature_names_in_)
+    position = {name: index for index, name in enumerate(names)}
+    features = np.zeros((len(inputs), len(names)))
+
+    for feature, field in NUMERIC_FIELDS.items():
+        if feature in position:
+            features[:, position[feature]] = inputs[field].to_numpy(dtype=float)
+
+    for prefix, field in ONE_HOT_FIELDS.items():
+        values = inputs[field]
+        codes = values.map({value: position.get(f"{prefix}{value}", -1) for value in values.unique()}).to_numpy()
+        rows = np.flatnonzero(codes >= 0)
+        features[rows, codes[rows]] = 1
+
+    if 'distance_from_center' in position:
+        with metrics.stage("distance"):
+            features[:, position['distance_from_center']] = distance_from_center(
+                inputs['latitude'].to_numpy(dtype=float), inputs['longitude'].to_numpy(dtype=float), center
+            )
+    return pd.DataFrame(features, columns=names)
+
+
+def city_model(model_name: str, city: Optional[str] = None) -> tuple[object, tuple[float, float], Optional[object]]:
+    """
+    The model a city is served with, the center its distances are measured from and its shard.
+    Cities without a shard of their own are served by the models of the default city, and have no shard.
+    """
+    shard = shards.shard_for(city)
+    if shard is None:
+        return get_model(model_name), MOSCOW_CENTER, None
+    return shard.get_model(model_name), shard.center, shard
+
+
+def city_model_version(model_name: str, city: Optional[str] = None) -> str:
+    """The version of the model a city is served with, see `city_model` and `get_model_version`."""
+    shard = shards.shard_for(city)
+    return get_model_version(model_name) if shard is None else shard.versions[model_name]
+
+
+def predict_frame(
+    model_name: str, inputs: pd.DataFrame, chunk_rows: int = PREDICT_CHUNK_ROWS, city: Optional[str] = None
+) -> np.ndarray:
+    """
+    Predict the price per square meter of every row of `inputs`, encoding and scoring `chunk_rows` at a time.
+    A missing `metro` or `okrug` is derived from the coordinates, see `geo.fill_missing`.
+    The rows are scored with the model of that name of `city`, see `city_model`.
+    """
+    model, center, shard = city_model(model_name, city)
+    inputs = geo.fill_missing(inputs) if shard is None else shard.fill_missing(inputs)
+    predictions = np.empty(len(inputs))
+    for start in range(0, len(inputs), chunk_rows):
+        chunk = inputs.iloc[start:start + chunk_rows]
+        with metrics.stage("encode"):
+            features = encode(model, chunk, center)
+        with metrics.stage("predict"):
+            predictions[start:start + len(chunk)] = model.predict(features)
+    metrics.record_prediction(model_name, rows=len(inputs))
+    return predictions
+
 
 # Prediction function
-def predict_user_input(user_input: PredictionRequest):
-    model = models[user_input.model]
-
-    input_data = {feature: 0 for feature in model.feature_names_in_}
-
-    # Map numerical fields
-    input_data['общая площадь'] = user_input.area
-    input_data['этаж'] = user_input.floor
-    input_data['время до станции'] = user_input.time_to_station
-    input_data['Этажность дома'] = user_input.total_floors
-    input_data['широта'] = user_input.latitude
-    input_data['долгота'] = user_input.longitude
-
-    # Set one-hot encoded fields
-    state_feature = f"состояние_{user_input.condition}"
-    if state_feature in input_data:
-        input_data[state_feature] = 1
-
-    district_feature = f"округ_{user_input.okrug}"
-    if district_feature in input_data:
-        input_data[district_feature] = 1
-
-    metro_feature = f"метро_{user_input.metro}"
-    if metro_feature in input_data:
-        input_data[metro_feature] = 1
-
-    walk_transit_feature = f"пешком/транспортом_{user_input.transport}"
-    if walk_transit_feature in input_data:
-        input_data[walk_transit_feature] = 1
-
-    category_feature = f"категория объявления_{user_input.category}"
-    if category_feature in input_data:
-        input_data[category_feature] = 1
-
-    # Convert dictionary into DataFrame for prediction
-    input_df = pd.DataFrame([input_data])
-
-    # Calculate distance from Moscow's center
-    moscow_center_coords = (55.7558, 37.6173)
-    input_df['distance_from_center'] = input_df.apply(
-        lambda row: great_circle((row['широта'], row['долгота']), moscow_center_coords).kilometers, axis=1
-    )
-
-    # Prediction
-    prediction = model.predict(input_df)
-    return prediction[0]
-
-# Define FastAPI endpoint
-@app.post("/predict/")
-def get_prediction(user_input: PredictionRequest):
-    prediction = predict_user_input(user_input)
-    return {"predicted_price_per_sqm": prediction}
+def predict_user_input(user_input: schemas.PredictionRequest):
+    return predict_frame(user_input.model, pd.DataFrame([user_input.dict()]), city=user_input.city)[0]
+
+
+def warmup_model(model_name: str) -> float:
+    """
+    Run a single prediction so the first real request does not pay for lazy allocations.
+    Args:
+        model_name: The name of an already loaded model
+
+    Returns:
+        float: The warmup prediction.
+    """
+    request = warmup_request.copy(update={"model": model_name})
+    return float(predict_user_input(request))
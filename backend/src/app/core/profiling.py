@@ -0,0 +1,172 @@
+"""
+Sampling profiler for live workers.
+
+Stacks are sampled from `sys._current_frames()` by a background thread and aggregated in the
+folded format (`outer;inner;leaf count` per line) understood by flamegraph.pl, speedscope and inferno.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+sample_rate = 0.01
+interval = 0.002
+output_dir = "./backend/profiles"
+max_capture_seconds = 300.0
+
+_write_lock = threading.Lock()
+
+
+def configure(config) -> None:
+    """Apply the `profiling` section of config.yaml."""
+    global enabled, sample_rate, interval, output_dir, max_capture_seconds
+    enabled = bool(config.get("enabled", enabled))
+    sample_rate = float(config.get("sample_rate", sample_rate))
+    interval = float(config.get("interval", interval))
+    output_dir = config.get("output_dir", output_dir)
+    max_capture_seconds = float(config.get("max_capture_seconds", max_capture_seconds))
+
+
+def _frame_label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def _stack(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """
+    Periodically record the stacks of the given threads, or of every other thread when `thread_ids` is None.
+    Args:
+        thread_ids: Identifiers of the threads to sample
+        sample_interval: Seconds between two samples, defaults to `profiling.interval` in config.yaml
+    """
+
+    def __init__(self, thread_ids: Optional[set[int]] = None, sample_interval: Optional[float] = None):
+        self.thread_ids = thread_ids
+        self.interval = sample_interval or interval
+        self.stacks: Counter = Counter()
+        self.started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "StackSampler":
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                self.stacks[_stack(frame)] += 1
+
+
+def to_folded(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def write_folded(name: str, stacks: Counter, append: bool = False) -> str:
+    """Write stacks to `<output_dir>/<name>.folded` and return the path."""
+    path = os.path.join(output_dir, f"{name}.folded")
+    with _write_lock:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(path, "a" if append else "w", encoding="utf-8") as file:
+            file.write(to_folded(stacks))
+    return path
+
+
+def profiled(route: str):
+    """
+    Profile a sampled fraction of the calls of a synchronous route handler.
+    The stacks of every sampled call are appended to `<output_dir>/<route>.folded`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled or random.random() >= sample_rate:
+                return func(*args, **kwargs)
+            sampler = StackSampler({threading.get_ident()}).start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stacks = sampler.stop()
+                if stacks:
+                    write_folded(route, stacks, append=True)
+        return wrapper
+    return decorator
+
+
+class Capture:
+    """A process-wide capture started from the admin endpoint and stopped on demand or after its time limit."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sampler: Optional[StackSampler] = None
+        self._timer: Optional[threading.Timer] = None
+        self.last_path: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._sampler is not None
+
+    def start(self, duration: float, sample_interval: Optional[float] = None) -> float:
+        duration = min(duration, max_capture_seconds)
+        with self._lock:
+            if self._sampler is not None:
+                raise RuntimeError("A profile capture is already running.")
+            self._sampler = StackSampler(None, sample_interval).start()
+            self._timer = threading.Timer(duration, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        logger.info(f"Started a {duration:.0f}s profile capture")
+        return duration
+
+    def stop(self) -> Optional[Counter]:
+        with self._lock:
+            sampler, self._sampler = self._sampler, None
+            if sampler is None:
+                return None
+            if self._timer is not None:
+                self._timer.cancel()
+        stacks = sampler.stop()
+        self.last_path = write_folded(f"capture-{int(sampler.started_at)}", stacks)
+        logger.info(f"Profile capture written to {self.last_path}")
+        return stacks
+
+    def status(self) -> dict:
+        sampler = self._sampler
+        return {
+            "running": sampler is not None,
+            "started_at": sampler.started_at if sampler else None,
+            "last_capture": self.last_path,
+        }
+
+
+capture = Capture()
@@ -0,0 +1,355 @@
+"""
+One eligibility rule set from the two places chains are described: the Excel criteria tables and the
+`service.eligibility` lists of config.yaml.
+
+The Excel rows are the reference, with their boolean criteria. A config entry naming the same chain only checks
+that the two agree. Entries for chains missing from the tables have no boolean criteria, so they would match on
+area and floor alone: they are only served with `serve_config_only_chains`, and `RuleSet.status` lists them
+either way. The merged set is
+validated, compiled into `eligibility.DecisionTable`s and pickled under a key hashed from the sources, so a boot
+with unchanged sources loads the compiled tables instead of parsing the Excel files again.
+"""
+import difflib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+from app.core import eligibility
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the pickled layout changes, so stale caches are never read
+CACHE_FORMAT = 2
+cache_dir: Optional[str] = "./backend/cache"
+serve_config_only_chains = False
+# Config entries whose name differs from a table chain only by such a ratio are taken for the same chain
+NAME_MATCH_CUTOFF = 0.9
+
+_reload_lock = threading.Lock()
+
+
+class ChainRule(BaseModel):
+    """The criteria of one chain; unset criteria accept any value."""
+
+    chain: str = Field(..., min_length=1)
+    category: Optional[str] = None
+    min_area: Optional[float] = Field(None, ge=0)
+    max_area: Optional[float] = Field(None, ge=0)
+    min_floor: Optional[int] = Field(None, ge=0)
+    max_floor: Optional[int] = Field(None, ge=0)
+    min_ceiling_height: Optional[float] = Field(None, ge=0)
+    flags: dict[str, bool] = {}
+    source: str
+    # criteria taken from the group entry of a config chain; the tables are not checked against them
+    inherited: set[str] = set()
+
+
+class RuleSet:
+    """The compiled facility and land rules, with the key of the sources they were built from."""
+
+    def __init__(self, key: str, facility: eligibility.DecisionTable, land: eligibility.DecisionTable,
+                 conflicts: list[str], added: dict[str, list[str]], served_added: bool):
+        self.key = key
+        self.facility = facility
+        self.land = land
+        self.conflicts = conflicts
+        # per kind, the chains only listed in config.yaml, and whether the decision tables include them
+        self.added = added
+        self.served_added = served_added
+        self.from_cache = False
+
+    def status(self) -> dict:
+        return {
+            "key": self.key,
+            "from_cache": self.from_cache,
+            "facility_rules": len(self.facility.records),
+            "land_rules": len(self.land.records),
+            "conflicts": self.conflicts,
+            "config_only_chains": self.added,
+            "config_only_chains_served": self.served_added,
+        }
+
+
+rule_set: Optional[RuleSet] = None
+sources: dict = {}
+
+
+def configure(config) -> None:
+    """Apply the `eligibility` section of config.yaml."""
+    global cache_dir, serve_config_only_chains
+    cache_dir = config.get("cache_dir", cache_dir)
+    serve_config_only_chains = bool(config.get("serve_config_only_chains", serve_config_only_chains))
+
+
+def normalize(name) -> str:
+    """Chain names compared without case, punctuation and repeated spaces; YAML reads some of them as numbers."""
+    return " ".join(re.sub(r"[^\w.]+", " ", str(name).casefold().replace("ё", "е")).split())
+
+
+def _value(value):
+    return None if pd.isna(value) else value
+
+
+def table_rules(table: pd.DataFrame, flags: dict[str, str], source: str) -> list[ChainRule]:
+    """The rules of the rows of a criteria table, in table order."""
+    rules = []
+    for row in table.to_dict("records"):
+        rules.append(ChainRule(
+            chain=str(row["chain"]).strip(),
+            category=_value(row["category"]),
+            **{bound: _value(row.get(bound)) for bound in ("min_area", "max_area", "min_floor", "max_floor", "min_ceiling_height")},
+            flags={column: row[column] for column in flags.values() if _value(row[column]) is not None},
+            source=source,
+        ))
+    return rules
+
+
+def _floors(floors) -> tuple[Optional[int], Optional[int]]:
+    """The floor range of a config entry: none, a single floor or a list of consecutive floors."""
+    if floors is None:
+        return None, None
+    if isinstance(floors, int):
+        return floors, floors
+    floors = sorted(floors)
+    if floors != list(range(floors[0], floors[-1] + 1)):
+        raise ValueError(f"floors {floors} are not consecutive")
+    return floors[0], floors[-1]
+
+
+# the rule bounds each criterion of a config entry sets
+_BOUNDS = {"min_area": ("min_area",), "max_area": ("max_area",), "floors": ("min_floor", "max_floor")}
+
+
+def config_rules(entries: list[dict], source: str) -> list[ChainRule]:
+    """
+    The rules of the chains of a `service.eligibility` list. An entry with `group: true` names the category of
+    the entries following it and is not a chain itself; its `min_area`, `max_area` and `floors` apply to the
+    entries that leave them unset.
+    Raises:
+        ValueError: The floors of an entry are not consecutive.
+    """
+    rules, group = [], {}
+    for entry in entries:
+        if entry.get("group"):
+            group = entry
+            continue
+        name = str(entry["name"]).strip()
+        inherited = {field for field in _BOUNDS if entry.get(field) is None}
+        criteria = {field: group.get(field) if field in inherited else entry[field] for field in _BOUNDS}
+        min_floor, max_floor = _floors(criteria["floors"])
+        rules.append(ChainRule(
+            chain=name,
+            category=str(group["name"]).strip() if group else None,
+            min_area=criteria["min_area"],
+            max_area=criteria["max_area"],
+            min_floor=min_floor,
+            max_floor=max_floor,
+            source=source,
+            inherited={bound for field in inherited for bound in _BOUNDS[field]},
+        ))
+    return rules
+
+
+def duplicates(rules: list[ChainRule]) -> list[str]:
+    """The chains a source lists more than once, e.g. under two categories."""
+    seen, repeated = {}, []
+    for rule in rules:
+        first = seen.setdefault((rule.source, normalize(rule.chain)), rule)
+        if first is not rule:
+            repeated.append(f"{rule.chain} is listed under {first.category} and {rule.category} in {rule.source}")
+    return repeated
+
+
+def validate(rules: list[ChainRule]) -> list[str]:
+    """The problems of a rule set that field validation does not catch."""
+    problems = []
+    for rule in rules:
+        for low, high in (("min_area", "max_area"), ("min_floor", "max_floor")):
+            if getattr(rule, low) is not None and getattr(rule, high) is not None and getattr(rule, low) > getattr(rule, high):
+                problems.append(f"{rule.source}: {rule.chain} has {low} {getattr(rule, low)} above {high} {getattr(rule, high)}")
+    return problems
+
+
+def merge(table: list[ChainRule], config: list[ChainRule]) -> tuple[list[ChainRule], list[str]]:
+    """
+    Match the config rules to the table rules by name, exactly or nearly, and keep the table values.
+    Returns:
+        The config rules for chains missing from the table, and the disagreements found on the matched ones.
+    """
+    by_name = {normalize(rule.chain): rule for rule in table}
+    added, conflicts = [], []
+    for rule in config:
+        name = normalize(rule.chain)
+        if name not in by_name:
+            close = difflib.get_close_matches(name, list(by_name), n=1, cutoff=NAME_MATCH_CUTOFF)
+            if not close:
+                added.append(rule)
+                continue
+            logger.info(f"Config chain {rule.chain} taken for table chain {by_name[close[0]].chain}")
+            name = close[0]
+        reference = by_name[name]
+        for field in ("min_area", "max_area", "min_floor", "max_floor"):
+            ours, theirs = getattr(reference, field), getattr(rule, field)
+            if field not in rule.inherited and theirs is not None and ours != theirs:
+                conflicts.append(f"{reference.chain}: {field} is {ours} in {reference.source}, {theirs} in {rule.source}")
+    return added, conflicts
+
+
+def _append_rules(table: pd.DataFrame, rules: list[ChainRule]) -> pd.DataFrame:
+    """The table with one row per rule added, the criteria the rules do not set left empty."""
+    if not rules:
+        return table
+    rows = pd.DataFrame([
+        {column: getattr(rule, column, None) for column in table.columns} for rule in rules
+    ], columns=table.columns)
+    return pd.concat([table, rows], ignore_index=True)
+
+
+def source_key(facility_path: str, land_path: str, entries: dict) -> str:
+    """A hash of everything the compiled rules depend on."""
+    digest = hashlib.sha256(f"format {CACHE_FORMAT} serve config only {serve_config_only_chains}".encode())
+    # the code that parses and compiles the rules, so that a cache written by an older version is not read
+    for path in (facility_path, land_path, __file__, eligibility.__file__):
+        with open(path, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    digest.update(json.dumps(entries, sort_keys=True, ensure_ascii=False).encode())
+    return digest.hexdigest()[:16]
+
+
+def build(facility_path: str, land_path: str, entries: dict, key: str) -> RuleSet:
+    """
+    Parse, merge, validate and compile both rule sets.
+    Raises:
+        ValueError: A rule is invalid, with every problem found.
+    """
+    compiled, conflicts, repeated, problems, config_only = {}, [], [], [], {}
+    kinds = {
+        "facility": (facility_path, eligibility.facility_column_mapping, eligibility.facility_flags,
+                     eligibility.facility_bounds, entries.get("building", [])),
+        "land": (land_path, eligibility.land_column_mapping, eligibility.land_flags,
+                 eligibility.land_bounds, entries.get("land", [])),
+    }
+    for kind, (path, mapping, flags, bounds, kind_entries) in kinds.items():
+        table = eligibility.read_eligibility_table(path, mapping)
+        try:
+            table_side = table_rules(table, flags, os.path.basename(path))
+            config_side = config_rules(kind_entries, f"config.yaml service.eligibility.{'building' if kind == 'facility' else 'land'}")
+        except ValueError as e:
+            problems.append(f"{kind}: {e}")
+            continue
+        problems += validate(table_side + config_side)
+        added, kind_conflicts = merge(table_side, config_side)
+        conflicts += kind_conflicts
+        repeated += duplicates(config_side)
+        config_only[kind] = [rule.chain for rule in added]
+        served = _append_rules(table, added) if serve_config_only_chains else table
+        compiled[kind] = eligibility.DecisionTable(served, flags, bounds)
+    if problems:
+        raise ValueError("Invalid eligibility rules: " + "; ".join(problems))
+    for conflict in conflicts:
+        logger.warning(f"Eligibility sources disagree, keeping the table: {conflict}")
+    for duplicate in repeated:
+        logger.warning(f"Eligibility chain listed twice, both entries are kept: {duplicate}")
+    for kind, chains in config_only.items():
+        if chains:
+            logger.warning(
+                f"{len(chains)} {kind} chains are only in config.yaml and match any flags, "
+                f"{'served' if serve_config_only_chains else 'not served'}: {', '.join(chains)}"
+            )
+    return RuleSet(
+        key, compiled["facility"], compiled["land"], conflicts + repeated, config_only, serve_config_only_chains
+    )
+
+
+def _cache_path(key: str) -> Optional[str]:
+    return os.path.join(cache_dir, f"eligibility-{key}.pkl") if cache_dir else None
+
+
+def _read_cache(key: str) -> Optional[RuleSet]:
+    path = _cache_path(key)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as file:
+            cached = pickle.load(file)
+    except Exception as e:
+        logger.warning(f"Ignoring the unreadable rule cache {path}: {e}")
+        return None
+    cached.from_cache = True
+    return cached
+
+
+def _write_cache(compiled: RuleSet) -> None:
+    path = _cache_path(compiled.key)
+    if not path:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        pickle.dump(compiled, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    # caches of earlier sources are never read again
+    for name in os.listdir(cache_dir):
+        if name.startswith("eligibility-") and name.endswith(".pkl") and name != os.path.basename(path):
+            os.remove(os.path.join(cache_dir, name))
+
+
+def install(compiled: RuleSet) -> None:
+    """Serve the rule set: the checks and the criteria endpoints read it from now on."""
+    global rule_set
+    eligibility.facility_decision_table = compiled.facility
+    eligibility.land_decision_table = compiled.land
+    eligibility.facility_eligibility_table = compiled.facility.table
+    eligibility.land_eligibility_table = compiled.land.table
+    rule_set = compiled
+
+
+def load_rules(facility_path: str, land_path: str, entries: dict) -> RuleSet:
+    """
+    Serve the rules of the sources, from the cache when they have not changed since it was written.
+    Args:
+        facility_path: The facility criteria table
+        land_path: The land criteria table
+        entries: `service.eligibility` of config.yaml, with `building` and `land` lists
+    """
+    start = time.perf_counter()
+    sources.update(facility=facility_path, land=land_path, entries=entries)
+    key = source_key(facility_path, land_path, entries)
+    compiled = _read_cache(key)
+    if compiled is None:
+        compiled = build(facility_path, land_path, entries, key)
+        try:
+            _write_cache(compiled)
+        except OSError as e:
+            logger.warning(f"Could not cache the compiled eligibility rules: {e}")
+    install(compiled)
+    logger.info(
+        f"Eligibility rules {key} {'read from the cache' if compiled.from_cache else 'compiled'} "
+        f"in {time.perf_counter() - start:.3f}s"
+    )
+    return compiled
+
+
+def reload(entries: Optional[dict] = None) -> tuple[RuleSet, bool]:
+    """
+    Serve the rules again if the sources changed since they were loaded; a failed build keeps the current rules.
+    Args:
+        entries: The current `service.eligibility` of config.yaml, defaults to the one loaded before
+
+    Returns:
+        The rules now served, and whether they changed.
+    """
+    with _reload_lock:
+        entries = sources["entries"] if entries is None else entries
+        key = source_key(sources["facility"], sources["land"], entries)
+        if rule_set is not None and rule_set.key == key:
+            return rule_set, False
+        return load_rules(sources["facility"], sources["land"], entries), True
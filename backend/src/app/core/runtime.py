@@ -0,0 +1,123 @@
+"""
+Native thread pools and CPU placement of the serving process.
+
+XGBoost runs on OpenMP and the MLP on BLAS. Each request thread of uvicorn that calls into them starts its own
+parallel region, so with several workers the threads multiply far past the cores. The `runtime` section of
+config.yaml caps the pools of every library and of every model, and can pin the process to a set of CPUs.
+"""
+import logging
+import os
+from typing import Optional
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Read by OpenMP (XGBoost), OpenBLAS, MKL and Accelerate when they start their thread pools
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"
+]
+
+# Threads of the native pools, None to keep the library defaults
+threads: Optional[int] = None
+# Per-model overrides of `threads`
+model_threads: dict[str, int] = {}
+# CPUs the process is restricted to, None for no pinning
+cpu_affinity: Optional[list[int]] = None
+
+# Threads each loaded model predicts with: its own for XGBoost, the shared pool limit for the others
+applied: dict[str, Optional[int]] = {}
+
+
+def set_thread_env(count: int) -> None:
+    """Cap the native thread pools through the environment. Only libraries loaded afterwards are affected."""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(count)
+
+
+def configure(config) -> None:
+    """
+    Apply the `runtime` section of config.yaml before the numerical libraries are imported.
+    Without an explicit `threads`, a limit already set in the environment (by the launcher) is kept.
+    """
+    global threads, model_threads, cpu_affinity
+    threads = config.get("threads") or None
+    if threads is None and os.environ.get("OMP_NUM_THREADS", "").isdigit():
+        threads = int(os.environ["OMP_NUM_THREADS"])
+    model_threads = dict(config.get("models") or {})
+    cpu_affinity = list(config.get("cpu_affinity") or []) or None
+
+    if threads is not None:
+        set_thread_env(threads)
+    if cpu_affinity is not None:
+        pin(cpu_affinity)
+
+
+def pin(cpus: list[int]) -> None:
+    """Restrict the current process, and the threads it starts from now on, to the given CPUs."""
+    if not hasattr(os, "sched_setaffinity"):
+        logger.warning("CPU affinity is not supported on this platform")
+        return
+    os.sched_setaffinity(0, cpus)
+    logger.info(f"Pinned process {os.getpid()} to CPUs {sorted(cpus)}")
+
+
+def limit_loaded_pools() -> None:
+    """
+    Resize the thread pools of the libraries loaded so far, which no longer read the environment.
+    Called once the models are imported.
+    """
+    if threads is None:
+        return
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        logger.warning("threadpoolctl is not installed, BLAS and OpenMP pools are only limited by the environment")
+        return
+    threadpool_limits(limits=threads)
+
+
+def configure_model(name: str, model) -> None:
+    """
+    Set the threads a model predicts with. XGBoost models get their own nthread; the others predict on the BLAS
+    pool the whole process shares, whose size is `threads`, so a per-model override cannot apply to them.
+    """
+    if hasattr(model, "get_booster"):
+        count = model_threads.get(name, threads)
+        if count is not None:
+            model.set_params(n_jobs=count)
+    else:
+        if name in model_threads:
+            logger.warning(f"Ignoring runtime.models.{name}: only XGBoost models have threads of their own")
+        count = threads
+    applied[name] = count
+
+
+def report() -> dict:
+    """Thread and CPU settings in effect in this process."""
+    info = []
+    try:
+        from threadpoolctl import threadpool_info
+
+        info = [
+            {key: pool.get(key) for key in ("user_api", "internal_api", "num_threads", "prefix")}
+            for pool in threadpool_info()
+        ]
+    except ImportError:
+        pass
+    return {
+        "pid": os.getpid(),
+        "cpu_count": os.cpu_count(),
+        "cpu_affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "threads": threads,
+        "environment": {name: os.environ.get(name) for name in THREAD_ENV_VARS},
+        "thread_pools": info,
+        "models": applied,
+    }
+
+
+def _thread_stats() -> dict[tuple, float]:
+    return {(name,): count for name, count in applied.items() if count is not None}
+
+
+metrics.Gauge("model_threads", "Threads each model predicts with", ("model",), callback=_thread_stats)
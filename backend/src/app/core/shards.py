@@ -0,0 +1,192 @@
+"""
+Per-city shards: the listings, city center, models and geo tables of the cities served next to the default one.
+
+The default city is served by `data`, `model` and `geo` as before. Every city configured under `cities.shards`
+gets a `CityShard` loaded on its first request. The shards share a memory budget: when a load goes over it, the
+least recently used shards are dropped, to be loaded again when next asked for. A request that already holds a
+dropped shard finishes with it. Cities without a shard of their own are served by the default city, whose
+listings cover the towns of the Moscow region as well.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import pandas as pd
+from app.core import data, geo, metrics
+
+logger = logging.getLogger(__name__)
+
+default_city = "Москва"
+# Bytes the loaded shards may hold together; the shard just loaded is kept even when it alone is larger
+memory_budget = 2048 * 2 ** 20
+
+
+def normalize(city) -> str:
+    return " ".join(str(city).casefold().replace("ё", "е").split())
+
+
+class CityShard:
+    """Everything needed to serve the queries and predictions of one city."""
+
+    def __init__(self, city: str, center: tuple[float, float], prices: pd.DataFrame, models: dict,
+                 versions: dict[str, str], model_bytes: int, stations: Optional[geo.Stations] = None,
+                 okrugs: Optional[geo.Okrugs] = None):
+        self.city = city
+        self.center = center
+        # sorted by latitude like `data.data`, the index the radius and polygon queries narrow their scan with
+        self.prices = prices
+        self.models = models
+        self.versions = versions
+        self.stations = stations
+        self.okrugs = okrugs
+        self.nbytes = int(prices.memory_usage(index=True, deep=True).sum()) + model_bytes
+
+    def get_model(self, model_name: str):
+        """The model of that name of the city; `model.UnknownModel` for a model the city is not served with."""
+        from app.core.model import UnknownModel
+
+        if model_name not in self.models:
+            raise UnknownModel(model_name, self.city)
+        return self.models[model_name]
+
+    def fill_missing(self, inputs: pd.DataFrame) -> pd.DataFrame:
+        """`geo.fill_missing` with the stations and okrugs of the city."""
+        return geo.fill_missing_from(inputs, self.stations, self.okrugs)
+
+
+def load_shard(city: str, config) -> CityShard:
+    """
+    Read the shard of a city from its `cities.shards` entry.
+    Args:
+        city: The name of the city
+        config: `center` as [latitude, longitude], `prices` (CSV like resources.prices), `models` mapping names
+            to pickled models, and optionally `metro_stations` and `okrugs` files
+    """
+    from app.core.model import read_model
+
+    start = time.perf_counter()
+    prices = data.index_by_latitude(pd.read_csv(config["prices"]))
+    models, versions, model_bytes = {}, {}, 0
+    for model_name, model_path in config.get("models", {}).items():
+        models[model_name], versions[model_name], size = read_model(model_name, model_path)
+        model_bytes += size
+    stations = geo.read_stations(config["metro_stations"]) if config.get("metro_stations") else None
+    okrugs = geo.read_okrugs(config["okrugs"]) if config.get("okrugs") else None
+    latitude, longitude = config["center"]
+    shard = CityShard(city, (float(latitude), float(longitude)), prices, models, versions, model_bytes,
+                      stations, okrugs)
+    logger.info(
+        f"Loaded the {city} shard: {len(prices)} listings, {len(models)} models, "
+        f"{shard.nbytes / 2 ** 20:.1f} MiB in {time.perf_counter() - start:.3f}s"
+    )
+    return shard
+
+
+class ShardManager:
+    """The configured cities, with the shards of the recently used ones held in memory."""
+
+    def __init__(self, configs: dict, budget: int):
+        self.configs = {normalize(city): (str(city), config) for city, config in configs.items()}
+        self.budget = budget
+        # least recently used first
+        self._shards: OrderedDict[str, CityShard] = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per city, so that concurrent first requests load a shard once without blocking other cities
+        self._loading: dict[str, threading.Lock] = {}
+        self.evictions = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(shard.nbytes for shard in self._shards.values())
+
+    def get(self, city: str) -> Optional[CityShard]:
+        """The shard of a city, loaded on first use; None for a city without one."""
+        key = normalize(city)
+        if key not in self.configs:
+            return None
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is not None:
+                self._shards.move_to_end(key)
+            loading = self._loading.setdefault(key, threading.Lock())
+        metrics.record_cache("city_shards", shard is not None)
+        if shard is not None:
+            return shard
+        with loading:
+            with self._lock:
+                shard = self._shards.get(key)
+            if shard is None:
+                name, config = self.configs[key]
+                shard = load_shard(name, config)
+                with self._lock:
+                    self._shards[key] = shard
+                    self._evict(keep=key)
+        return shard
+
+    def _evict(self, keep: str) -> None:
+        while self.nbytes > self.budget and len(self._shards) > 1:
+            oldest = next(key for key in self._shards if key != keep)
+            shard = self._shards.pop(oldest)
+            self.evictions += 1
+            logger.info(f"Dropped the {shard.city} shard to stay within the memory budget")
+
+    def status(self) -> dict:
+        with self._lock:
+            loaded = [
+                {"city": shard.city, "bytes": shard.nbytes, "listings": len(shard.prices), "models": list(shard.models)}
+                for shard in self._shards.values()
+            ]
+        return {
+            "default_city": default_city,
+            "cities": [name for name, _ in self.configs.values()],
+            "memory_budget": self.budget,
+            "loaded": loaded,
+            "evictions": self.evictions,
+        }
+
+
+manager: Optional[ShardManager] = None
+
+
+def configure(config) -> None:
+    """Apply the `cities` section of config.yaml."""
+    global default_city, memory_budget, manager
+    default_city = config.get("default", default_city)
+    memory_budget = int(float(config.get("memory_budget_mb", memory_budget / 2 ** 20)) * 2 ** 20)
+    shards = {
+        city: shard for city, shard in (config.get("shards") or {}).items() if normalize(city) != normalize(default_city)
+    }
+    manager = ShardManager(shards, memory_budget) if shards else None
+
+
+def shard_for(city: Optional[str]) -> Optional[CityShard]:
+    """The shard serving a city, or None when the default city serves it."""
+    if city is None or manager is None:
+        return None
+    return manager.get(city)
+
+
+def served_city(city: Optional[str]) -> str:
+    """The name of the city whose shard serves `city`, without loading it."""
+    if city is not None and manager is not None and normalize(city) in manager.configs:
+        return manager.configs[normalize(city)][0]
+    return default_city
+
+
+def status() -> dict:
+    if manager is None:
+        return {"default_city": default_city, "cities": [], "memory_budget": memory_budget, "loaded": [], "evictions": 0}
+    return manager.status()
+
+
+def _shard_stats() -> dict[tuple, float]:
+    if manager is None:
+        return {}
+    with manager._lock:
+        return {("loaded",): len(manager._shards), ("bytes",): manager.nbytes, ("evictions",): manager.evictions}
+
+
+metrics.Gauge("city_shards", "Loaded city shards, their bytes and the shards dropped so far", ("stat",),
+              callback=_shard_stats)
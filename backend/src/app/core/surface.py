@@ -0,0 +1,84 @@
+"""
+Predicted price per square meter over a latitude/longitude grid or a set of points, with every other attribute
+of the listing held fixed, and its encodings as GeoJSON and as a PNG heatmap.
+"""
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+from app.api import schemas
+from app.core.model import predict_frame
+
+# Colors of the heatmap from the lowest to the highest price, interpolated linearly
+PALETTE = np.array([
+    [49, 54, 149], [69, 117, 180], [116, 173, 209], [171, 217, 233], [254, 224, 144],
+    [253, 174, 97], [244, 109, 67], [215, 48, 39], [165, 0, 38],
+], dtype=float)
+
+
+def grid_axes(bbox: schemas.BoundingBox, resolution: int) -> tuple[np.ndarray, np.ndarray]:
+    """Cell center latitudes from north to south and longitudes from west to east."""
+    return (
+        np.linspace(bbox.max_latitude, bbox.min_latitude, resolution),
+        np.linspace(bbox.min_longitude, bbox.max_longitude, resolution),
+    )
+
+
+def predict_points(base: schemas.PredictionRequest, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Predictions for the base listing moved to each of the points."""
+    inputs = pd.DataFrame({**base.dict(), "latitude": latitudes, "longitude": longitudes})
+    return predict_frame(base.model, inputs, city=base.city)
+
+
+def predict_grid(base: schemas.PredictionRequest, bbox: schemas.BoundingBox, resolution: int):
+    """
+    Predictions for the base listing at every cell of a `resolution` x `resolution` grid over the bounding box.
+    Returns:
+        The latitude axis, the longitude axis and the predictions, one row per latitude, north first.
+    """
+    latitudes, longitudes = grid_axes(bbox, resolution)
+    grid_lat, grid_lon = np.meshgrid(latitudes, longitudes, indexing="ij")
+    prices = predict_points(base, grid_lat.ravel(), grid_lon.ravel())
+    return latitudes, longitudes, prices.reshape(resolution, resolution)
+
+
+def to_geojson(latitudes: np.ndarray, longitudes: np.ndarray, prices: np.ndarray) -> dict:
+    """A FeatureCollection with one point per prediction."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+                "properties": {"predicted_price_per_sqm": price},
+            }
+            for latitude, longitude, price in zip(latitudes.tolist(), longitudes.tolist(), prices.tolist())
+        ],
+    }
+
+
+def colorize(prices: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Map a 2D array of prices to RGB pixels along the palette."""
+    scaled = np.clip((prices - low) / (high - low or 1.0), 0, 1) * (len(PALETTE) - 1)
+    lower = np.floor(scaled).astype(int)
+    upper = np.minimum(lower + 1, len(PALETTE) - 1)
+    weight = (scaled - lower)[..., None]
+    return np.round(PALETTE[lower] * (1 - weight) + PALETTE[upper] * weight).astype(np.uint8)
+
+
+def _chunk(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+
+def to_png(pixels: np.ndarray) -> bytes:
+    """Encode an RGB image array of shape (height, width, 3) as PNG."""
+    height, width, _ = pixels.shape
+    # every scanline starts with the filter type, 0 for none
+    scanlines = np.hstack([np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, width * 3)])
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + _chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6))
+        + _chunk(b"IEND", b"")
+    )
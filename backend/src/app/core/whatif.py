@@ -0,0 +1,68 @@
+"""What-if analysis: the base listing with some attributes changed, scored as one batch against the unchanged one."""
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
+from app.api import schemas
+from app.core.model import predict_frame
+
+# Attributes that can be swept, in the column order of the result
+SWEEP_FIELDS = ["area", "floor", "time_to_station", "condition", "transport"]
+
+
+def sweep_size(sweep) -> int:
+    """The number of values of a sweep, counted without building them; `sweep_values` returns that many."""
+    if isinstance(sweep, schemas.Range):
+        return max(0, math.ceil((sweep.stop - sweep.start) / sweep.step + 0.5))
+    return len(sweep)
+
+
+def sweep_values(sweep) -> list:
+    """The values of a sweep: a `schemas.Range` from start to stop inclusive, or a list of values."""
+    if isinstance(sweep, schemas.Range):
+        return np.arange(sweep.start, sweep.stop + sweep.step / 2, sweep.step).round(6).tolist()
+    return list(sweep)
+
+
+def expand(base: schemas.PredictionRequest, sweeps: dict[str, list], mode: str = "each") -> pd.DataFrame:
+    """
+    The variants of the base listing, the base itself first.
+    Args:
+        base: The listing to vary
+        sweeps: Values for some of `SWEEP_FIELDS`
+        mode: `each` to vary one attribute at a time, `product` for every combination of the values
+
+    Returns:
+        pd.DataFrame: One listing per row, with a `changed` column naming the varied attributes.
+    """
+    variants = [{}]
+    if mode == "product":
+        fields = list(sweeps)
+        variants += [dict(zip(fields, values)) for values in itertools.product(*sweeps.values())]
+    else:
+        variants += [{field: value} for field, values in sweeps.items() for value in values]
+    rows = pd.DataFrame([base.dict()] * len(variants))
+    for field in sweeps:
+        rows[field] = [variant.get(field, rows.at[index, field]) for index, variant in enumerate(variants)]
+        if isinstance(getattr(base, field), int):
+            rows[field] = rows[field].round().astype(int)
+    rows["changed"] = ["base"] + [",".join(variant) for variant in variants[1:]]
+    return rows
+
+
+def what_if(base: schemas.PredictionRequest, sweeps: dict[str, list], mode: str = "each") -> tuple[float, pd.DataFrame]:
+    """
+    Score every variant of the base listing in one model call.
+    Returns:
+        The base prediction, and a table of the variants with their prediction and its change from the base.
+    """
+    rows = expand(base, sweeps, mode)
+    predictions = predict_frame(base.model, rows, city=base.city)
+    base_price = float(predictions[0])
+    table = rows.loc[1:, ["changed", *SWEEP_FIELDS]].assign(
+        predicted_price_per_sqm=predictions[1:],
+        delta=predictions[1:] - base_price,
+        delta_pct=(predictions[1:] / base_price - 1) * 100 if base_price else np.nan,
+    )
+    return base_price, table.reset_index(drop=True)
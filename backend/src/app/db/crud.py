@@ -1,25 +1,29 @@
 import logging
 
-from app.db.database import get_session
+from app.core.metrics import timed
+from app.db.database import DB_BATCH_SIZE, get_enginge, get_session
 from app.db.models import Item, User
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@timed("db")
 def read_user(user_id: int) -> User:
     db: Session = get_session()
     result = db.query(User).filter(User.id == user_id).first()
     db.close()
     return result
 
+@timed("db")
 def get_user_by_username(username: str) -> User:
     db: Session = get_session()
     result = db.query(User).filter(User.name == username).first()
     db.close()
     return result
 
+@timed("db")
 def create_user(username: str) -> User:
     db: Session = get_session()
     db_user = User(name=username)
@@ -29,12 +33,14 @@ def create_user(username: str) -> User:
     db.close()
     return db_user
 
+@timed("db")
 def read_users() -> list[User]:
     db: Session = get_session()
     result = db.query(User).all()
     db.close()
     return result
 
+@timed("db")
 def delete_user(user_id: int) -> bool:
     db: Session = get_session()
     user = db.query(User).filter(User.id == user_id).first()
@@ -46,6 +52,7 @@ def delete_user(user_id: int) -> bool:
     db.close()
     return False
 
+@timed("db")
 def create_item(user_id: int, title: str, description: str) -> Item:
     db: Session = get_session()
     db_item = Item(owner_id=user_id, title=title, description=description)
@@ -55,12 +62,14 @@ def create_item(user_id: int, title: str, description: str) -> Item:
     db.close()
     return db_item
 
+@timed("db")
 def get_user_items(user_id: int) -> list[Item]:
     db: Session = get_session()
     result = db.query(Item).filter(Item.owner_id == user_id).all()
     db.close()
     return result
 
+@timed("db")
 def delete_item(user_id:int, item_id: int) -> bool:
     db: Session = get_session()
     item = db.query(Item).filter(Item.id == item_id, Item.owner_id == user_id).first()
@@ -71,3 +80,46 @@ def delete_item(user_id:int, item_id: int) -> bool:
         return True
     db.close()
     return False
+
+
+def _batches(rows: list, batch_size: int):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+@timed("db")
+def bulk_create_users(usernames: list[str], batch_size: int = DB_BATCH_SIZE) -> int:
+    """Insert the users that do not exist yet, in one transaction. Returns the number of users created."""
+    engine = get_enginge()
+    rows = [{"name": name} for name in dict.fromkeys(usernames)]
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    created = 0
+    with engine.begin() as connection:
+        for batch in _batches(rows, batch_size):
+            if insert is not None:
+                statement = insert(User.__table__).values(batch).on_conflict_do_nothing(index_elements=["name"])
+            else:
+                names = [row["name"] for row in batch]
+                existing = set(connection.execute(select(User.name).where(User.name.in_(names))).scalars())
+                new_rows = [row for row in batch if row["name"] not in existing]
+                if not new_rows:
+                    continue
+                statement = User.__table__.insert().values(new_rows)
+            created += connection.execute(statement).rowcount
+    logger.info(f"Created {created} of {len(usernames)} users")
+    return created
+
+@timed("db")
+def bulk_create_items(user_id: int, items: list[dict], batch_size: int = DB_BATCH_SIZE) -> int:
+    """Insert items with a title and a description for a user, in one transaction. Returns the number of items created."""
+    rows = [{"owner_id": user_id, "title": item["title"], "description": item.get("description")} for item in items]
+    with get_enginge().begin() as connection:
+        for batch in _batches(rows, batch_size):
+            connection.execute(Item.__table__.insert(), batch)
+    logger.info(f"Created {len(rows)} items for user {user_id}")
+    return len(rows)
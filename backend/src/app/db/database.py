@@ -1,17 +1,18 @@
-import logging.config
+import logging
 import os
+from functools import lru_cache
 
+from app.core import metrics
 from dotenv import find_dotenv, load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
 
 
 from .models import Base
 
 
-# Load logging configuration with OmegaConf
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv(find_dotenv(usecwd=True))
@@ -23,28 +24,62 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 APP_NAME = os.getenv("APP_NAME")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Rows per statement of the bulk inserts; all batches of one call share a transaction
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "1000"))
 
-# Check if any of the required environment variables are not set
-if not all([DB_HOST, DB_NAME, DB_USER, DB_PASSWORD]):
-    logger.error("One or more database environment variables are not set.")
-    exit(1)
+# A full URL, e.g. `sqlite:///app.db` for local runs and benchmarks, takes precedence over the DB_* variables
+DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Construct the database URL
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=require"
+if DATABASE_URL is None:
+    # Check if any of the required environment variables are not set
+    if not all([DB_HOST, DB_NAME, DB_USER, DB_PASSWORD]):
+        logger.error("One or more database environment variables are not set.")
+        exit(1)
 
+    # Construct the database URL
+    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=require"
+
+@lru_cache(maxsize=None)
 def get_enginge():
-    logger.info(f"Creating database engine for {DB_NAME}")
+    """Create the process-wide engine; connections are reused through its pool."""
+    logger.info(f"Creating database engine for {make_url(DATABASE_URL).render_as_string(hide_password=True)}")
+    if DATABASE_URL.startswith("sqlite"):
+        return create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
     return create_engine(
         DATABASE_URL,
         connect_args={'connect_timeout': 5, "application_name": APP_NAME},
-        poolclass=NullPool
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True
     )
 
+
+@lru_cache(maxsize=None)
+def get_sessionmaker():
+    return sessionmaker(bind=get_enginge())
+
+
+def pool_stats() -> dict[tuple, float]:
+    """Connection counts of the engine pool, reported on /metrics."""
+    if get_enginge.cache_info().currsize == 0 or not isinstance(get_enginge().pool, QueuePool):
+        return {}
+    pool = get_enginge().pool
+    return {
+        ("size",): pool.size(),
+        ("checked_in",): pool.checkedin(),
+        ("checked_out",): pool.checkedout(),
+        ("overflow",): pool.overflow(),
+    }
+
+
+metrics.Gauge("db_pool_connections", "Connections in the database pool by state", ("state",), callback=pool_stats)
+
 def create_tables():
     engine = get_enginge()
     Base.metadata.create_all(engine)
     logger.info("Tables created")
 
 def get_session():
-    engine = get_enginge()
-    return sessionmaker(bind=engine)()
\ No newline at end of file
+    return get_sessionmaker()()
\ No newline at end of file
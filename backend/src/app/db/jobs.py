@@ -0,0 +1,117 @@
+"""
+The `jobs` table, through which the processes of the service share their background jobs.
+
+A process takes a queued job with a conditional update, so two processes never run the same job.
+"""
+import time
+from typing import Optional
+
+from app.core.metrics import timed
+from app.db.database import get_session
+from app.db.models import Job
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+@timed("db")
+def create_job(job_id: str, kind: str, params: str, total_chunks: Optional[int]) -> Job:
+    db: Session = get_session()
+    job = Job(id=job_id, kind=kind, status="queued", params=params, total_chunks=total_chunks, created_at=time.time())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    db.close()
+    return job
+
+
+@timed("db")
+def get_job(job_id: str) -> Optional[Job]:
+    db: Session = get_session()
+    job = db.query(Job).filter(Job.id == job_id).first()
+    db.close()
+    return job
+
+
+@timed("db")
+def list_jobs(limit: int, status: Optional[str] = None) -> list[Job]:
+    """The most recent jobs first."""
+    db: Session = get_session()
+    query = db.query(Job)
+    if status is not None:
+        query = query.filter(Job.status == status)
+    jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+    db.close()
+    return jobs
+
+
+@timed("db")
+def queued_jobs(limit: int) -> list[Job]:
+    """The jobs waiting to run, oldest first."""
+    db: Session = get_session()
+    jobs = db.query(Job).filter(Job.status == "queued").order_by(Job.created_at).limit(limit).all()
+    db.close()
+    return jobs
+
+
+def _update(*conditions, **values) -> int:
+    db: Session = get_session()
+    result = db.execute(update(Job).where(*conditions).values(**values).execution_options(synchronize_session=False))
+    db.commit()
+    db.close()
+    return result.rowcount
+
+
+@timed("db")
+def claim(job_id: str, runner_id: str) -> bool:
+    """Mark a queued job as run by a runner; False when another process took it or it was cancelled meanwhile."""
+    now = time.time()
+    return _update(
+        Job.id == job_id, Job.status == "queued", status="running", runner_id=runner_id, started_at=now,
+        heartbeat_at=now,
+    ) == 1
+
+
+@timed("db")
+def update_running(job_id: str, runner_id: str, **values) -> bool:
+    """
+    Update a job still running under a runner; False when it was queued again and possibly taken by another
+    runner meanwhile, which then owns it.
+    """
+    return _update(Job.id == job_id, Job.status == "running", Job.runner_id == runner_id, **values) == 1
+
+
+@timed("db")
+def heartbeat(job_ids: list[str], runner_id: str) -> None:
+    if job_ids:
+        _update(Job.id.in_(job_ids), Job.status == "running", Job.runner_id == runner_id, heartbeat_at=time.time())
+
+
+@timed("db")
+def requeue_stale(cutoff: float, max_attempts: int) -> tuple[int, int]:
+    """
+    Queue again the running jobs whose process stopped refreshing their heartbeat before `cutoff`, and fail
+    those that already lost `max_attempts` processes: such a job is likely what brings its process down.
+    Returns:
+        The numbers of jobs queued again and failed.
+    """
+    stale = (Job.status == "running", Job.heartbeat_at < cutoff)
+    failed = _update(
+        *stale, Job.attempts + 1 >= max_attempts, status="failed", attempts=Job.attempts + 1, runner_id=None,
+        error="The processes running the job stopped responding", finished_at=time.time(),
+    )
+    requeued = _update(*stale, status="queued", attempts=Job.attempts + 1, runner_id=None)
+    return requeued, failed
+
+
+@timed("db")
+def request_cancel(job_id: str) -> Optional[Job]:
+    """
+    Cancel a queued job at once, or ask the process running a job to stop it after its current chunk.
+    Returns:
+        The job afterwards, or None when it does not exist.
+    """
+    if not _update(Job.id == job_id, Job.status == "queued", status="cancelled", finished_at=time.time()):
+        _update(Job.id == job_id, Job.status == "running", cancel_requested=True)
+    return get_job(job_id)
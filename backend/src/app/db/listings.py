@@ -0,0 +1,217 @@
+"""
+Spatial queries over the `listings` table.
+
+With the PostGIS extension installed, radius, nearest neighbour and aggregate queries are answered by
+`ST_DWithin` and the `<->` operator over a GiST index on the geography of each listing. On SQLite and plain
+Postgres the (latitude, longitude) index narrows the rows to the bounding box of the circle and the exact
+great-circle distance is applied to that box only. Polygon queries always narrow the rows by that index to the
+bounding box of the polygon and test the remaining points in numpy.
+
+Load a CSV with the columns of prices.csv (COPY on Postgres, batched inserts elsewhere):
+
+    python -m app.db.listings ./backend/data/prices.csv
+"""
+import argparse
+import logging
+import math
+from functools import lru_cache
+from typing import Iterator, Optional
+
+import pandas as pd
+from app.core.data import COLUMNS, EARTH_RADIUS_KM, describe_prices, haversine
+from app.core.metrics import timed
+from app.db.database import create_tables, get_enginge
+from app.db.models import Listing
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Rows inserted per statement when COPY is not available
+INSERT_BATCH_ROWS = 10_000
+
+# Must match the expression of the GiST index for the planner to use it
+GEOGRAPHY = "(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography)"
+CENTER = "(ST_SetSRID(ST_MakePoint(:longitude, :latitude), 4326)::geography)"
+SELECT_COLUMNS = ", ".join(COLUMNS)
+
+
+@lru_cache(maxsize=None)
+def has_postgis() -> bool:
+    engine = get_enginge()
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")).first() is not None
+
+
+def create_spatial_index() -> None:
+    """Create the listings table, and the geography index when PostGIS is available."""
+    create_tables()
+    if has_postgis():
+        with get_enginge().begin() as connection:
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_listings_geography ON listings USING GIST ({GEOGRAPHY})"))
+        logger.info("Spatial index on listings is ready")
+
+
+def bounding_box(latitude: float, longitude: float, radius: float) -> tuple[float, float, float, float]:
+    """Latitude and longitude bounds of the circle of `radius` kilometers around the center."""
+    lat_delta = math.degrees(radius / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    lon_delta = 180.0 if cos_lat < 1e-6 else min(180.0, lat_delta / cos_lat)
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def _read(query: str, **params) -> pd.DataFrame:
+    with get_enginge().connect() as connection:
+        result = connection.execute(text(query), params)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def _in_box(latitude: float, longitude: float, radius: float) -> pd.DataFrame:
+    """Listings inside the bounding box of the circle, with their distance to the center in kilometers."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+    frame = _read(
+        f"SELECT {SELECT_COLUMNS} FROM listings "
+        "WHERE latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon",
+        min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon,
+    )
+    frame["distance"] = haversine(latitude, longitude, frame["latitude"].to_numpy(), frame["longitude"].to_numpy())
+    return frame
+
+
+@timed("db")
+def within_radius(latitude: float, longitude: float, radius: float) -> pd.DataFrame:
+    """Listings within `radius` kilometers of the center."""
+    if has_postgis():
+        return _read(
+            f"SELECT {SELECT_COLUMNS} FROM listings WHERE ST_DWithin({GEOGRAPHY}, {CENTER}, :meters)",
+            latitude=latitude, longitude=longitude, meters=radius * 1000,
+        )
+    frame = _in_box(latitude, longitude, radius)
+    return frame.loc[frame["distance"] <= radius, COLUMNS].reset_index(drop=True)
+
+
+def iter_within_radius(latitude: float, longitude: float, radius: float, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Listings within `radius` kilometers of the center, fetched from a server-side cursor `chunk_rows` at a time."""
+    if has_postgis():
+        query = f"SELECT {SELECT_COLUMNS} FROM listings WHERE ST_DWithin({GEOGRAPHY}, {CENTER}, :meters)"
+        params = {"latitude": latitude, "longitude": longitude, "meters": radius * 1000}
+    else:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+        query = (
+            f"SELECT {SELECT_COLUMNS} FROM listings "
+            "WHERE latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon"
+        )
+        params = {"min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon}
+    with get_enginge().connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(text(query), params)
+        while rows := result.fetchmany(chunk_rows):
+            chunk = pd.DataFrame(rows, columns=COLUMNS)
+            if not has_postgis():
+                distances = haversine(latitude, longitude, chunk["latitude"].to_numpy(), chunk["longitude"].to_numpy())
+                chunk = chunk[distances <= radius]
+            if len(chunk):
+                yield chunk
+
+
+@timed("db")
+def nearest(latitude: float, longitude: float, k: int) -> pd.DataFrame:
+    """The `k` listings closest to the point, nearest first, with their distance in kilometers."""
+    if has_postgis():
+        return _read(
+            f"SELECT {SELECT_COLUMNS}, ST_Distance({GEOGRAPHY}, {CENTER}) / 1000 AS distance FROM listings "
+            f"ORDER BY {GEOGRAPHY} <-> {CENTER} LIMIT :k",
+            latitude=latitude, longitude=longitude, k=k,
+        )
+    # Grow the search circle until it holds k listings; a listing outside the circle but inside
+    # its box may be farther than one not fetched yet, so only those within the radius are final
+    total = count()
+    radius = 0.5
+    while True:
+        frame = _in_box(latitude, longitude, radius)
+        found = frame[frame["distance"] <= radius]
+        if len(found) >= k or len(frame) >= total or radius > math.pi * EARTH_RADIUS_KM:
+            result = (found if len(found) >= k else frame).nsmallest(k, "distance")
+            return result.reset_index(drop=True)
+        radius *= 2
+
+
+@timed("db")
+def price_stats(latitude: float, longitude: float, radius: float) -> dict[str, Optional[float]]:
+    """Count, mean, median, min and max price per meter of the listings within the radius."""
+    if has_postgis():
+        stats = _read(
+            "SELECT count(*) AS count, avg(price_per_meter) AS mean, "
+            "percentile_cont(0.5) WITHIN GROUP (ORDER BY price_per_meter) AS median, "
+            "min(price_per_meter) AS min, max(price_per_meter) AS max "
+            f"FROM listings WHERE ST_DWithin({GEOGRAPHY}, {CENTER}, :meters)",
+            latitude=latitude, longitude=longitude, meters=radius * 1000,
+        )
+        return {key: (None if pd.isna(value) else float(value)) for key, value in stats.iloc[0].items()}
+    return describe_prices(within_radius(latitude, longitude, radius)["price_per_meter"].to_numpy())
+
+
+@timed("db")
+def within_polygon(polygon) -> pd.DataFrame:
+    """Listings inside a `geo.PreparedPolygon`: the index narrows them to its bounding box, numpy does the rest."""
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    frame = _read(
+        f"SELECT {SELECT_COLUMNS} FROM listings "
+        "WHERE latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon",
+        min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon,
+    )
+    if frame.empty:
+        return pd.DataFrame(columns=COLUMNS, dtype=float)
+    return frame[polygon.contains(frame["latitude"].to_numpy(), frame["longitude"].to_numpy())].reset_index(drop=True)
+
+
+def polygon_price_stats(polygon) -> dict[str, Optional[float]]:
+    """Count, mean, median, min and max price per meter of the listings inside the polygon."""
+    return describe_prices(within_polygon(polygon)["price_per_meter"].to_numpy(dtype=float))
+
+
+def count() -> int:
+    with get_enginge().connect() as connection:
+        return connection.execute(text("SELECT count(*) FROM listings")).scalar()
+
+
+@timed("db")
+def load_csv(path: str) -> int:
+    """Append the listings of a CSV with the columns of prices.csv and return the number of rows loaded."""
+    engine = get_enginge()
+    if engine.dialect.name == "postgresql":
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor, open(path, encoding="utf-8") as file:
+                header = file.readline().strip().split(",")
+                if sorted(header) != sorted(COLUMNS):
+                    raise ValueError(f"Expected the columns {COLUMNS} in {path}, got {header}")
+                cursor.copy_expert(f"COPY listings ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)", file)
+                loaded = cursor.rowcount
+            connection.commit()
+        finally:
+            connection.close()
+    else:
+        loaded = 0
+        insert = Listing.__table__.insert()
+        with engine.begin() as connection:
+            for chunk in pd.read_csv(path, usecols=COLUMNS, chunksize=INSERT_BATCH_ROWS):
+                connection.execute(insert, chunk.to_dict("records"))
+                loaded += len(chunk)
+    logger.info(f"Loaded {loaded} listings from {path}")
+    return loaded
+
+
+def main():
+    from app.core import log
+
+    log.configure()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV file with price_per_meter, latitude and longitude columns")
+    args = parser.parse_args()
+    create_spatial_index()
+    load_csv(args.path)
+
+
+if __name__ == "__main__":
+    main()
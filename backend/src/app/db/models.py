@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -21,3 +21,62 @@ class Item(Base):
     owner_id = Column(Integer, ForeignKey("users.id"))
 
     owner = relationship("User", back_populates="items")
+
+
+class Listing(Base):
+    __tablename__ = "listings"
+    # B-tree on (latitude, longitude) for the bounding box prefilter; with PostGIS the repository
+    # adds a GiST index on the geography of the point, see app.db.listings.create_spatial_index
+    __table_args__ = (Index("ix_listings_latitude_longitude", "latitude", "longitude"),)
+
+    id = Column(Integer, primary_key=True)
+    price_per_meter = Column(Float, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+
+
+class Job(Base):
+    """A background job of app.core.jobs; times are seconds since the epoch."""
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_created_at", "status", "created_at"),)
+
+    id = Column(String(32), primary_key=True)
+    kind = Column(String, nullable=False)
+    # queued, running, succeeded, failed or cancelled
+    status = Column(String, nullable=False, default="queued")
+    params = Column(Text, nullable=False)
+    total_chunks = Column(Integer)
+    done_chunks = Column(Integer, nullable=False, default=0)
+    rows = Column(Integer, nullable=False, default=0)
+    # processes lost while running the job
+    attempts = Column(Integer, nullable=False, default=0)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    error = Column(Text)
+    created_at = Column(Float, nullable=False)
+    started_at = Column(Float)
+    finished_at = Column(Float)
+    # refreshed by the process running the job; a stale one means that process is gone
+    heartbeat_at = Column(Float)
+    # the runner that claimed the job last; only it may record the progress and the outcome of the job
+    runner_id = Column(String(32))
+
+
+class PredictionRecord(Base):
+    """A prediction served by the API, written by the history buffer of app.core.history."""
+    __tablename__ = "predictions"
+    __table_args__ = (Index("ix_predictions_model_created_at", "model", "created_at"),)
+
+    id = Column(Integer, primary_key=True)
+    # seconds since the epoch
+    created_at = Column(Float, nullable=False)
+    endpoint = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    # content hash of the model file, see app.core.model.get_model_version
+    model_version = Column(String, nullable=False)
+    city = Column(String)
+    # the fields of the prediction request, as JSON
+    inputs = Column(Text, nullable=False)
+    predicted_price_per_sqm = Column(Float)
+    # seconds spent scoring the call the prediction was part of, and the rows of that call
+    latency = Column(Float, nullable=False)
+    batch_rows = Column(Integer, nullable=False, default=1)
@@ -0,0 +1,18 @@
+"""The `predictions` table, the history of the predictions served, written in bulk by app.core.history."""
+import logging
+
+from app.core.metrics import timed
+from app.db.database import DB_BATCH_SIZE, get_enginge
+from app.db.models import PredictionRecord
+
+logger = logging.getLogger(__name__)
+
+
+@timed("db")
+def insert_predictions(records: list[dict], batch_size: int = DB_BATCH_SIZE) -> int:
+    """Insert prediction records, in one transaction. Returns the number of records inserted."""
+    insert = PredictionRecord.__table__.insert()
+    with get_enginge().begin() as connection:
+        for start in range(0, len(records), batch_size):
+            connection.execute(insert, records[start:start + batch_size])
+    return len(records)
@@ -0,0 +1,49 @@
+"""
+Send listings from a CSV file with the columns of prices.csv to a running service, in batches:
+
+    python -m app.ingest new_listings.csv --url http://localhost:8000 --mode upsert
+"""
+import argparse
+import json
+import logging
+import urllib.request
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["price_per_meter", "latitude", "longitude"]
+
+
+def post_batch(url: str, listings: pd.DataFrame, mode: str) -> dict:
+    body = json.dumps({"listings": listings.to_dict("records"), "mode": mode}).encode()
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/data/listings", data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request) as response:  # noqa: S310 - the URL is given by the operator
+        return json.load(response)
+
+
+def main():
+    from app.core import log
+
+    log.configure()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV file with price_per_meter, latitude and longitude columns")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the service")
+    parser.add_argument("--mode", choices=["append", "upsert"], default="append")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Listings sent per request")
+    args = parser.parse_args()
+
+    totals = {"added": 0, "updated": 0, "duplicates": 0}
+    result = {}
+    for batch in pd.read_csv(args.path, usecols=COLUMNS, chunksize=args.batch_size):
+        result = post_batch(args.url, batch.dropna(), args.mode)
+        for key in totals:
+            totals[key] += result[key]
+        logger.info(f"Sent {len(batch)} listings, dataset version {result['version']} has {result['rows']} rows")
+    logger.info(f"Done: {totals}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Per-route concurrency limits, bounded queues and the requests turned away by admission control."""
+import asyncio
+
+import pytest
+from app.core import admission
+
+
+def test_a_freed_slot_goes_to_the_oldest_waiting_request():
+    async def scenario():
+        limiter = admission.RouteLimiter("/slow", concurrency=1, queue=2, max_wait=5.0)
+        await limiter.acquire()
+        order = []
+
+        async def request(name):
+            await limiter.acquire()
+            order.append(name)
+            limiter.release(0.01)
+
+        waiting = [asyncio.create_task(request(name)) for name in ("first", "second")]
+        await asyncio.sleep(0.01)
+        assert limiter.status()["queued"] == 2
+        limiter.release(0.01)
+        await asyncio.gather(*waiting)
+        return order, limiter.status()
+
+    order, status = asyncio.run(scenario())
+    assert order == ["first", "second"]
+    assert status["active"] == 0 and status["queued"] == 0
+
+
+def test_requests_beyond_the_queue_or_past_their_deadline_are_rejected():
+    async def scenario():
+        limiter = admission.RouteLimiter("/full", concurrency=1, queue=1, max_wait=0.05)
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(admission.Rejected) as full:
+            await limiter.acquire()
+        with pytest.raises(admission.Rejected) as late:
+            await waiting
+        return full.value, late.value, limiter.status()
+
+    full, late, status = asyncio.run(scenario())
+    assert full.reason == "queue_full" and late.reason == "deadline"
+    assert full.retry_after >= 1
+    # the slot is still held by the first request, nobody is left queued
+    assert status["active"] == 1 and status["queued"] == 0
+
+
+def test_requests_expected_to_wait_over_the_budget_are_rejected_at_once():
+    async def scenario():
+        limiter = admission.RouteLimiter("/busy", concurrency=1, queue=10, max_wait=1.0)
+        await limiter.acquire()
+        limiter.release(3.0)
+        await limiter.acquire()
+        with pytest.raises(admission.Rejected) as rejected:
+            await limiter.acquire()
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == "wait_budget"
+    assert rejected.retry_after == 1
+
+
+def test_a_cancelled_request_gives_back_the_slot_it_was_handed():
+    async def scenario():
+        limiter = admission.RouteLimiter("/gone", concurrency=1, queue=1, max_wait=5.0)
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # the slot is handed over, then the client goes away before the waiter runs
+        limiter.release(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return limiter.status()
+
+    status = asyncio.run(scenario())
+    assert status["active"] == 0 and status["queued"] == 0
@@ -0,0 +1,46 @@
+"""Listings ingested through the journal shared by the worker processes."""
+import multiprocessing
+
+import pandas as pd
+import pytest
+from app.core import data
+
+
+def listings(latitudes: list, price: float = 1.0) -> pd.DataFrame:
+    return pd.DataFrame({"price_per_meter": price, "latitude": latitudes, "longitude": 37.0})
+
+
+def sorted_data() -> pd.DataFrame:
+    return data.get_data().sort_values(data.COLUMNS, ignore_index=True)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    prices = tmp_path / "prices.csv"
+    listings([55.0, 55.0, 56.0]).assign(price_per_meter=[100.0, 200.0, 300.0]).to_csv(prices, index=False)
+    data.load_data(str(prices), str(tmp_path / "journal.csv"))
+    yield str(prices), str(tmp_path / "journal.csv")
+    data.data, data.journal_path = None, None
+
+
+def test_listings_ingested_by_another_process_are_served(journal):
+    def ingest_elsewhere():
+        data.ingest(listings([50.0, 50.1]))
+        data.ingest(listings([55.0], price=150.0), upsert=True)
+
+    worker = multiprocessing.get_context("fork").Process(target=ingest_elsewhere)
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    assert sorted_data()["price_per_meter"].tolist() == [1.0, 1.0, 150.0, 300.0]
+
+
+def test_a_boot_compacts_the_journal_to_the_same_listings(journal):
+    for price in (110.0, 120.0, 130.0):
+        data.ingest(listings([55.0], price=price), upsert=True)
+    data.ingest(listings([55.0], price=140.0))
+    served = sorted_data()
+
+    data.load_data(*journal)
+    assert len(pd.read_csv(journal[1])) == 2
+    assert sorted_data().equals(served)
@@ -0,0 +1,115 @@
+"""The compiled decision tables answer exactly like the row by row evaluators, on the shipped and on random tables."""
+import itertools
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+from app.api import schemas
+from app.core import eligibility
+
+FACILITY_TABLE = "../data/facility.xlsx"
+LAND_TABLE = "../data/land.xlsx"
+
+
+def _as_records(rows) -> list[dict]:
+    return [{key: None if pd.isna(value) else value for key, value in dict(row).items()} for row in rows]
+
+
+def _random_bound(rng: random.Random, choices: list[float]) -> float:
+    return rng.choice(choices) if rng.random() < 0.7 else np.nan
+
+
+def random_facility_table(rng: random.Random, rows: int) -> pd.DataFrame:
+    areas = [15.0, 20.0, 50.0, 80.0, 100.0, 150.0, 400.0]
+    records = []
+    for index in range(rows):
+        record = {column: None for column in eligibility.facility_column_mapping.values()}
+        record.update(chain=f"chain {index}", category=rng.choice(["Аптеки", "Кофейни"]))
+        record.update(
+            min_area=_random_bound(rng, areas),
+            max_area=_random_bound(rng, areas),
+            min_floor=_random_bound(rng, [0.0, 1.0, 2.0]),
+            max_floor=_random_bound(rng, [0.0, 1.0, 2.0, 5.0]),
+            min_ceiling_height=_random_bound(rng, [2.0, 3.0, 4.0]),
+        )
+        for column in eligibility.facility_flags.values():
+            record[column] = rng.choice([True, False, None, None])
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def random_land_table(rng: random.Random, rows: int) -> pd.DataFrame:
+    records = []
+    for index in range(rows):
+        record = {column: None for column in eligibility.land_column_mapping.values()}
+        record.update(
+            chain=f"chain {index}",
+            category="Супермаркеты",
+            min_area=_random_bound(rng, [500.0, 900.0, 3000.0]),
+            max_area=_random_bound(rng, [3000.0, 15000.0]),
+        )
+        for column in eligibility.land_flags.values():
+            record[column] = rng.choice([True, False, None, None])
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def random_facility_request(rng: random.Random) -> schemas.FacilityEligibilityRequest:
+    return schemas.FacilityEligibilityRequest(
+        total_area=rng.choice([1, 15, 20, 49, 50, 51, 80, 100, 150, 399, 400, 401, 1000]),
+        floor=rng.randint(0, 6),
+        ceiling_height=rng.randint(0, 5),
+        high_pedestrian_traffic=rng.random() < 0.5,
+        expected_visitors=rng.random() < 0.5,
+        **{field: rng.random() < 0.5 for field in eligibility.facility_flags},
+    )
+
+
+def random_land_request(rng: random.Random) -> schemas.LandEligibilityRequest:
+    return schemas.LandEligibilityRequest(
+        total_area=rng.choice([0, 499, 500, 501, 900, 2999, 3000, 3001, 20000]),
+        **{field: rng.random() < 0.5 for field in eligibility.land_flags},
+    )
+
+
+@pytest.fixture
+def tables():
+    facility, land = eligibility.facility_eligibility_table, eligibility.land_eligibility_table
+    yield
+    eligibility.facility_eligibility_table, eligibility.land_eligibility_table = facility, land
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_facility_decision_table_matches_rows(tables, seed):
+    rng = random.Random(seed)
+    eligibility.facility_eligibility_table = random_facility_table(rng, rng.randint(0, 40))
+    for _ in range(200):
+        request = random_facility_request(rng)
+        compiled = eligibility.get_facility_decision_table().eligible(request)
+        assert compiled == _as_records(eligibility.evaluate_facility_rows(request))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_land_decision_table_matches_rows(tables, seed):
+    rng = random.Random(seed)
+    eligibility.land_eligibility_table = random_land_table(rng, rng.randint(0, 20))
+    for _ in range(200):
+        request = random_land_request(rng)
+        compiled = eligibility.get_land_decision_table().eligible(request)
+        assert compiled == _as_records(eligibility.evaluate_land_rows(request))
+
+
+def test_shipped_tables_every_flag_combination(tables):
+    import os
+
+    here = os.path.dirname(__file__)
+    eligibility.load_facility_table(os.path.join(here, FACILITY_TABLE))
+    eligibility.load_land_table(os.path.join(here, LAND_TABLE))
+    rng = random.Random(0)
+    for flags in itertools.product([False, True], repeat=len(eligibility.facility_flags)):
+        request = random_facility_request(rng).copy(update=dict(zip(eligibility.facility_flags, flags)))
+        assert eligibility.check_eligibility_facility(request) == _as_records(eligibility.evaluate_facility_rows(request))
+    for flags in itertools.product([False, True], repeat=len(eligibility.land_flags)):
+        request = random_land_request(rng).copy(update=dict(zip(eligibility.land_flags, flags)))
+        assert eligibility.check_eligibility_land(request) == _as_records(eligibility.evaluate_land_rows(request))
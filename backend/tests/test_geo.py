@@ -0,0 +1,78 @@
+"""Nearest stations, okrug lookups and prepared polygons of app.core.geo against brute force."""
+import numpy as np
+import pandas as pd
+import pytest
+from app.core import geo
+
+
+def random_ring(rng: np.random.Generator, center: tuple, radius: float, vertices: int, simple: bool) -> list:
+    """A closed ring of (longitude, latitude) vertices; without `simple`, the vertex order makes its edges cross."""
+    angles = rng.uniform(0, 2 * np.pi, vertices)
+    if simple:
+        angles = np.sort(angles)
+    radii = rng.uniform(0.3, 1.0, vertices) * radius
+    ring = np.column_stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)])
+    return [*ring.tolist(), ring[0].tolist()]
+
+
+def random_points(rng: np.random.Generator, rings: list, count: int) -> tuple[np.ndarray, np.ndarray]:
+    """Points spread over the rings and their surroundings, with some right next to the vertices."""
+    vertices = np.vstack([np.asarray(ring) for ring in rings])
+    low, high = vertices.min(axis=0) - 0.05, vertices.max(axis=0) + 0.05
+    spread = rng.uniform(low, high, (count, 2))
+    near = vertices[rng.integers(len(vertices), size=count // 4)] + rng.normal(0, 1e-4, (count // 4, 2))
+    points = np.vstack([spread, near])
+    return points[:, 1], points[:, 0]
+
+
+@pytest.mark.parametrize("simple", [True, False])
+def test_okrugs_match_ray_casting_every_boundary(simple):
+    rng = np.random.default_rng(41)
+    centers = [(37.4, 55.6), (37.7, 55.6), (37.55, 55.85)]
+    rings = [random_ring(rng, center, 0.15, 12, simple) for center in centers]
+    features = [
+        {"properties": {"name": f"okrug {position}"}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+        for position, ring in enumerate(rings)
+    ]
+    okrugs = geo.Okrugs(features, cell_degrees=0.01)
+    latitudes, longitudes = random_points(rng, rings, 20000)
+
+    expected = np.full(len(latitudes), None, dtype=object)
+    for ring, name in zip(reversed(rings), reversed(okrugs.names)):
+        # the first okrug containing a point names it
+        inside = geo._inside(geo.ring_edges([ring]), longitudes, latitudes)
+        expected[inside] = name
+    assert (okrugs.containing(latitudes, longitudes) == expected).all()
+
+
+@pytest.mark.parametrize("simple", [True, False])
+def test_prepared_polygons_match_ray_casting_every_edge(simple):
+    rng = np.random.default_rng(44)
+    # two parts, the first with a hole, under the even-odd rule
+    rings = [
+        random_ring(rng, (37.6, 55.75), 0.2, 40, simple),
+        random_ring(rng, (37.6, 55.75), 0.05, 8, simple),
+        random_ring(rng, (37.95, 55.75), 0.1, 15, simple),
+    ]
+    edges = geo.ring_edges(rings)
+    latitudes, longitudes = random_points(rng, rings, 20000)
+    expected = geo._inside(edges, longitudes, latitudes)
+    for cells in (1, 16, geo.POLYGON_GRID_CELLS):
+        assert (geo.PreparedPolygon(edges, cells=cells).contains(latitudes, longitudes) == expected).all()
+
+
+def test_nearest_stations_count_an_interchange_once():
+    stations = geo.Stations(pd.DataFrame({
+        "name": ["Киевская", "Киевская", "Киевская", "Смоленская", "Парк культуры"],
+        "latitude": [55.7431, 55.7436, 55.7441, 55.7491, 55.7355],
+        "longitude": [37.5655, 37.5660, 37.5665, 37.5822, 37.5933],
+    }))
+    names, distances = stations.nearest([55.7432, 55.7480], [37.5650, 37.5800], k=3)
+    assert names.tolist() == [
+        ["Киевская", "Смоленская", "Парк культуры"],
+        ["Смоленская", "Киевская", "Парк культуры"],
+    ]
+    assert (np.diff(distances, axis=1) >= 0).all()
+    # asking for more stations than there are names returns every name once
+    names, _ = stations.nearest(55.7432, 37.5650, k=5)
+    assert sorted(names[0]) == ["Киевская", "Парк культуры", "Смоленская"]
@@ -0,0 +1,48 @@
+"""The bounded write-behind buffer of the prediction history."""
+import json
+import sys
+import types
+
+import pytest
+from app.core import history
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    batches = []
+    database = types.SimpleNamespace(insert_predictions=lambda records: batches.append(records) or len(records))
+    monkeypatch.setitem(sys.modules, "app.db.predictions", database)
+    monkeypatch.setattr(history, "max_records", 3)
+    monkeypatch.setattr(history, "batch_size", 2)
+    return batches
+
+
+def records(count: int) -> list[dict]:
+    return [{"inputs": {"area": 50 + index}, "predicted_price_per_sqm": 1.0} for index in range(count)]
+
+
+def test_records_over_the_bound_are_dropped_and_counted(inserted):
+    buffer = history.HistoryBuffer()
+    before = history.dropped.value("buffer_full")
+    buffer.add(records(2))
+    buffer.add(records(2))
+    assert len(buffer.records) == 3
+    assert history.dropped.value("buffer_full") == before + 1
+
+
+def test_a_flush_writes_the_buffered_records_with_their_inputs_as_json(inserted):
+    buffer = history.HistoryBuffer()
+    buffer.add(records(2))
+    assert buffer.flush() == 2
+    assert buffer.records == []
+    assert [json.loads(record["inputs"]) for record in inserted[0]] == [{"area": 50}, {"area": 51}]
+    assert buffer.flush() == 0
+
+
+def test_stopping_writes_the_remaining_records(inserted, monkeypatch):
+    monkeypatch.setattr(history, "flush_interval", 60.0)
+    buffer = history.HistoryBuffer()
+    buffer.start()
+    buffer.add(records(1))
+    buffer.stop(timeout=5)
+    assert sum(len(batch) for batch in inserted) == 1
@@ -0,0 +1,47 @@
+"""Sampling, payload truncation and structured output of the logging set up by app.core.log."""
+import json
+import logging
+import queue
+
+from app.core import log
+
+
+def record(name: str, level: int, message: str, *args, **extra) -> logging.LogRecord:
+    entry = logging.LogRecord(name, level, __file__, 1, message, args, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_records_below_warning_are_sampled_at_the_rate_of_the_closest_logger():
+    sampling = log.SamplingFilter({"app.api.routes": 0.0, "app.api.routes.users": 1.0})
+    assert sampling.rate("app.api.routes.model") == 0.0
+    assert sampling.rate("app.api.routes.users") == 1.0
+    assert sampling.rate("app.core.data") == 1.0
+    assert not sampling.filter(record("app.api.routes.model", logging.INFO, "prediction"))
+    assert sampling.filter(record("app.api.routes.model", logging.WARNING, "slow prediction"))
+
+
+def test_payloads_are_rendered_when_formatted_and_cut_to_the_limit():
+    rendered = []
+    payload = log.Payload(log.Lazy(lambda: rendered.append(1) or "x" * 50), limit=10)
+    entry = record("app.test", logging.DEBUG, "request: %s", payload)
+    assert rendered == []
+    assert entry.getMessage() == "request: xxxxxxxxxx... (50 characters)"
+    assert rendered == [1]
+
+
+def test_json_records_carry_their_extra_fields():
+    line = log.JsonFormatter().format(record("app.test", logging.INFO, "scored %d rows", 5, city="Москва"))
+    assert json.loads(line) == {
+        "time": json.loads(line)["time"], "level": "INFO", "logger": "app.test", "message": "scored 5 rows",
+        "city": "Москва",
+    }
+
+
+def test_records_are_dropped_when_the_queue_is_full():
+    handler = log.QueueHandler(queue.Queue(1))
+    before = log.dropped.value()
+    handler.handle(record("app.test", logging.INFO, "first"))
+    handler.handle(record("app.test", logging.INFO, "second"))
+    assert handler.queue.qsize() == 1
+    assert log.dropped.value() == before + 1
@@ -0,0 +1,88 @@
+"""Merging the Excel criteria tables with `service.eligibility` of config.yaml."""
+import os
+
+import pytest
+from app.core import eligibility, rules
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+FACILITY_TABLE = os.path.join(DATA_DIR, "facility.xlsx")
+LAND_TABLE = os.path.join(DATA_DIR, "land.xlsx")
+
+ENTRIES = {
+    "building": [
+        {"name": "Алкомаркеты", "group": True, "min_area": 60.0, "max_area": 400.0, "floors": 1},
+        {"name": "Красное и белое", "min_area": 80.0, "max_area": 400.0, "floors": 1},
+        {"name": "Бристоль", "min_area": 90.0, "max_area": 400.0, "floors": 1},
+        {"name": "Дарксторы", "group": True},
+        {"name": "Самокат", "min_area": 200.0, "max_area": 1000.0, "floors": [0, 1, 2]},
+    ],
+    "land": [{"name": "Магнит - косметик", "min_area": 480.0, "max_area": 2000.0, "rent": True, "sell": True}],
+}
+
+
+@pytest.fixture
+def rule_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(rules, "cache_dir", str(tmp_path))
+    facility, land = eligibility.facility_eligibility_table, eligibility.land_eligibility_table
+    yield tmp_path
+    eligibility.facility_eligibility_table, eligibility.land_eligibility_table = facility, land
+
+
+def test_merge_keeps_table_rows_and_adds_config_chains(rule_cache):
+    table = eligibility.read_eligibility_table(FACILITY_TABLE, eligibility.facility_column_mapping)
+    compiled = rules.load_rules(FACILITY_TABLE, LAND_TABLE, ENTRIES)
+
+    # a misspelt name matches its table chain, the chain missing from the table is reported but not served
+    assert [record["chain"] for record in compiled.facility.records] == table["chain"].tolist()
+    assert compiled.conflicts == ["Бристоль: min_area is 80.0 in facility.xlsx, 90.0 in config.yaml service.eligibility.building"]
+    assert compiled.status()["config_only_chains"] == {"facility": ["Самокат"], "land": []}
+    assert len(compiled.land.records) == len(eligibility.read_eligibility_table(LAND_TABLE, eligibility.land_column_mapping))
+
+
+def test_config_only_chains_are_served_under_their_group_when_enabled(rule_cache, monkeypatch):
+    monkeypatch.setattr(rules, "serve_config_only_chains", True)
+    table = eligibility.read_eligibility_table(FACILITY_TABLE, eligibility.facility_column_mapping)
+    compiled = rules.load_rules(FACILITY_TABLE, LAND_TABLE, ENTRIES)
+
+    assert [record["chain"] for record in compiled.facility.records][len(table):] == ["Самокат"]
+    added = compiled.facility.records[-1]
+    assert (added["category"], added["min_floor"], added["max_floor"]) == ("Дарксторы", 0, 2)
+
+
+def test_unchanged_sources_are_read_from_the_cache(rule_cache):
+    first = rules.load_rules(FACILITY_TABLE, LAND_TABLE, ENTRIES)
+    second = rules.load_rules(FACILITY_TABLE, LAND_TABLE, ENTRIES)
+    assert (first.from_cache, second.from_cache) == (False, True)
+    assert second.key == first.key
+    assert second.facility.records == first.facility.records
+
+
+def test_reload_swaps_only_changed_and_valid_rules(rule_cache):
+    loaded = rules.load_rules(FACILITY_TABLE, LAND_TABLE, ENTRIES)
+    assert rules.reload() == (loaded, False)
+
+    changed = {**ENTRIES, "building": ENTRIES["building"] + [{"name": "Новая сеть", "min_area": 10.0}]}
+    reloaded, swapped = rules.reload(changed)
+    assert swapped and reloaded.key != loaded.key
+    assert eligibility.get_facility_decision_table() is reloaded.facility
+
+    invalid = {**ENTRIES, "building": [{"name": "Сеть", "min_area": 30.0, "max_area": 20.0}]}
+    with pytest.raises(ValueError, match="min_area 30.0 above max_area 20.0"):
+        rules.reload(invalid)
+    assert rules.rule_set is reloaded
+
+
+def test_group_criteria_apply_to_the_chains_that_leave_them_unset():
+    entries = [
+        {"name": "Кофейни", "group": True, "min_area": 15.0, "max_area": 150.0, "floors": 1},
+        {"name": "Кофейня", "min_area": None, "max_area": 50.0},
+    ]
+    rule = rules.config_rules(entries, "config")[0]
+    assert (rule.category, rule.min_area, rule.max_area, rule.min_floor, rule.max_floor) == ("Кофейни", 15.0, 50.0, 1, 1)
+    repeated = rules.config_rules(entries + [{"name": "Пекарни", "group": True}, {"name": "кофейня"}], "config")
+    assert rules.duplicates(repeated) == ["кофейня is listed under Кофейни and Пекарни in config"]
+
+
+def test_floors_must_be_consecutive():
+    with pytest.raises(ValueError, match="not consecutive"):
+        rules.config_rules([{"name": "Сеть", "floors": [0, 2]}], "config")
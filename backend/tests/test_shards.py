@@ -0,0 +1,53 @@
+"""Loading city shards on first use and dropping the least recently used ones under the memory budget."""
+import pandas as pd
+import pytest
+from app.core import data, shards
+
+
+@pytest.fixture
+def cities(tmp_path, monkeypatch):
+    configs = {}
+    for index, city in enumerate(["Санкт-Петербург", "Казань", "Самара"]):
+        path = tmp_path / f"{index}.csv"
+        pd.DataFrame({
+            "price_per_meter": [100_000.0 * (index + 1)] * 3,
+            "latitude": [56.0 + index, 55.0 + index, 57.0 + index],
+            "longitude": [40.0 + index] * 3,
+        }).to_csv(path, index=False)
+        configs[city] = {"center": [55.0 + index, 40.0 + index], "prices": str(path)}
+    monkeypatch.setattr(shards, "manager", None)
+    return configs
+
+
+def test_cities_without_a_shard_are_served_by_the_default_city(cities):
+    shards.configure({"default": "Москва", "shards": cities})
+    assert shards.shard_for("Химки") is None
+    assert shards.shard_for(None) is None
+    assert shards.served_city("Химки") == "Москва"
+    assert shards.served_city("санкт-петербург") == "Санкт-Петербург"
+
+
+def test_shards_are_loaded_once_and_sorted_by_latitude(cities):
+    shards.configure({"shards": cities})
+    shard = shards.shard_for("Казань")
+    assert shard is shards.shard_for(" казань ")
+    assert shard.center == (56.0, 41.0)
+    assert shard.prices["latitude"].is_monotonic_increasing
+    assert data.get_data("Казань") is shard.prices
+
+
+def test_least_recently_used_shards_are_dropped_over_the_budget(cities):
+    shards.configure({"shards": cities})
+    first = shards.shard_for("Санкт-Петербург")
+    # room for two shards
+    shards.manager.budget = int(first.nbytes * 2.5)
+    shards.shard_for("Казань")
+    shards.shard_for("Санкт-Петербург")
+    shards.shard_for("Самара")
+
+    loaded = [shard["city"] for shard in shards.status()["loaded"]]
+    assert loaded == ["Санкт-Петербург", "Самара"]
+    assert shards.manager.evictions == 1
+    # a dropped shard is loaded again
+    assert shards.shard_for("Казань") is not None
+    assert [shard["city"] for shard in shards.status()["loaded"]] == ["Самара", "Казань"]
@@ -71,7 +71,7 @@ def predict_user_input(*user_input_values):
         "model": user_input["model"]
     }
 
-    # TODO: request the closest metro station if not provided
+    # TODO: leave the station to the backend (app.core.geo) once resources.metro_stations ships with the service
     if not request_data["metro"]:
         request_data["metro"] = "Полянка"
 